@@ -0,0 +1,279 @@
+"""
+Response cache and persisted queries for the /graphql endpoint.
+
+Query results are cached per normalized query, operation, variables and
+viewer. The key also contains the current :py:class:`stocks.models.DataVersion`
+counters, so every quote ingestion, trade, bucket edit, bank sync or mutation
+makes the cached results unreachable without having to find and delete them.
+
+Parsed and validated documents are kept per process, so operations that were
+seen before skip parsing and validation. Clients can send the sha256 hash of
+a query instead of its text (the automatic persisted query protocol): unknown
+hashes answer with ``PersistedQueryNotFound`` and the client retries with the
+text, which is then stored under its hash.
+
+Operations are priced before execution (see :py:mod:`BuyBitcoin.graphql_cost`).
+Cached results aren't charged to the viewer's budget.
+"""
+from collections import OrderedDict, namedtuple
+import hashlib
+import json
+import threading
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed
+from graphene_django.views import GraphQLView, HttpError
+from graphql import GraphQLError, Source, parse, print_ast, validate
+from graphql.execution import ExecutionResult
+from graphql.utils.get_operation_ast import get_operation_ast
+from BuyBitcoin.graphql_cost import charge, query_cost, viewer_key
+from BuyBitcoin.graphql_executor import PooledExecutor, ResolverPool
+from stocks.async_execution import execute_async
+from stocks.models import DataVersion
+
+ParsedQuery = namedtuple(
+    "ParsedQuery",
+    ["document", "normalized", "errors"],
+)
+
+
+class DocumentCache(object):
+    """
+    Keeps the parsed and validated documents of the most recent size query
+    texts
+    """
+    def __init__(self, size=500):
+        self.size = size
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, schema, query):
+        """
+        Returns the ParsedQuery for query, parsing and validating it only if
+        it wasn't seen recently
+        """
+        with self._lock:
+            if query in self._documents:
+                self._documents.move_to_end(query)
+                return self._documents[query]
+        try:
+            document = parse(Source(query, name='GraphQL request'))
+            parsed = ParsedQuery(
+                document, print_ast(document), validate(schema, document))
+        except Exception as ex:  # pylint: disable=broad-except
+            parsed = ParsedQuery(None, None, [ex])
+        with self._lock:
+            self._documents[query] = parsed
+            while len(self._documents) > self.size:
+                self._documents.popitem(last=False)
+        return parsed
+
+    def clear(self):
+        """
+        Forgets all documents
+        """
+        with self._lock:
+            self._documents.clear()
+
+
+DOCUMENTS = DocumentCache(settings.GRAPHQL_DOCUMENT_CACHE_SIZE)
+
+
+def query_hash(query):
+    """
+    sha256 hex digest of a query text, as used by persisted queries
+    """
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+class CachedGraphQLView(GraphQLView):
+    """
+    GraphQLView with persisted queries, a document cache and a response
+    cache. The X-GraphQL-Cache header tells whether a response was served
+    from the cache.
+    """
+    def dispatch(self, request, *args, **kwargs):
+        response = super(CachedGraphQLView, self).dispatch(request, *args, **kwargs)
+        if hasattr(request, 'graphql_cache'):
+            response['X-GraphQL-Cache'] = request.graphql_cache
+        if hasattr(request, 'graphql_budget'):
+            (remaining, reset_in) = request.graphql_budget
+            response['X-GraphQL-Cost-Remaining'] = remaining
+            response['X-GraphQL-Cost-Reset'] = reset_in
+            if response.status_code == 429:
+                response['Retry-After'] = reset_in
+        return response
+
+    def json_encode(self, request, d, pretty=False):
+        """
+        Adds the cost of the operation to the extensions of the response
+        """
+        cost = getattr(request, 'graphql_cost', None)
+        if cost is not None and isinstance(d, dict):
+            d = dict(d, extensions={'cost': {
+                'requestedQueryCost': cost,
+                'maximumAvailable': settings.GRAPHQL_MAX_COST,
+            }})
+        return super(CachedGraphQLView, self).json_encode(request, d, pretty)
+
+    def rejection(self, request, message, status_code):
+        """
+        Response for an operation that isn't executed
+        """
+        return (self.json_encode(request, {
+            'errors': [self.format_error(GraphQLError(message))],
+        }), status_code)
+
+    def get_graphql_params(self, request, data):
+        (query, variables, operation_name, request_id) = super(
+            CachedGraphQLView, self).get_graphql_params(request, data)
+        extensions = request.GET.get('extensions') or data.get('extensions') or {}
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest('Extensions are invalid JSON.'))
+        persisted = extensions.get('persistedQuery')
+        if not persisted:
+            return (query, variables, operation_name, request_id)
+        digest = persisted.get('sha256Hash')
+        store = caches[settings.GRAPHQL_CACHE]
+        if query:
+            if query_hash(query) != digest:
+                raise HttpError(HttpResponseBadRequest(
+                    'provided sha does not match query'))
+            store.set('graphql:persisted:' + digest, query, None)
+        else:
+            query = store.get('graphql:persisted:' + digest)
+            if query is None:
+                raise HttpError(HttpResponse(status=200), 'PersistedQueryNotFound')
+        return (query, variables, operation_name, request_id)
+
+    def get_response(self, request, data, show_graphiql=False):
+        (query, variables, operation_name, _) = self.get_graphql_params(request, data)
+        parsed = DOCUMENTS.get(self.schema, query) if query else None
+        operation = None
+        if parsed is not None and parsed.document is not None:
+            operation = get_operation_ast(parsed.document, operation_name)
+        rejected = self.price(request, parsed, operation, variables)
+        if rejected is not None:
+            return rejected
+        key = None
+        if (not show_graphiql and not self.batch and operation is not None and
+                operation.operation == 'query' and not parsed.errors):
+            key = self.cache_key(request, parsed, variables, operation_name)
+            result = caches[settings.GRAPHQL_CACHE].get(key)
+            request.graphql_cache = 'hit' if result is not None else 'miss'
+            if result is not None:
+                return (result, 200)
+        rejected = self.charge_budget(request)
+        if rejected is not None:
+            return rejected
+        (result, status_code) = super(CachedGraphQLView, self).get_response(
+            request, data, show_graphiql)
+        if operation is not None and operation.operation == 'mutation':
+            DataVersion.bump(DataVersion.MUTATIONS)
+        if key is not None and getattr(request, 'graphql_cacheable', False):
+            caches[settings.GRAPHQL_CACHE].set(key, result, settings.GRAPHQL_CACHE_TTL)
+        return (result, status_code)
+
+    def price(self, request, parsed, operation, variables):
+        """
+        Stores the cost of a valid operation on the request
+
+        :returns: the rejection if the cost is above GRAPHQL_MAX_COST, else None
+        """
+        if operation is None or parsed.errors:
+            return None
+        request.graphql_cost = query_cost(self.schema, parsed.document, operation, variables)
+        if request.graphql_cost <= settings.GRAPHQL_MAX_COST:
+            return None
+        return self.rejection(request, 'Query cost {} exceeds the maximum of {}'.format(
+            request.graphql_cost, settings.GRAPHQL_MAX_COST), 400)
+
+    def charge_budget(self, request):
+        """
+        Charges the cost of the operation to the budget of the viewer
+
+        :returns: the rejection if the budget is used up, else None
+        """
+        if getattr(request, 'graphql_cost', None) is None:
+            return None
+        (allowed, remaining, reset_in) = charge(viewer_key(request), request.graphql_cost)
+        request.graphql_budget = (remaining, reset_in)
+        if allowed:
+            return None
+        return self.rejection(request, 'Query cost {} exceeds the remaining budget of '
+                              '{}, retry in {}s'.format(
+                                  request.graphql_cost, remaining, reset_in), 429)
+
+    @staticmethod
+    def cache_key(request, parsed, variables, operation_name):
+        """
+        Key of a query result: normalized query, operation, variables, viewer
+        and the current data versions
+        """
+        viewer = request.user.id if request.user.is_authenticated else None
+        return 'graphql:response:' + hashlib.sha256(json.dumps(
+            [parsed.normalized, operation_name, variables or {}, viewer,
+             DataVersion.current()],
+            sort_keys=True,
+        ).encode('utf-8')).hexdigest()
+
+    def get_executor(self):
+        """
+        Executor for one request. A shared ResolverPool gets a PooledExecutor
+        per request, so requests only wait for their own resolvers.
+        """
+        if isinstance(self.executor, ResolverPool):
+            return PooledExecutor(self.executor)
+        return self.executor
+
+    # pylint: disable=too-many-arguments
+    def execute_graphql_request(self, request, data, query, variables, operation_name,
+                                show_graphiql=False):
+        """
+        Same as GraphQLView.execute_graphql_request, but parsing and
+        validation go through the document cache
+        """
+        if not query:
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseBadRequest('Must provide query string.'))
+        parsed = DOCUMENTS.get(self.schema, query)
+        if parsed.errors:
+            return ExecutionResult(errors=parsed.errors, invalid=True)
+        if request.method.lower() == 'get':
+            operation_ast = get_operation_ast(parsed.document, operation_name)
+            if operation_ast and operation_ast.operation != 'query':
+                if show_graphiql:
+                    return None
+                raise HttpError(HttpResponseNotAllowed(
+                    ['POST'], 'Can only perform a {} operation from a POST request.'.format(
+                        operation_ast.operation)
+                ))
+        try:
+            result = self.execute(
+                parsed.document,
+                root_value=self.get_root_value(request),
+                variable_values=variables,
+                operation_name=operation_name,
+                context_value=self.get_context(request),
+                middleware=self.get_middleware(request),
+                executor=self.get_executor(),
+            )
+        except Exception as ex:  # pylint: disable=broad-except
+            return ExecutionResult(errors=[ex], invalid=True)
+        request.graphql_cacheable = not result.errors and not result.invalid
+        return result
+    # pylint: enable=too-many-arguments
+
+
+class AsyncGraphQLView(CachedGraphQLView):
+    """
+    CachedGraphQLView that executes every request on its own event loop,
+    see :py:mod:`stocks.async_execution`
+    """
+    def execute(self, *args, **kwargs):
+        kwargs.pop('executor', None)
+        return execute_async(self.schema, *args, **kwargs)
@@ -0,0 +1,208 @@
+"""
+Static cost analysis and per-viewer cost budgets for the /graphql endpoint.
+
+Before a query is executed its cost is computed from the document alone.
+Every object a field returns costs one point, leaves are free, and fields
+that return lists or connections multiply the cost of their selection by the
+number of items they are expected to return. That number comes from the
+field's arguments (``first``/``last``, ``count`` or the days between
+``start`` and ``end``), or from an estimate if the arguments don't bound it.
+``maxPoints`` and ``points`` only reduce how many of those items are
+returned, the resolver still loads all of them. They cap the items the
+selection is charged for, never the items themselves.
+
+Queries above ``GRAPHQL_MAX_COST`` are rejected. The cost of every executed
+operation is charged against a budget of ``GRAPHQL_COST_BUDGET`` points per
+viewer and ``GRAPHQL_COST_WINDOW`` seconds, viewers that used up their
+budget are throttled until the window ends. Budgets are kept in the
+``GRAPHQL_CACHE``, which has to be shared by all worker processes (the
+database cache in settings), otherwise every process keeps its own window.
+"""
+import datetime
+import time
+from django.conf import settings
+from django.core.cache import caches
+from graphene_django.settings import graphene_settings
+from graphql.error import GraphQLError
+from graphql.execution.values import get_argument_values
+from graphql.language import ast
+from graphql.type import GraphQLList
+from graphql.type.definition import get_named_type, get_nullable_type, is_leaf_type
+
+# Items returned by list fields whose arguments don't bound them. Missing
+# fields use GRAPHQL_COST_LIST_SIZE, connections the relay page limit.
+LIST_SIZES = {
+    # Without count the last 30 days are returned
+    ('GInvestmentBucket', 'history'): 30,
+}
+# Fields that return a page of compact points instead of a list, with the
+# setting that limits the page size
+PAGED_FIELDS = {
+    ('GStock', 'quoteSeries'): 'QUOTE_SERIES_PAGE_SIZE',
+}
+
+
+def _days(start, end):
+    """
+    Number of days from start to end (both YYYY-MM-DD), None if either
+    can't be parsed
+    """
+    try:
+        start = datetime.datetime.strptime(start, '%Y-%m-%d').date()
+        end = (
+            datetime.datetime.strptime(end, '%Y-%m-%d').date()
+            if end else datetime.date.today()
+        )
+    except (TypeError, ValueError):
+        return None
+    return max((end - start).days + 1, 0)
+
+
+def list_size(parent_type, name, definition, args):
+    """
+    Number of items a field is expected to return, 1 for fields that don't
+    return a list or a connection
+    """
+    is_connection = get_named_type(definition.type).name.endswith('Connection')
+    paged = PAGED_FIELDS.get((parent_type.name, name))
+    if not (is_connection or paged or
+            isinstance(get_nullable_type(definition.type), GraphQLList)):
+        return 1
+    if parent_type.name.endswith('Connection'):
+        # The edges were already counted on the connection field
+        return 1
+    limit = None
+    if is_connection:
+        limit = graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+    elif paged:
+        limit = getattr(settings, paged)
+    sizes = [
+        max(int(args[key]), 0)
+        for key in ('first', 'last', 'count')
+        if args.get(key) is not None
+    ]
+    if args.get('start') is not None:
+        days = _days(args['start'], args.get('end'))
+        if days is not None:
+            sizes.append(days)
+    if (parent_type.name, name) in LIST_SIZES and not any(
+            args.get(key) is not None for key in ('first', 'last', 'count')):
+        sizes.append(LIST_SIZES[(parent_type.name, name)])
+    if limit:
+        sizes.append(limit)
+    return min(sizes) if sizes else settings.GRAPHQL_COST_LIST_SIZE
+
+
+class _CostAnalysis(object):
+    """
+    Walks the selections of one operation
+    """
+    def __init__(self, schema, document, variables):
+        self.schema = schema
+        self.variables = variables or {}
+        self.fragments = {
+            definition.name.value: definition
+            for definition in document.definitions
+            if isinstance(definition, ast.FragmentDefinition)
+        }
+
+    def selections(self, parent_type, selection_set, spread=frozenset()):
+        """
+        Cost of a selection set on parent_type
+        """
+        total = 0
+        for selection in selection_set.selections:
+            if isinstance(selection, ast.Field):
+                total += self.field(parent_type, selection, spread)
+            elif isinstance(selection, ast.InlineFragment):
+                fragment_type = parent_type
+                if selection.type_condition is not None:
+                    fragment_type = self.schema.get_type(selection.type_condition.name.value)
+                total += self.selections(fragment_type, selection.selection_set, spread)
+            elif isinstance(selection, ast.FragmentSpread):
+                name = selection.name.value
+                fragment = self.fragments.get(name)
+                if fragment is None or name in spread:
+                    continue
+                total += self.selections(
+                    self.schema.get_type(fragment.type_condition.name.value),
+                    fragment.selection_set, spread | {name})
+        return total
+
+    def field(self, parent_type, field, spread):
+        """
+        Cost of a field: its own point times the items it loads plus its
+        selection times the items it returns
+        """
+        name = field.name.value
+        definition = getattr(parent_type, 'fields', {}).get(name)
+        if name.startswith('__') or definition is None:
+            return 0
+        try:
+            args = get_argument_values(definition.args, field.arguments, self.variables)
+        except GraphQLError:
+            args = {}
+        named_type = get_named_type(definition.type)
+        cost = 0 if is_leaf_type(named_type) else 1
+        children = 0
+        if field.selection_set is not None:
+            children = self.selections(named_type, field.selection_set, spread)
+        size = list_size(parent_type, name, definition, args)
+        returned = size
+        for key in ('max_points', 'points'):
+            if args.get(key) is not None:
+                returned = min(returned, max(int(args[key]), 0))
+        return size * cost + returned * children
+
+
+def query_cost(schema, document, operation, variables=None):
+    """
+    Static cost of executing operation (an OperationDefinition of document)
+
+    :returns: int
+    """
+    root = {
+        'query': schema.get_query_type,
+        'mutation': schema.get_mutation_type,
+        'subscription': schema.get_subscription_type,
+    }[operation.operation]()
+    if root is None:
+        return 0
+    return _CostAnalysis(schema, document, variables).selections(root, operation.selection_set)
+
+
+def viewer_key(request):
+    """
+    Identifies the viewer a cost is charged to
+    """
+    if request.user.is_authenticated:
+        return 'user:{}'.format(request.user.id)
+    return 'anonymous:{}'.format(request.META.get('REMOTE_ADDR', ''))
+
+
+def charge(viewer, cost):
+    """
+    Charges cost to the budget of viewer in the current window. A charge
+    that doesn't fit into the remaining budget isn't taken.
+
+    :returns: (allowed, remaining points, seconds until the window ends)
+    """
+    window = settings.GRAPHQL_COST_WINDOW
+    now = time.time()
+    key = 'graphql:cost:{}:{}'.format(viewer, int(now // window))
+    reset_in = int(window - now % window) + 1
+    store = caches[settings.GRAPHQL_CACHE]
+    store.add(key, 0, window + 1)
+    try:
+        spent = store.incr(key, cost)
+    except ValueError:
+        # The window expired between add and incr
+        store.set(key, cost, window + 1)
+        spent = cost
+    if spent > settings.GRAPHQL_COST_BUDGET:
+        try:
+            store.decr(key, cost)
+        except ValueError:
+            pass
+        return (False, max(settings.GRAPHQL_COST_BUDGET - spent + cost, 0), reset_in)
+    return (True, settings.GRAPHQL_COST_BUDGET - spent, reset_in)
@@ -0,0 +1,217 @@
+"""
+Bounded executor for GraphQL resolvers.
+
+All requests of a process share one :py:class:`ResolverPool`: a fixed number
+of worker threads and a bounded queue in front of them. When the queue is
+full the resolver runs in the thread that asked for it, which slows down the
+request that is producing work instead of piling up threads. Every worker
+keeps its own database connection, so the pool also bounds the connections a
+process opens for resolvers.
+
+The pool records the wall time of every resolver, how long resolvers waited
+in the queue and how many workers hold a database connection. The numbers
+are served as JSON on /graphql/stats for staff users.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait
+import os
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.http import HttpResponseForbidden, JsonResponse
+from graphql.execution.executors.utils import process
+from promise import Promise
+
+
+class Timing(object):
+    """
+    Count, total and maximum of a series of durations in seconds
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        """
+        Records one duration
+        """
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self):
+        """
+        Summary in milliseconds
+        """
+        return {
+            'count': self.count,
+            'total_ms': self.total * 1000,
+            'mean_ms': self.total * 1000 / self.count if self.count else 0.0,
+            'max_ms': self.max * 1000,
+        }
+
+
+# pylint: disable=too-many-instance-attributes
+class ResolverPool(object):
+    """
+    Worker threads shared by all GraphQL requests of a process
+
+    :param workers: Number of worker threads.
+    :param queue_depth: Resolvers that may wait for a worker. Further
+        resolvers run in the calling thread.
+    """
+    def __init__(self, workers=8, queue_depth=64):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='graphql')
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.inline = 0
+        self.pending = 0
+        self.busy = 0
+        self.peak_pending = 0
+        self.queue_wait = Timing()
+        self.resolvers = {}
+        self._connections = set()
+
+    def reset(self):
+        """
+        Forgets all recorded metrics
+        """
+        with self._lock:
+            self.submitted = 0
+            self.inline = 0
+            self.pending = 0
+            self.busy = 0
+            self.peak_pending = 0
+            self.queue_wait = Timing()
+            self.resolvers = {}
+            self._connections = set()
+
+    # pylint: disable=too-many-arguments
+    def submit(self, name, promise, resolver, args, kwargs):
+        """
+        Resolves promise with resolver(*args, **kwargs) on a worker
+
+        :returns: concurrent.futures.Future, or None if the queue was full and
+            the resolver ran in the calling thread
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.inline += 1
+            self._run(name, promise, resolver, args, kwargs)
+            return None
+        with self._lock:
+            self.submitted += 1
+            self.pending += 1
+            self.peak_pending = max(self.peak_pending, self.pending)
+        try:
+            return self._pool.submit(
+                self._work, time.monotonic(), name, promise, resolver, args, kwargs)
+        except RuntimeError:
+            self._slots.release()
+            raise
+
+    def _work(self, queued, name, promise, resolver, args, kwargs):
+        with self._lock:
+            self.queue_wait.add(time.monotonic() - queued)
+            self.pending -= 1
+            self.busy += 1
+        try:
+            close_old_connections()
+            self._run(name, promise, resolver, args, kwargs)
+        finally:
+            with self._lock:
+                self.busy -= 1
+                if connection.connection is None:
+                    self._connections.discard(threading.get_ident())
+                else:
+                    self._connections.add(threading.get_ident())
+            self._slots.release()
+
+    def _run(self, name, promise, resolver, args, kwargs):
+        start = time.monotonic()
+        process(promise, resolver, args, kwargs)
+        seconds = time.monotonic() - start
+        with self._lock:
+            self.resolvers.setdefault(name, Timing()).add(seconds)
+    # pylint: enable=too-many-arguments
+
+    def stats(self):
+        """
+        Snapshot of the pool size, its load and the recorded timings
+        """
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'workers': self.workers,
+                'queue_depth': self.queue_depth,
+                'busy': self.busy,
+                'pending': self.pending,
+                'peak_pending': self.peak_pending,
+                'submitted': self.submitted,
+                'inline': self.inline,
+                'db_connections': len(self._connections),
+                'queue_wait': self.queue_wait.as_dict(),
+                'resolvers': {
+                    name: timing.as_dict() for (name, timing) in self.resolvers.items()
+                },
+            }
+# pylint: enable=too-many-instance-attributes
+
+
+class PooledExecutor(object):
+    """
+    graphql-core executor of a single request that runs its resolvers on a
+    shared :py:class:`ResolverPool`
+    """
+    def __init__(self, pool):
+        self.pool = pool
+        self.futures = []
+        self._lock = threading.Lock()
+
+    def execute(self, resolver, *args, **kwargs):
+        """
+        Schedules resolver and returns a promise for its result
+        """
+        info = args[1]
+        name = '{}.{}'.format(info.parent_type.name, info.field_name)
+        promise = Promise()
+        future = self.pool.submit(name, promise, resolver, args, kwargs)
+        if future is not None:
+            with self._lock:
+                self.futures.append(future)
+        return promise
+
+    def wait_until_finished(self):
+        """
+        Blocks until all resolvers of the request, including the ones they
+        scheduled, have finished
+        """
+        while True:
+            with self._lock:
+                (futures, self.futures) = (self.futures, [])
+            if not futures:
+                return
+            wait(futures)
+
+    def clean(self):
+        """
+        Forgets the scheduled resolvers
+        """
+        with self._lock:
+            self.futures = []
+
+
+POOL = ResolverPool(settings.GRAPHQL_WORKERS, settings.GRAPHQL_QUEUE_DEPTH)
+
+
+def stats(request):
+    """
+    Serves the metrics of the resolver pool of this process to staff users
+    """
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    return JsonResponse(POOL.stats())
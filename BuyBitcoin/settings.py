@@ -114,6 +114,17 @@ if 'TRAVIS' in os.environ:
 else:
     DATABASES['default'].update(dj_database_url.config(conn_max_age=500))
 
+# Cache
+# Stored in the database so every worker process shares the cached GraphQL
+# results and the cost budgets of the viewers (see BuyBitcoin.graphql_cost)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'django_cache',
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
 
@@ -179,6 +190,58 @@ WHITENOISE_ROOT = os.path.join(BASE_DIR, 'assets')
 # GraphQL
 
 GRAPHENE = {'SCHEMA': 'BuyBitcoin.graphene_schema.SCHEMA'}
+# Cache alias and seconds for cached /graphql query results and the number
+# of parsed query documents kept per process
+GRAPHQL_CACHE = os.environ.get('GRAPHQL_CACHE', 'default')
+GRAPHQL_CACHE_TTL = int(os.environ.get('GRAPHQL_CACHE_TTL', 300))
+GRAPHQL_DOCUMENT_CACHE_SIZE = int(os.environ.get('GRAPHQL_DOCUMENT_CACHE_SIZE', 500))
+# Worker threads of the GraphQL resolver pool and how many resolvers may wait
+# for them before they run in the request thread
+GRAPHQL_WORKERS = int(os.environ.get('GRAPHQL_WORKERS', 8))
+GRAPHQL_QUEUE_DEPTH = int(os.environ.get('GRAPHQL_QUEUE_DEPTH', 64))
+# Highest static cost of a single GraphQL operation, the points every viewer
+# may spend per window of seconds and the items assumed for unbounded lists
+GRAPHQL_MAX_COST = int(os.environ.get('GRAPHQL_MAX_COST', 50000))
+GRAPHQL_COST_BUDGET = int(os.environ.get('GRAPHQL_COST_BUDGET', 500000))
+GRAPHQL_COST_WINDOW = int(os.environ.get('GRAPHQL_COST_WINDOW', 60))
+GRAPHQL_COST_LIST_SIZE = int(os.environ.get('GRAPHQL_COST_LIST_SIZE', 20))
+# "thread" runs resolvers on the resolver pool, "asyncio" executes every
+# request on an event loop with blocking resolvers on bounded pools
+GRAPHQL_EXECUTION = os.environ.get('GRAPHQL_EXECUTION', 'thread')
+GRAPHQL_ORM_WORKERS = int(os.environ.get('GRAPHQL_ORM_WORKERS', 8))
+GRAPHQL_IO_WORKERS = int(os.environ.get('GRAPHQL_IO_WORKERS', 16))
+
+# Stock quotes
+# Seconds a stock's quote history stays in the in-process cache. Ingestion
+# invalidates the cache of the ingesting process right away, the others
+# pick up new quotes once their entry expires.
+QUOTE_CACHE_MAX_AGE = int(os.environ.get('QUOTE_CACHE_MAX_AGE', 300))
+# Default and maximum number of points of a page of GStock.quoteSeries
+QUOTE_SERIES_PAGE_SIZE = int(os.environ.get('QUOTE_SERIES_PAGE_SIZE', 2000))
+# Concurrent downloads, requests per second to the quote provider and
+# retries per ticker when filling missing quotes
+FILL_WORKERS = int(os.environ.get('FILL_WORKERS', 8))
+FILL_RATE_PER_HOST = float(os.environ.get('FILL_RATE_PER_HOST', 5))
+FILL_RETRIES = int(os.environ.get('FILL_RETRIES', 3))
+# Tasks a fill worker leases at once, how long the lease lasts and how often
+# a failing ticker is handed out again before it is given up
+FILL_BATCH_SIZE = int(os.environ.get('FILL_BATCH_SIZE', 32))
+FILL_LEASE_SECONDS = int(os.environ.get('FILL_LEASE_SECONDS', 600))
+FILL_MAX_ATTEMPTS = int(os.environ.get('FILL_MAX_ATTEMPTS', 3))
+# Seconds a ticker validation is cached, unknown tickers are checked again
+# sooner in case they were just listed
+TICKER_VALID_TTL = int(os.environ.get('TICKER_VALID_TTL', 7 * 24 * 3600))
+TICKER_INVALID_TTL = int(os.environ.get('TICKER_INVALID_TTL', 24 * 3600))
+
+# Bank balances
+# Seconds a synced Plaid balance is used before trades sync it again
+PLAID_BALANCE_MAX_AGE = int(os.environ.get('PLAID_BALANCE_MAX_AGE', 300))
+# The balance refresher keeps the balances of users that logged in within
+# the last days warm and refreshes them once they are this many seconds old
+PLAID_ACTIVE_DAYS = int(os.environ.get('PLAID_ACTIVE_DAYS', 7))
+PLAID_REFRESH_AGE = int(os.environ.get('PLAID_REFRESH_AGE', 240))
+# Days of transactions downloaded when a bank is synced the first time
+PLAID_HISTORY_DAYS = int(os.environ.get('PLAID_HISTORY_DAYS', 2 * 365))
 
 if os.environ.get('DEBUG') != "TRUE" and 'TRAVIS' not in os.environ:
     SECURE_SSL_REDIRECT = True
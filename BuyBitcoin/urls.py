@@ -13,15 +13,15 @@ Including another URLconf
     1. Import the include() function: from django.conf.urls import url, include
     2. Add a URL to urlpatterns:  url(r'^blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.conf.urls import url, include
 from django.contrib import admin
-from graphql.execution.executors.thread import ThreadExecutor
-import graphene_django.views
 import authentication.views
 import web.views
+from BuyBitcoin.graphql_cache import AsyncGraphQLView, CachedGraphQLView
+import BuyBitcoin.graphql_executor
 import stocks.historical
 
-EXECUTOR = ThreadExecutor()
 # pylint: disable=invalid-name
 urlpatterns = [
     url(r'^/?$', authentication.views.idx),
@@ -30,9 +30,11 @@ urlpatterns = [
     url(r'^admin/', admin.site.urls),
     url('', include('social_django.urls', namespace='social')),
     url(r'^home/?.*$', web.views.home),
-    url(r'^graphql', graphene_django.views.GraphQLView.as_view(
-        graphiql=True,
-        executor=EXECUTOR,
+    url(r'^graphql/stats$', BuyBitcoin.graphql_executor.stats),
+    url(r'^graphql', (
+        AsyncGraphQLView.as_view(graphiql=True)
+        if settings.GRAPHQL_EXECUTION == 'asyncio' else
+        CachedGraphQLView.as_view(graphiql=True, executor=BuyBitcoin.graphql_executor.POOL)
     )),
     url(r'^stocks/addstock/', stocks.historical.data_ten_years_back_for_stock),
     url(r'^stocks/fill/', stocks.historical.fill_stocks),
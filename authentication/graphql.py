@@ -3,13 +3,18 @@ GraphQL definitions for the Authentication App
 """
 import datetime
 from django.contrib.auth.models import User
+from django.utils import timezone
 from graphene import Argument, Field, Float, Int, List, Mutation, \
     NonNull, String, relay
 from graphene_django import DjangoObjectType, DjangoConnectionField
 from trading.models import TradingAccount
 from trading.graphql import GTradingAccount
-from stocks.graphql import GInvestmentBucket, GStock, GDataPoint, DataPoint
+from stocks.async_execution import IO, offload
+from stocks.graphql import GInvestmentBucket, GStock, GDataPoint, DataPoint, \
+    downsampled, history_args
+from stocks.loaders import get_loader
 from stocks.models import InvestmentBucket, Stock
+from .loaders import UserBankLoader
 from .models import Profile, UserBank
 
 
@@ -30,6 +35,14 @@ class GUser(DjangoObjectType):
         only_fields = ('id', 'profile', 'username', 'userbank')
         interfaces = (relay.Node, )
 
+    @staticmethod
+    def resolve_userbank(data, info, **_args):
+        """
+        Returns the banks of the user through the request's
+        :py:class:`authentication.loaders.UserBankLoader`
+        """
+        return get_loader(info, UserBankLoader).load(data.id)
+
 
 class GProfile(DjangoObjectType):
     """
@@ -108,7 +121,7 @@ class GUserBank(DjangoObjectType):
     name = NonNull(String)
     outcome = NonNull(Float)
     history = NonNull(
-        List(NonNull(GDataPoint)), args={'start': Argument(NonNull(String))})
+        List(NonNull(GDataPoint)), args=history_args(start=Argument(NonNull(String))))
     balance_date = NonNull(String)
     monthly_start = NonNull(String)
     monthly_end = NonNull(String)
@@ -123,22 +136,29 @@ class GUserBank(DjangoObjectType):
         interfaces = (relay.Node, )
 
     @staticmethod
-    def resolve_history(data, _info, start, **_args):
+    @offload(IO)
+    def resolve_history(data, _info, start, max_points=None, **args):
         """
         This method returns the account history for a user. This is, how much
         value the bank account historically had.
         (see :py:meth:`authentication.models.UserBank.historical_data`)
+        It runs on the I/O pool since the first call syncs the transactions
+        from Plaid. The other fields read the stored values.
 
         :param data: The bank we want to extract the history from.
         :type data: :py:class:`authentication.models.UserBank`
         :param start: The date with that the history should start. The query
             will return the history from start until today.
         :type start: str (YYYY-MM-dd).
+        :param max_points: Reduces the history to at most this many points,
+            see :py:mod:`stocks.downsampling`.
+        :type max_points: int.
         :returns: `stocks.graphql.DataPoint` representing the history.
         """
+        points = data.historical_data(start)
         return [
-            DataPoint(date, value)
-            for (date, value) in data.historical_data(start)
+            DataPoint(*points[idx])
+            for idx in downsampled(points, max_points, args.get('downsampling'))
         ]
 
     @staticmethod
@@ -154,11 +174,13 @@ class GUserBank(DjangoObjectType):
         return data.current_balance(False)
 
     @staticmethod
-    def resolve_balance_date(_data, _info):
+    def resolve_balance_date(data, _info):
         """
-        Date of the balance
+        Date the balance was last synced with the bank
         """
-        return str(datetime.date.today())
+        if data.balance_updated is None:
+            return str(datetime.date.today())
+        return str(timezone.localtime(data.balance_updated).date())
 
     @staticmethod
     def resolve_monthly_start(_data, _info):
@@ -196,7 +218,7 @@ class GUserBank(DjangoObjectType):
         :type data: :py:class:`authentication.models.UserBank`
         :returns: The monthly income of the account.
         """
-        return data.income(False)
+        return data.income()
 
     @staticmethod
     def resolve_outcome(data, _info, **_args):
@@ -208,7 +230,7 @@ class GUserBank(DjangoObjectType):
         :type data: :py:class:`authentication.models.UserBank`
         :returns: The monthly expenditure of the account.
         """
-        return data.expenditure(False)
+        return data.expenditure()
 
 
 # pylint: disable=no-init
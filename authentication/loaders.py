@@ -0,0 +1,23 @@
+"""
+Request scoped DataLoaders for the Authentication App
+"""
+from collections import defaultdict
+from promise import Promise
+from promise.dataloader import DataLoader
+from .models import UserBank
+
+
+# pylint: disable=method-hidden,no-self-use
+class UserBankLoader(DataLoader):
+    """
+    Loads the list of :py:class:`authentication.models.UserBank` per user id
+    """
+    def batch_load_fn(self, keys):
+        """
+        Fetches the banks of all users with one query
+        """
+        banks = defaultdict(list)
+        for bank in UserBank.objects.filter(user_id__in=keys).order_by('id'):
+            banks[bank.user_id].append(bank)
+        return Promise.resolve([banks[key] for key in keys])
+# pylint: enable=method-hidden,no-self-use
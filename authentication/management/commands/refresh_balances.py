@@ -0,0 +1,40 @@
+"""
+Keeps the bank balances of active users warm
+(see :py:meth:`authentication.models.UserBank.refresh_stale`)
+"""
+import time
+from django.core.management.base import BaseCommand
+from authentication.models import UserBank
+
+
+class Command(BaseCommand):
+    """
+    Periodically syncs the balances of active users before they go stale
+    """
+    help = "Refreshes stale bank balances of active users"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Refresh once and exit")
+        parser.add_argument(
+            '--interval', type=int, default=60,
+            help="Seconds between two refresh rounds")
+        parser.add_argument(
+            '--max-age', type=int, default=None,
+            help="Seconds after which a balance is refreshed")
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help="Number of balances refreshed at the same time")
+
+    def handle(self, *args, **options):
+        while True:
+            (refreshed, failed) = UserBank.refresh_stale(
+                max_age=options['max_age'], workers=options['workers'])
+            self.stdout.write("{} balances refreshed, {} failed".format(
+                len(refreshed), len(failed)))
+            for (bank_id, error) in sorted(failed.items()):
+                self.stdout.write("bank {}: {}".format(bank_id, error))
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,36 @@
+"""
+Keeps the local bank transactions of active users up to date
+(see :py:meth:`authentication.models.UserBank.sync_stale_transactions`)
+"""
+import time
+from django.core.management.base import BaseCommand
+from authentication.models import UserBank
+
+
+class Command(BaseCommand):
+    """
+    Periodically downloads the new transactions of active users
+    """
+    help = "Syncs the bank transactions of active users"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Sync once and exit")
+        parser.add_argument(
+            '--interval', type=int, default=3600,
+            help="Seconds between two sync rounds")
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help="Number of banks synced at the same time")
+
+    def handle(self, *args, **options):
+        while True:
+            (synced, failed) = UserBank.sync_stale_transactions(workers=options['workers'])
+            self.stdout.write("{} banks synced, {} failed".format(
+                len(synced), len(failed)))
+            for (bank_id, error) in sorted(failed.items()):
+                self.stdout.write("bank {}: {}".format(bank_id, error))
+            if options['once']:
+                return
+            time.sleep(options['interval'])
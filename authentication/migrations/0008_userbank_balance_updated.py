@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2026-10-18 14:36
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0007_remove_profile_has_bank_linked'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userbank',
+            name='balance_updated',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2026-10-18 14:38
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0008_userbank_balance_updated'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BankTransaction',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaction_id', models.CharField(blank=True, max_length=255)),
+                ('date', models.DateField()),
+                ('amount', models.FloatField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='userbank',
+            name='transactions_synced',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='banktransaction',
+            name='bank',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transactions', to='authentication.UserBank'),
+        ),
+        migrations.AddIndex(
+            model_name='banktransaction',
+            index=models.Index(fields=['bank', '-date', 'amount'], name='auth_bank_tx_date_idx'),
+        ),
+    ]
@@ -1,10 +1,17 @@
 """
 Models keeps track of all the persistent data around the user profile
 """
-from django.db import models
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import threading
+import numpy
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, models, transaction
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
+from django.utils import timezone
 from authentication.plaid_wrapper import PlaidAPI
 
 
@@ -59,6 +66,11 @@ def save_user_profile(instance, **_):
     instance.profile.save()
 
 
+# Guards the creation of the PlaidAPI of every bank
+_PLAID_LOCK = threading.Lock()
+
+
+# pylint: disable=too-many-instance-attributes
 class UserBank(models.Model):
     """
     The UserBank wraps a connection to Plaid. It stores the access token for the User.
@@ -70,42 +82,228 @@ class UserBank(models.Model):
     access_token = models.CharField(max_length=1000)
     institution_name = models.CharField(max_length=1000)
     current_balance_field = models.FloatField()
+    balance_updated = models.DateTimeField(null=True, blank=True)
     account_name_field = models.CharField(max_length=1000)
     income_field = models.FloatField()
     expenditure_field = models.FloatField()
+    transactions_synced = models.DateField(null=True, blank=True)
+
+    # Created by plaid() on first use, not stored or pickled
+    _plaid = None
 
     def plaid(self):
         """
         This method instanciates a new `authentication.plaid_wrapper.PlaidAPI` with
-        the stored access token.
+        the stored access token. The instance is kept on the bank, so
+        everything it fetched is shared by all accessors of this bank, e.g.
+        by all resolvers of one GraphQL request that got the bank from
+        :py:class:`authentication.loaders.UserBankLoader`.
 
         :returns: `authentication.plaid_wrapper.PlaidAPI` for the User.
         """
-        return PlaidAPI(self.access_token)
+        if self._plaid is None:
+            with _PLAID_LOCK:
+                if self._plaid is None:
+                    self._plaid = PlaidAPI(self.access_token)
+        return self._plaid
 
-    def historical_data(self, *args, **kwargs):
+    def __reduce__(self):
+        """
+        Leaves the PlaidAPI out when the bank is pickled or copied, it holds
+        locks and is recreated on demand
         """
-        Fetches the historical data
-        (see :py:meth:`authentication.plaid_wrapper.PlaidAPI.historical_data`)
+        (unpickle, args, state) = super(UserBank, self).__reduce__()
+        state = dict(state)
+        state.pop('_plaid', None)
+        return (unpickle, args, state)
 
-        :returns: list of tuples for the historical data.
+    def historical_data(self, start):
         """
-        return self.plaid().historical_data(*args, **kwargs)
+        Computes the balance history from the locally stored transactions,
+        without any remote call once the transactions were synced once. The
+        balance on a day is the current balance minus the cumulative sum of
+        all later transactions.
 
-    def current_balance(self, update=True):
+        :param start: The first day of the history.
+        :type start: str (YYYY-mm-dd) or date
+        :returns: list of (date, balance) tuples, newest first.
+        """
+        if self.transactions_synced is None:
+            self.sync_transactions()
+        today = datetime.date.today()
+        days = self.transactions.filter(
+            date__gte=start,
+        ).values_list('date').annotate(
+            models.Sum('amount'),
+        ).order_by('-date')
+        (dates, amounts) = zip(*days) if days else ((), ())
+        values = self.current_balance_field - numpy.cumsum(amounts)
+        return [(str(today), self.current_balance_field)] + [
+            (str(date), float(value))
+            for (date, value) in zip(dates, values)
+            if date != today
+        ]
+
+    def sync_transactions(self):
+        """
+        Stores the transactions since the last sync in
+        :py:class:`authentication.models.BankTransaction`. The first sync
+        downloads settings.PLAID_HISTORY_DAYS days, later syncs only the days
+        since the last one. All pages are downloaded before the transaction
+        that replaces the stored ones starts, so slow Plaid calls never hold
+        a connection or the bank's rows. The income and expenditure of the
+        last 30 days are stored with them.
+
+        :returns: int of the number of stored transactions
+        """
+        today = datetime.date.today()
+        start = self.transactions_synced or (
+            today - datetime.timedelta(days=settings.PLAID_HISTORY_DAYS))
+        fetched = [
+            BankTransaction(
+                bank=self,
+                transaction_id=trans.get('transaction_id') or '',
+                date=trans['date'],
+                amount=trans['amount'],
+            )
+            for trans in self.plaid().iter_transactions(start)
+        ]
+        with transaction.atomic():
+            self.transactions.filter(date__gte=start).delete()
+            BankTransaction.objects.bulk_create(fetched, batch_size=PlaidAPI.PAGE_SIZE)
+            self.transactions_synced = today
+            self.income_field = self.transaction_sum(amount__gt=0)
+            self.expenditure_field = self.transaction_sum(amount__lt=0)
+            self.save(update_fields=['transactions_synced', 'income_field', 'expenditure_field'])
+            _bump_banks()
+        return len(fetched)
+
+    def transaction_sum(self, days=30, **amount_filter):
+        """
+        Sums up the stored transactions of the last days
+
+        :param amount_filter: Additional filters, e.g. amount__gt=0.
+        :returns: float of the sum
+        """
+        return self.transactions.filter(
+            date__gte=datetime.date.today() - datetime.timedelta(days=days),
+            **amount_filter
+        ).aggregate(total=models.Sum('amount'))['total'] or 0.0
+
+    def current_balance(self, update=True, max_age=None):
         """
         Returns the latest balance for the bank account. If update is set, then
-        the balance will be synced with the original bank account.
+        the balance will be synced with the original bank account unless the
+        stored balance is fresh enough.
 
-        :param update: Whether to sync with the remote bank account.
+        :param update: Whether to sync with the remote bank account. With
+            False the stored balance is returned as is ("cached").
         :type update: bool
+        :param max_age: How many seconds old the stored balance may be before
+            it is synced, defaults to settings.PLAID_BALANCE_MAX_AGE. 0 always
+            syncs ("force").
+        :type max_age: int
         :returns: float of the current balance for the account
         """
         if update:
-            self.current_balance_field = self.plaid().current_balance()
-            self.save()
+            with self.plaid().lock:
+                if self.balance_is_stale(max_age):
+                    self.refresh_balance()
+        return self.current_balance_field
+
+    def balance_is_stale(self, max_age=None):
+        """
+        Whether the stored balance is older than max_age seconds
+
+        :param max_age: Defaults to settings.PLAID_BALANCE_MAX_AGE.
+        :type max_age: int
+        :returns: bool
+        """
+        if max_age is None:
+            max_age = settings.PLAID_BALANCE_MAX_AGE
+        return self.balance_updated is None or max_age <= 0 or (
+            timezone.now() - self.balance_updated > datetime.timedelta(seconds=max_age))
+
+    def refresh_balance(self):
+        """
+        Syncs the balance with the original bank account
+
+        :returns: float of the current balance for the account
+        """
+        self.current_balance_field = self.plaid().current_balance(refresh=True)
+        self.balance_updated = timezone.now()
+        self.save(update_fields=['current_balance_field', 'balance_updated'])
+        _bump_banks()
         return self.current_balance_field
 
+    @staticmethod
+    def refresh_stale(max_age=None, active_days=None, workers=4):
+        """
+        Syncs the balances of active users that are older than max_age
+        seconds, so their requests find a warm balance.
+
+        :param max_age: Defaults to settings.PLAID_REFRESH_AGE.
+        :type max_age: int
+        :param active_days: Defaults to settings.PLAID_ACTIVE_DAYS.
+        :type active_days: int
+        :param workers: Number of balances synced at the same time.
+        :type workers: int
+        :returns: tuple of the refreshed banks and a dict of the failed bank
+            ids to their error
+        """
+        if max_age is None:
+            max_age = settings.PLAID_REFRESH_AGE
+        cutoff = timezone.now() - datetime.timedelta(seconds=max_age)
+        return UserBank.for_active_banks(
+            UserBank.refresh_balance,
+            models.Q(balance_updated__isnull=True) | models.Q(balance_updated__lt=cutoff),
+            active_days, workers)
+
+    @staticmethod
+    def sync_stale_transactions(active_days=None, workers=4):
+        """
+        Syncs the transactions of active users that weren't synced today
+
+        :returns: tuple of the synced banks and a dict of the failed bank
+            ids to their error
+        """
+        return UserBank.for_active_banks(
+            UserBank.sync_transactions,
+            models.Q(transactions_synced__isnull=True) |
+            models.Q(transactions_synced__lt=datetime.date.today()),
+            active_days, workers)
+
+    @staticmethod
+    def for_active_banks(action, condition, active_days=None, workers=4):
+        """
+        Runs action on the banks matching condition of all users that logged
+        in within the last active_days days, on a pool of workers threads
+
+        :param active_days: Defaults to settings.PLAID_ACTIVE_DAYS.
+        :type active_days: int
+        :returns: tuple of the banks action ran on and a dict of the failed
+            bank ids to their error
+        """
+        if active_days is None:
+            active_days = settings.PLAID_ACTIVE_DAYS
+        banks = list(UserBank.objects.filter(
+            condition,
+            user__last_login__gte=timezone.now() - datetime.timedelta(days=active_days),
+        ).order_by('id'))
+        failed = {}
+
+        def run(bank):
+            try:
+                action(bank)
+            except Exception as ex:  # pylint: disable=broad-except
+                failed[bank.id] = "{}: {}".format(type(ex).__name__, ex)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(run, banks))
+        return ([bank for bank in banks if bank.id not in failed], failed)
+
     def account_name(self, update=True):
         """
         Returns the account name
@@ -115,26 +313,55 @@ class UserBank(models.Model):
             self.save()
         return self.account_name_field
 
-    def income(self, days=30, update=True):
+    def income(self, days=30, update=False):
         """
-        Returns the income in the given timespan
+        Returns the income in the given timespan, computed from the stored
+        transactions. The last 30 days are kept in income_field by every
+        sync. Only with update set, the transactions are synced first.
         """
-        inc = self.income_field
-        if update or days != 30:
-            inc = self.plaid().income(days=days)
-            if days == 30:
-                self.income_field = inc
-                self.save()
-        return inc
+        if update:
+            self.sync_transactions()
+        if days == 30:
+            return self.income_field
+        return self.transaction_sum(days, amount__gt=0)
 
-    def expenditure(self, days=30, update=True):
+    def expenditure(self, days=30, update=False):
         """
-        Returns the expenditures in the given timespan
+        Returns the expenditures in the given timespan, computed from the
+        stored transactions. The last 30 days are kept in expenditure_field
+        by every sync. Only with update set, the transactions are synced
+        first.
         """
-        exp = self.expenditure_field
-        if update or days != 30:
-            exp = self.plaid().expenditure(days=days)
-            if days == 30:
-                self.expenditure_field = exp
-                self.save()
-        return exp
+        if update:
+            self.sync_transactions()
+        if days == 30:
+            return self.expenditure_field
+        return self.transaction_sum(days, amount__lt=0)
+# pylint: enable=too-many-instance-attributes
+
+
+def _bump_banks():
+    """
+    Bumps the bank data version, see :py:class:`stocks.models.DataVersion`.
+    The model is looked up lazily since the stocks app depends on this one.
+    """
+    data_version = apps.get_model('stocks', 'DataVersion')
+    data_version.bump(data_version.BANKS)
+
+
+class BankTransaction(models.Model):
+    """
+    Local copy of the transactions of a
+    :py:class:`authentication.models.UserBank`, so the balance history,
+    income and expenditure are computed without remote calls.
+    """
+    bank = models.ForeignKey(
+        UserBank, on_delete=models.CASCADE, related_name='transactions')
+    transaction_id = models.CharField(max_length=255, blank=True)
+    date = models.DateField()
+    amount = models.FloatField()
+
+    class Meta(object):
+        indexes = [
+            models.Index(fields=['bank', '-date', 'amount'], name='auth_bank_tx_date_idx'),
+        ]
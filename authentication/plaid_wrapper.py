@@ -3,7 +3,11 @@ Plaid API wrapper to provide convenience methods
 """
 import datetime
 import os
+import queue
+import threading
 import plaid
+from plaid import requester as plaid_requester
+import requests
 
 
 class PlaidAPI(object):
@@ -18,7 +22,11 @@ class PlaidAPI(object):
         if os.environ.get('DEBUG') == "TRUE"
         or os.environ.get('TRAVIS_BRANCH') is not None
         else 'development')
-    balance = None
+    PAGE_SIZE = 500
+    PREFETCH = 2
+    POOL_SIZE = int(os.environ.get('PLAID_POOL_SIZE', 10))
+    shared_client = None
+    shared_client_lock = threading.Lock()
 
     def __init__(self, access_token, client=None):
         if client is None:
@@ -26,56 +34,122 @@ class PlaidAPI(object):
         else:
             self.plaid = client
         self.access_token = access_token
+        self.lock = threading.RLock()
+        self.balance = None
+        self.name = None
 
     @staticmethod
     def client():
         """
-        Creates a new plaid client
+        Returns the plaid client of this process. It is created on first use
+        and shared by all PlaidAPI instances, so its HTTP connections are
+        kept alive and reused.
         """
-        return plaid.Client(
-            client_id=PlaidAPI.PLAID_CLIENT_ID,
-            secret=PlaidAPI.PLAID_SECRET,
-            public_key=PlaidAPI.PLAID_PUBLIC_KEY,
-            environment=PlaidAPI.PLAID_ENV,
-        )
+        with PlaidAPI.shared_client_lock:
+            if PlaidAPI.shared_client is None or PlaidAPI.shared_client.pid != os.getpid():
+                PlaidAPI.shared_client = PooledClient(
+                    client_id=PlaidAPI.PLAID_CLIENT_ID,
+                    secret=PlaidAPI.PLAID_SECRET,
+                    public_key=PlaidAPI.PLAID_PUBLIC_KEY,
+                    environment=PlaidAPI.PLAID_ENV,
+                    pool_size=PlaidAPI.POOL_SIZE,
+                )
+                # plaid.requester sends every request of every plaid.Client
+                # with the module level requests.post, so the only way to
+                # give it the pooled session is to replace that module for
+                # the whole process. The shared client is the only one the
+                # app uses.
+                plaid_requester.requests = _SessionRequests(PlaidAPI.shared_client)
+            return PlaidAPI.shared_client
 
-    def current_balance(self):
+    def current_balance(self, refresh=False):
         """
-        Returns the current numerical balance of the user
+        Returns the current numerical balance of the user. It is fetched
+        once per instance unless refresh is set.
         """
-        if self.balance:
+        with self.lock:
+            if self.balance is not None and not refresh:
+                return self.balance
+            balances = self.plaid.Accounts.balance.get(self.access_token)['accounts']
+            extracted_balances = [((b['balances']['available']
+                                    if b['balances']['available'] is not None else
+                                    b['balances']['current']) *
+                                   (1
+                                    if b['subtype'] != 'credit card' else -1))
+                                  for b in balances]
+            balance = sum(extracted_balances)
+            self.balance = float(balance)
             return self.balance
-        balances = self.plaid.Accounts.balance.get(self.access_token)['accounts']
-        extracted_balances = [((b['balances']['available']
-                                if b['balances']['available'] is not None else
-                                b['balances']['current']) *
-                               (1
-                                if b['subtype'] != 'credit card' else -1))
-                              for b in balances]
-        balance = sum(extracted_balances)
-        self.balance = float(balance)
-        return self.balance
 
     def account_name(self):
         """
         The name of the account that the user hass
         """
-        return self.plaid.Accounts.get(self.access_token)['accounts'][0]['name']
+        with self.lock:
+            if self.name is None:
+                self.name = self.plaid.Accounts.get(self.access_token)['accounts'][0]['name']
+            return self.name
+
+    def iter_transactions(self, start):
+        """
+        Yields the transactions from start until today, newest first. They
+        are streamed from Plaid page by page without being kept, callers
+        store what they need (see
+        :py:meth:`authentication.models.UserBank.sync_transactions`).
+
+        :param start: The first day, as datetime or YYYY-mm-dd string.
+        """
+        return self.stream_transactions(start, _today())
+
+    def stream_transactions(self, start, end, prefetch=None):
+        """
+        Lazily yields the transactions between start and end (both inclusive),
+        page by page. A background thread fetches up to prefetch pages ahead
+        while the caller consumes the current one, so only prefetch + 1 pages
+        are held in memory at any time.
+
+        :param start: The first day, as datetime or YYYY-mm-dd string.
+        :param end: The last day, as datetime or YYYY-mm-dd string.
+        :param prefetch: Number of pages fetched ahead, defaults to PREFETCH.
+            With 0 the pages are fetched on demand.
+        """
+        pages = self.pages(_day(start), _day(end))
+        if prefetch is None:
+            prefetch = self.PREFETCH
+        if prefetch > 0:
+            pages = _prefetched(pages, prefetch)
+        for page in pages:
+            yield from page
+
+    def pages(self, start, end):
+        """
+        Yields the pages of transactions between start and end until
+        total_transactions were received
+        """
+        offset = 0
+        while True:
+            response = self.plaid.Transactions.get(
+                self.access_token,
+                start_date=start,
+                end_date=end,
+                count=self.PAGE_SIZE,
+                offset=offset,
+            )
+            page = response['transactions']
+            offset += len(page)
+            if page:
+                yield page
+            if not page or offset >= response.get('total_transactions', offset):
+                return
 
     def historical_data(self, start):
         """
         Returns a list of tuples that show the balance a user had at the given point in time
         """
-        end = datetime.datetime.now().strftime("%Y-%m-%d")
-        response = self.plaid.Transactions.get(
-            self.access_token,
-            start_date=start,
-            end_date=end
-        )
-        transactions = response['transactions']
+        end = _today()
         value = self.current_balance()
         value_list = [(end, value)]
-        for transaction in transactions:
+        for transaction in self.iter_transactions(start):
             value = value - transaction['amount']
             if not value_list[-1][0] == transaction['date']:
                 value_list.append((transaction['date'], value))
@@ -85,28 +159,107 @@ class PlaidAPI(object):
         """
         Calculates the income a user has per month
         """
-        start = (datetime.datetime.now() - datetime.timedelta(days=days)).strftime("%Y-%m-%d")
-        end = datetime.datetime.now().strftime("%Y-%m-%d")
-        response = self.plaid.Transactions.get(
-            self.access_token,
-            start_date=start,
-            end_date=end,
-        )
-        transactions = response['transactions']
-        plus = sum(filter(lambda x: x > 0, [tx['amount'] for tx in transactions]))
-        return float(plus)
+        transactions = self.iter_transactions(
+            datetime.datetime.now() - datetime.timedelta(days=days))
+        return float(sum(tx['amount'] for tx in transactions if tx['amount'] > 0))
 
     def expenditure(self, days=30):
         """
         Calculates the expenses a user has in a given timespan
         """
-        start = (datetime.datetime.now() - datetime.timedelta(days=days)).strftime("%Y-%m-%d")
-        end = datetime.datetime.now().strftime("%Y-%m-%d")
-        response = self.plaid.Transactions.get(
-            self.access_token,
-            start_date=start,
-            end_date=end,
-        )
-        transactions = response['transactions']
-        plus = sum(filter(lambda x: x < 0, [tx['amount'] for tx in transactions]))
-        return float(plus)
+        transactions = self.iter_transactions(
+            datetime.datetime.now() - datetime.timedelta(days=days))
+        return float(sum(tx['amount'] for tx in transactions if tx['amount'] < 0))
+
+
+class PooledClient(plaid.Client):
+    """
+    plaid.Client that sends its requests through one requests.Session, so
+    connections to Plaid are kept alive and reused by all threads of the
+    process instead of being opened per call. :py:meth:`PlaidAPI.client`
+    points plaid.requester at the session of the shared client, so plaid
+    keeps building the URLs and errors itself. This relies on plaid-python
+    2.1.1, which requirements.txt pins.
+    """
+    def __init__(self, *args, pool_size=10, **kwargs):
+        super(PooledClient, self).__init__(*args, **kwargs)
+        self.pid = os.getpid()
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+
+
+# pylint: disable=too-few-public-methods
+class _SessionRequests(object):
+    """
+    Stands in for the requests module in plaid.requester
+    """
+    def __init__(self, client):
+        self.client = client
+
+    def post(self, *args, **kwargs):
+        """
+        requests.post through the session of the client
+        """
+        return self.client.session.post(*args, **kwargs)
+# pylint: enable=too-few-public-methods
+
+
+def _prefetched(items, size):
+    """
+    Consumes the iterator items on a background thread, at most size items
+    ahead of the caller. Errors are raised in the caller and the thread stops
+    when the caller stops iterating.
+    """
+    buffer = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except Exception as ex:  # pylint: disable=broad-except
+            put((done, ex))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            (item, error) = buffer.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _day(value):
+    """
+    Formats a date, datetime or YYYY-mm-dd string as YYYY-mm-dd
+    """
+    if isinstance(value, str):
+        return value[:10]
+    return value.strftime("%Y-%m-%d")
+
+
+def _today():
+    """
+    Today as YYYY-mm-dd
+    """
+    return _day(datetime.datetime.now())
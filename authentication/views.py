@@ -5,6 +5,8 @@ from django.shortcuts import render
 from django.http import HttpResponseRedirect, HttpResponse
 from django.contrib.auth import logout as log_out
 from django.contrib.auth.decorators import login_required
+from django.utils import timezone
+from authentication.models import UserBank
 from authentication.plaid_wrapper import PlaidAPI
 
 
@@ -51,16 +53,21 @@ def get_access_token(request):
         public_token = request.POST.get('public_token')
         exchange_response = client.Item.public_token.exchange(public_token)
         plaidrequest = client.Item.get(exchange_response['access_token'])
-        plaid = PlaidAPI(exchange_response['access_token'])
-        request.user.userbank.create(
+        bank = UserBank(
+            user=request.user,
             item_id=exchange_response['item_id'],
             access_token=exchange_response['access_token'],
             institution_name=plaidrequest['item']['institution_id'],
-            current_balance_field=plaid.current_balance(),
-            account_name_field=plaid.account_name(),
-            income_field=plaid.income(),
-            expenditure_field=plaid.expenditure(),
+            income_field=0.0,
+            expenditure_field=0.0,
         )
+        plaid = bank.plaid()
+        bank.current_balance_field = plaid.current_balance()
+        bank.balance_updated = timezone.now()
+        bank.account_name_field = plaid.account_name()
+        bank.save()
+        # Stores the transactions together with their income and expenditure
+        bank.sync_transactions()
         return HttpResponse(status=201)
     return HttpResponse(status=403)
 
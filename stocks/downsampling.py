@@ -0,0 +1,104 @@
+"""
+Downsampling of chart series. Charts can't draw more points than they are
+wide, so history fields take a maxPoints argument and only the points that
+shape the line are sent.
+
+* :py:func:`lttb` (largest triangle three buckets) keeps the point of every
+  bucket that spans the largest triangle with its neighbours, which keeps
+  the visual shape of the series.
+* :py:func:`min_max` keeps the lowest and the highest point of every
+  bucket, so no spike is lost.
+
+Both return the indices of the kept points in their original order.
+"""
+import numpy
+
+LTTB = 'lttb'
+MIN_MAX = 'min_max'
+
+
+def lttb(dates, values, threshold):
+    """
+    Indices of the threshold points picked by largest triangle three buckets
+
+    :param dates: numpy array of the dates as numbers
+    :param values: numpy array of the values
+    """
+    size = len(dates)
+    if threshold >= size:
+        return numpy.arange(size)
+    if threshold < 3:
+        return numpy.array([0, size - 1][:max(threshold, 0)], dtype=int)
+    # First and last point are always kept, the others are split into
+    # threshold - 2 buckets
+    edges = numpy.append(
+        1 + numpy.arange(threshold - 1) * (size - 2) // (threshold - 2), size)
+    selected = numpy.empty(threshold, dtype=int)
+    selected[0] = 0
+    selected[-1] = size - 1
+    prev = 0
+    for bucket in range(threshold - 2):
+        (start, end, after) = edges[bucket:bucket + 3]
+        next_date = dates[end:after].mean()
+        next_value = values[end:after].mean()
+        area = numpy.abs(
+            (dates[prev] - next_date) * (values[start:end] - values[prev]) -
+            (dates[prev] - dates[start:end]) * (next_value - values[prev])
+        )
+        prev = start + int(area.argmax())
+        selected[bucket + 1] = prev
+    return selected
+
+
+def min_max(_dates, values, threshold):
+    """
+    Indices of the lowest and highest point of threshold // 2 buckets
+    """
+    size = len(values)
+    if threshold >= size:
+        return numpy.arange(size)
+    if threshold < 2:
+        return numpy.arange(max(threshold, 0))
+    buckets = threshold // 2
+    edges = numpy.arange(buckets + 1) * size // buckets
+    selected = []
+    for (start, end) in zip(edges[:-1], edges[1:]):
+        window = values[start:end]
+        selected.extend((start + int(window.argmin()), start + int(window.argmax())))
+    return numpy.unique(selected)
+
+
+METHODS = {
+    LTTB: lttb,
+    MIN_MAX: min_max,
+}
+
+
+def indices(points, max_points, method=LTTB):
+    """
+    Indices of the points of a series that are kept when it is reduced to
+    at most max_points points
+
+    :param points: list of (date, value), dates are dates or YYYY-MM-DD
+        strings
+    :param method: LTTB or MIN_MAX
+    :returns: numpy array of indices in ascending order
+    """
+    if len(points) <= max_points:
+        return numpy.arange(len(points))
+    dates = numpy.array(
+        [date for (date, _) in points], dtype='datetime64[D]').astype(numpy.float64)
+    values = numpy.array([value for (_, value) in points], dtype=numpy.float64)
+    return METHODS[method](dates, values, max_points)
+
+
+def downsample(points, max_points, method=LTTB):
+    """
+    Reduces a series of (date, value) to at most max_points points, None
+    keeps the series as it is
+
+    :returns: list of the kept points in their original order
+    """
+    if max_points is None or len(points) <= max_points:
+        return points
+    return [points[idx] for idx in indices(points, max_points, method)]
@@ -0,0 +1,154 @@
+"""
+Engine to download quote histories for many tickers concurrently. Downloads
+run on a bounded worker pool while every finished history is saved right away
+by the calling thread, so only one thread writes to the database.
+"""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import logging
+import threading
+import time
+from yahoo_historical import Fetcher
+
+LOGGER = logging.getLogger(__name__)
+
+FetchJob = namedtuple(
+    "FetchJob",
+    ["ticker", "stock_id", "start", "end"],
+)
+
+FillResult = namedtuple(
+    "FillResult",
+    ["ticker", "stock_id", "rows", "attempts", "seconds", "error"],
+)
+
+
+# pylint: disable=too-few-public-methods
+class RateLimiter(object):
+    """
+    Spaces out requests so that every host sees at most rate requests per
+    second, no matter how many workers are downloading
+    """
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.clock = clock
+        self.sleep = sleep
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, host):
+        """
+        Blocks until the next request to host is allowed
+        """
+        with self._lock:
+            now = self.clock()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+        if slot > now:
+            self.sleep(slot - now)
+
+
+class HistoryFetcher(object):
+    """
+    Downloads single histories. Requests to the host are spaced out by a
+    shared :py:class:`RateLimiter` and failed downloads are retried with
+    exponential backoff.
+
+    :param fetcher_class: Class with the interface of
+        :py:class:`yahoo_historical.Fetcher`, tests pass a local fake here.
+    :param rate: Maximum requests per second and host.
+    :param retries: How often a failed download is retried.
+    :param backoff: Seconds to wait before the first retry, doubled for
+        every further one.
+    :param permanent_errors: Exceptions that are not worth retrying, e.g. the
+        KeyError the fetcher raises for unknown tickers.
+    """
+    # pylint: disable=too-many-arguments
+    def __init__(self, fetcher_class=Fetcher, rate=5.0, retries=3, backoff=1.0,
+                 host='finance.yahoo.com', permanent_errors=(KeyError, ), sleep=time.sleep):
+        self.fetcher_class = fetcher_class
+        self.retries = retries
+        self.backoff = backoff
+        self.host = host
+        self.permanent_errors = permanent_errors
+        self.sleep = sleep
+        self.limiter = RateLimiter(rate, sleep=sleep)
+    # pylint: enable=too-many-arguments
+
+    def fetch(self, job):
+        """
+        Downloads the history of a single job, retrying with exponential
+        backoff. Returns (history, attempts, error) where error is the last
+        exception if the download did not succeed.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            self.limiter.wait(self.host)
+            try:
+                fetcher = self.fetcher_class(job.ticker, job.start, job.end)
+                return (fetcher.getHistorical(), attempt, None)
+            except self.permanent_errors as ex:
+                return (None, attempt, ex)
+            except Exception as ex:  # pylint: disable=broad-except
+                if attempt > self.retries:
+                    return (None, attempt, ex)
+                self.sleep(self.backoff * 2 ** (attempt - 1))
+# pylint: enable=too-few-public-methods
+
+
+# pylint: disable=too-few-public-methods
+class FillEngine(object):
+    """
+    Downloads histories with a pool of workers and hands each of them to save
+    as soon as it arrives.
+
+    :param save: Called as save(history, stock_id) for every download. Its
+        return value is reported as the number of rows.
+    :param workers: Maximum number of concurrent downloads.
+    :param fetcher_options: passed on to :py:class:`HistoryFetcher`
+    """
+    def __init__(self, save, workers=8, **fetcher_options):
+        self.save = save
+        self.workers = workers
+        self.fetcher = HistoryFetcher(**fetcher_options)
+
+    def _timed_fetch(self, job):
+        start = time.monotonic()
+        return self.fetcher.fetch(job) + (start, )
+
+    def run(self, jobs):
+        """
+        Runs all jobs and returns a list of FillResult, one per job, in the
+        order the downloads finished
+        """
+        results = []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self._timed_fetch, job): job for job in jobs}
+            for future in as_completed(futures):
+                job = futures[future]
+                (history, attempts, error, start) = future.result()
+                rows = None
+                if error is None:
+                    try:
+                        rows = self.save(history, job.stock_id)
+                    except Exception as ex:  # pylint: disable=broad-except
+                        error = ex
+                result = FillResult(
+                    ticker=job.ticker,
+                    stock_id=job.stock_id,
+                    rows=rows,
+                    attempts=attempts,
+                    seconds=time.monotonic() - start,
+                    error=None if error is None else repr(error),
+                )
+                if error is None:
+                    LOGGER.info(
+                        "Filled %s: %s rows in %.2fs", job.ticker, rows, result.seconds)
+                else:
+                    LOGGER.warning(
+                        "Filling %s failed after %.2fs: %s",
+                        job.ticker, result.seconds, result.error)
+                results.append(result)
+        return results
+# pylint: enable=too-few-public-methods
@@ -0,0 +1,158 @@
+"""
+Database backed queue for quote downloads. The web process only enqueues a
+:py:class:`stocks.models.FillJob`, the ``fill_worker`` management command
+leases its tasks and downloads them on a :py:class:`stocks.fill_engine.FillEngine`.
+Any number of worker processes can share the queue.
+"""
+import datetime
+import logging
+import os
+import socket
+import time
+import arrow
+from django.conf import settings
+from django.db.models import F, Max, Q
+from django.utils import timezone
+from .fill_engine import FetchJob, FillEngine
+from .historical import save_stock_quote_from_fetcher
+from .models import DailyStockQuote, FillJob, FillTask
+from .stock_helper import get_date_array_for_fetcher
+
+LOGGER = logging.getLogger(__name__)
+
+
+def default_owner():
+    """
+    Identifies the current worker process in task leases
+    """
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+def claim_tasks(owner, limit, lease_seconds):
+    """
+    Leases up to limit tasks for owner. Every task is claimed with a
+    conditional UPDATE, so two workers can never lease the same task, and
+    tasks whose lease expired (e.g. after a dyno restart) are claimed again.
+    A batch never contains two tasks for the same stock.
+
+    :returns: list of the leased :py:class:`stocks.models.FillTask`
+    """
+    now = timezone.now()
+    claimable = (
+        Q(status=FillTask.PENDING) |
+        Q(status=FillTask.RUNNING, lease_expires__lt=now)
+    )
+    claimed = []
+    stock_ids = set()
+    candidates = FillTask.objects.filter(claimable).order_by('id').values_list(
+        'id', 'stock_id')[:limit * 4]
+    for (task_id, stock_id) in candidates:
+        if len(claimed) >= limit:
+            break
+        if stock_id in stock_ids:
+            continue
+        if FillTask.objects.filter(claimable, id=task_id).update(
+                status=FillTask.RUNNING,
+                lease_owner=owner,
+                lease_expires=now + datetime.timedelta(seconds=lease_seconds),
+                attempts=F('attempts') + 1,
+        ):
+            claimed.append(task_id)
+            stock_ids.add(stock_id)
+    FillJob.objects.filter(
+        tasks__id__in=claimed, status=FillJob.PENDING,
+    ).update(status=FillJob.RUNNING)
+    return list(FillTask.objects.filter(id__in=claimed).select_related('stock'))
+
+
+def run_tasks(tasks, max_attempts=None, **engine_options):
+    """
+    Downloads the quotes for leased tasks. Each stock is checkpointed on its
+    task as soon as its quotes are saved. Failed tasks go back to the queue
+    until they used up max_attempts.
+
+    :param engine_options: passed on to :py:class:`stocks.fill_engine.FillEngine`
+    :returns: list of :py:class:`stocks.fill_engine.FillResult`
+    """
+    if max_attempts is None:
+        max_attempts = settings.FILL_MAX_ATTEMPTS
+    by_stock = {task.stock_id: task for task in tasks}
+    last_dates = dict(
+        DailyStockQuote.objects.filter(stock_id__in=by_stock).values_list(
+            'stock_id').annotate(Max('date'))
+    )
+    now = arrow.now()
+
+    def start_of(task):
+        if task.start is not None:
+            return arrow.get(task.start)
+        if task.stock_id in last_dates:
+            return arrow.get(last_dates[task.stock_id]).replace(days=+1)
+        return now.replace(years=-10)
+
+    def save(history, stock_id):
+        result = save_stock_quote_from_fetcher(history, stock_id)
+        task = by_stock[stock_id]
+        FillTask.objects.filter(id=task.id, lease_owner=task.lease_owner).update(
+            status=FillTask.DONE,
+            rows=result.inserted + result.updated,
+            last_date=DailyStockQuote.objects.filter(
+                stock_id=stock_id).aggregate(Max('date'))['date__max'],
+            lease_expires=None,
+            error='',
+        )
+        return result
+
+    engine_options.setdefault('workers', settings.FILL_WORKERS)
+    engine_options.setdefault('rate', settings.FILL_RATE_PER_HOST)
+    engine_options.setdefault('retries', settings.FILL_RETRIES)
+    results = FillEngine(save, **engine_options).run([
+        FetchJob(
+            ticker=task.stock.ticker,
+            stock_id=task.stock_id,
+            start=get_date_array_for_fetcher(start_of(task)),
+            end=get_date_array_for_fetcher(now),
+        )
+        for task in tasks
+    ])
+    for result in results:
+        if result.error is None:
+            continue
+        task = by_stock[result.stock_id]
+        FillTask.objects.filter(id=task.id, lease_owner=task.lease_owner).update(
+            status=(
+                FillTask.FAILED if task.attempts >= max_attempts
+                else FillTask.PENDING
+            ),
+            lease_owner='',
+            lease_expires=None,
+            error=result.error,
+        )
+    for job in FillJob.objects.filter(tasks__in=tasks).distinct():
+        job.finish_if_complete()
+    return results
+
+
+def work(once=False, owner=None, batch_size=None, lease_seconds=None,
+         idle_sleep=5, **options):
+    """
+    Processes leased batches of tasks. With once set, it returns the results
+    as soon as the queue is empty, otherwise it keeps polling for new jobs.
+    """
+    owner = owner or default_owner()
+    batch_size = batch_size or settings.FILL_BATCH_SIZE
+    lease_seconds = lease_seconds or settings.FILL_LEASE_SECONDS
+    processed = []
+    while True:
+        tasks = claim_tasks(owner, batch_size, lease_seconds)
+        if tasks:
+            results = run_tasks(tasks, **options)
+            LOGGER.info(
+                "%s processed %s tasks, %s failed", owner, len(results),
+                len([result for result in results if result.error is not None]))
+            if once:
+                processed.extend(results)
+        elif once:
+            return processed
+        else:
+            time.sleep(idle_sleep)
@@ -3,9 +3,17 @@ GraphQL definitions for the Stocks App
 """
 from collections import namedtuple
 from graphene_django import DjangoObjectType
-from graphene import Argument, Boolean, Field, Float, ID, Int, \
+from django.conf import settings
+from graphene import Argument, Boolean, Enum, Field, Float, ID, Int, \
     InputObjectType, List, Mutation, NonNull, ObjectType, String, relay
+from graphene.types.generic import GenericScalar
 from graphql_relay.node.node import from_global_id
+from graphql_relay.utils import base64, unbase64
+from trading.loaders import BucketTradeSumLoader, DefaultAccountLoader
+from . import downsampling
+from .async_execution import ORM, offload
+from .loaders import BackfillTaskLoader, BucketValueLoader, LatestQuoteLoader, \
+    StockConfigLoader, get_loader
 from .models import DailyStockQuote, InvestmentBucket, \
     InvestmentBucketDescription, InvestmentStockConfiguration, Stock
 
@@ -28,6 +36,34 @@ class GDataPoint(ObjectType):
     value = NonNull(Float)
 
 
+class GDownsampling(Enum):
+    """
+    How a history is reduced to maxPoints points
+    (see :py:mod:`stocks.downsampling`)
+    """
+    LTTB = downsampling.LTTB
+    MIN_MAX = downsampling.MIN_MAX
+
+
+def history_args(**args):
+    """
+    Arguments of a history field, including maxPoints and downsampling
+    """
+    return dict(args, max_points=Int(), downsampling=GDownsampling())
+
+
+def downsampled(points, max_points=None, method=None):
+    """
+    Indices of the (date, value) points that are kept by the maxPoints and
+    downsampling arguments of a history field
+    """
+    if max_points is None:
+        return range(len(points))
+    if max_points < 3:
+        raise Exception("maxPoints has to be at least 3")
+    return downsampling.indices(points, max_points, method or downsampling.LTTB)
+
+
 class GInvestmentBucketConfigurationUpdate(InputObjectType):
     """
     Represents one choice of stock for a bucket
@@ -67,7 +103,7 @@ class GInvestmentBucket(DjangoObjectType):
     is_owner = NonNull(Boolean)
     owned_amount = NonNull(Float)
     value = NonNull(Float)
-    history = NonNull(List(NonNull(GDataPoint)), args={'count': Int(), 'skip': Int()})
+    history = NonNull(List(NonNull(GDataPoint)), args=history_args(count=Int(), skip=Int()))
 
     class Meta:
         """
@@ -94,35 +130,41 @@ class GInvestmentBucket(DjangoObjectType):
         return data.owner.id == info.context.user.profile.id
 
     @staticmethod
-    def resolve_stocks(data, _info, **_args):
+    def resolve_stocks(data, info, **_args):
         """
         Returns the *current* stocks in the bucket
         """
-        return data.get_stock_configs()
+        return get_loader(info, StockConfigLoader).load(data.id)
 
     @staticmethod
-    def resolve_value(data, _info, **_args):
+    def resolve_value(data, info, **_args):
         """
         The current value of the investment bucket
         """
-        return data.value_on()
+        return get_loader(info, BucketValueLoader).load(data.id)
 
     @staticmethod
     def resolve_owned_amount(data, info, **_args):
         """
         Returns how much of the bucket the user owns
         """
-        return info.context.user.profile.default_acc().available_buckets(data)
+        trade_sums = get_loader(info, BucketTradeSumLoader)
+        return get_loader(info, DefaultAccountLoader).load(
+            info.context.user.profile.id
+        ).then(
+            lambda account: trade_sums.load((account.id, data.id))
+        )
 
     @staticmethod
-    def resolve_history(data, _info, count=None, skip=None, **_args):
+    @offload(ORM)
+    def resolve_history(data, _info, count=None, skip=None, max_points=None, **args):
         """
         Returns the historic data for the bucket
         """
+        points = data.historical(skip=skip, count=count)
         return [
-            DataPoint(date, value)
-            for (date, value)
-            in data.historical(skip=skip, count=count)
+            DataPoint(*points[idx])
+            for idx in downsampled(points, max_points, args.get('downsampling'))
         ]
 
 
@@ -138,13 +180,62 @@ class GInvestmentStockConfiguration(DjangoObjectType):
         interfaces = (relay.Node, )
 
 
+class GBackfill(ObjectType):
+    """
+    Progress of the download of a stock's history after it was created
+    """
+    status = NonNull(String)
+    attempts = NonNull(Int)
+    rows = NonNull(Int)
+    last_date = String()
+    error = String()
+
+
+class GQuoteInterval(Enum):
+    """
+    Downsampling of a quote series
+    """
+    DAY = Stock.DAY
+    WEEK = Stock.WEEK
+    MONTH = Stock.MONTH
+
+
+class GQuoteSeries(ObjectType):
+    """
+    Page of a stock's quote history. The points are [date, value] pairs.
+    """
+    points = NonNull(GenericScalar)
+    page_info = NonNull(relay.PageInfo)
+
+
+def quote_cursor(date):
+    """
+    Opaque cursor of the point at date
+    """
+    return base64('quote:' + date)
+
+
+def cursor_date(cursor):
+    """
+    Date of the point a cursor points to
+    """
+    date = unbase64(cursor)
+    if not date.startswith('quote:'):
+        raise Exception("Invalid cursor")
+    return date[len('quote:'):]
+
+
 class GStock(DjangoObjectType):
     """
     GraphQL representation of a Stock
     """
-    quote_in_range = NonNull(List(GDailyStockQuote), args={'start': Argument(
-        NonNull(String)), 'end': Argument(NonNull(String))})
+    quote_in_range = NonNull(List(GDailyStockQuote), args=history_args(
+        start=Argument(NonNull(String)), end=Argument(NonNull(String))))
+    quote_series = NonNull(GQuoteSeries, args={
+        'start': String(), 'end': String(), 'first': Int(), 'after': String(),
+        'interval': GQuoteInterval(), 'points': Int()})
     latest_quote = Field(GDailyStockQuote)
+    backfill = NonNull(GBackfill)
 
     class Meta(object):
         """
@@ -152,21 +243,76 @@ class GStock(DjangoObjectType):
         """
         model = Stock
         interfaces = (relay.Node, )
-        only_fields = ('quote_in_range', 'latest_quote', 'name', 'ticker', 'trades')
+        only_fields = (
+            'quote_in_range', 'quote_series', 'latest_quote', 'name', 'ticker', 'trades',
+            'backfill')
+
+    @staticmethod
+    def resolve_backfill(data, info, **_args):
+        """
+        Reports whether the stock is still backfilling, clients poll this
+        after they added a stock
+        """
+        return get_loader(info, BackfillTaskLoader).load(data.id).then(
+            lambda task: Backfill(
+                status=Stock.backfill_status_of(task),
+                attempts=task.attempts if task else 0,
+                rows=task.rows if task else 0,
+                last_date=task.last_date if task else None,
+                error=(task.error or None) if task else None,
+            )
+        )
 
     @staticmethod
-    def resolve_latest_quote(data, _info, **_args):
+    def resolve_latest_quote(data, info, **_args):
         """
         Returns the most recent stock quote
         """
-        return data.latest_quote()
+        return get_loader(info, LatestQuoteLoader).load(data.id)
 
     @staticmethod
-    def resolve_quote_in_range(data, _info, start, end, **_args):
+    @offload(ORM)
+    def resolve_quote_in_range(data, _info, start, end, max_points=None, **args):
         """
         Finds the stock quotes for the stock within a time range
         """
-        return data.quote_in_range(start, end)
+        quotes = data.quote_in_range(start, end)
+        if max_points is None:
+            return quotes
+        rows = list(quotes.values_list('id', 'date', 'value'))
+        points = [(date, value) for (_, date, value) in rows]
+        kept = downsampled(points, max_points, args.get('downsampling'))
+        if len(kept) == len(rows):
+            return quotes
+        return quotes.filter(id__in=[rows[idx][0] for idx in kept])
+
+    @staticmethod
+    @offload(ORM)
+    def resolve_quote_series(data, _info, start=None, end=None, **args):
+        """
+        Returns a page of at most first (default and maximum:
+        QUOTE_SERIES_PAGE_SIZE) points of the stock's quotes, optionally
+        downsampled (see :py:meth:`stocks.models.Stock.quote_series`)
+        """
+        (first, after, points) = (args.get('first'), args.get('after'), args.get('points'))
+        limit = settings.QUOTE_SERIES_PAGE_SIZE
+        if first is not None and not 0 < first <= limit:
+            raise Exception("first has to be between 1 and {}".format(limit))
+        if points is not None and points < 1:
+            raise Exception("points has to be positive")
+        (rows, has_next) = data.quote_series(
+            start, end, after=cursor_date(after) if after else None,
+            first=first or limit, interval=args.get('interval') or Stock.DAY, points=points)
+        series = [[date.isoformat(), value] for (date, value) in rows]
+        return QuoteSeries(
+            points=series,
+            page_info=relay.PageInfo(
+                has_next_page=has_next,
+                has_previous_page=after is not None,
+                start_cursor=quote_cursor(series[0][0]) if series else None,
+                end_cursor=quote_cursor(series[-1][0]) if series else after,
+            ),
+        )
 
     @staticmethod
     def resolve_trades(stock, info, **_args):
@@ -336,10 +482,18 @@ class DeleteBucket(Mutation):
         return DeleteAttribute(is_ok=True)
 
 
+Backfill = namedtuple(
+    "Backfill",
+    ["status", "attempts", "rows", "last_date", "error"],
+)
 Config = namedtuple(
     "Config",
     ["id", "quantity"],
 )
+QuoteSeries = namedtuple(
+    "QuoteSeries",
+    ["points", "page_info"],
+)
 
 
 class EditConfiguration(Mutation):
@@ -1,31 +1,13 @@
 """This module is for loading historical data for stocks"""
-import threading
-from yahoo_historical import Fetcher
-import arrow
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from django.db.models import Max
 from django.http import HttpResponse
-from .models import Stock, DailyStockQuote
-from .stock_helper import get_date_array_for_fetcher
-
-
-def fill_quote_history(stock):
-    """
-    Given a stock, it fills in the last 10 years of historical data
-    """
-    now = arrow.now()
-    ten_back = now.replace(years=-10)
-    now = get_date_array_for_fetcher(now)
-    ten_back = get_date_array_for_fetcher(ten_back)
-    fetcher = Fetcher(stock.ticker, ten_back, now)
-    history = fetcher.getHistorical()
-    save_stock_quote_from_fetcher(history, stock.id)
+from .models import DailyStockQuote, FillJob, Stock
 
 
 def data_ten_years_back_for_stock(request):
     """ Function that creates Stock object
-        and loads data for it 10 years back
+        and queues the download of its data 10 years back
     """
     if request.method == "POST":
         body = request.POST
@@ -45,45 +27,36 @@ def data_ten_years_back_for_stock(request):
 @receiver(post_save, sender=Stock)
 def create_stock(instance, created, **_):
     """
-    Queries stock quotes when stock is created
+    Queues the download of the stock's history when the stock is created.
+    The fill_worker picks it up, meanwhile the stock reports 'backfilling'.
     """
     if created:
-        fill_quote_history(instance)
+        FillJob.enqueue_backfill(instance)
 
 
 def fill_stocks(request):
-    """Function that fills stock data for missing days via GET"""
+    """
+    Function that queues a job to fill stock data for missing days via GET.
+    The job is processed by the fill_worker management command.
+    """
     if request.method == "GET":
-        thread = threading.Thread(target=fill)
-        thread.start()
-        return HttpResponse("Filling Data...", status=200)
+        (job, created) = FillJob.enqueue()
+        if created:
+            return HttpResponse("Queued fill job {}".format(job.id), status=200)
+        return HttpResponse("Fill job {} is already queued".format(job.id), status=200)
     return HttpResponse("405 Method Not Allowed", status=405)
 
 
-def fill():
-    """Function that fills stock data for missing days"""
-    stock_id_field = 'stock_id'
-    stock_ticker = 'stock__ticker'
-    date = 'date'
-    now = arrow.now()
-    data = DailyStockQuote.objects.values(stock_ticker, stock_id_field).annotate(date=Max(date))
-    for stock in data:
-        last_date = arrow.get(stock[date]).replace(days=+1)
-        last_date = get_date_array_for_fetcher(last_date)
-        now_fetcher = get_date_array_for_fetcher(now)
-        ticker = stock[stock_ticker]
-        stock_id = stock[stock_id_field]
-        fetcher = Fetcher(ticker, last_date, now_fetcher)
-        history = fetcher.getHistorical()
-        save_stock_quote_from_fetcher(history, stock_id)
-
-
 def save_stock_quote_from_fetcher(fetcher_history, stock_id):
-    """Function that saves DailyStockQuote from yahoo_historical fetcher"""
-    objects = []
-    for row in fetcher_history.itertuples():
-        value = getattr(row, "Close")
-        date = getattr(row, "Date")
-        objects.append(
-            DailyStockQuote(value=value, date=date, stock_id=stock_id))
-    DailyStockQuote.objects.bulk_create(objects, batch_size=500)
+    """
+    Function that saves DailyStockQuote from yahoo_historical fetcher. Quotes
+    that are already stored are skipped or corrected, so overlapping runs are
+    safe to repeat (see :py:meth:`stocks.models.DailyStockQuote.upsert`)
+    """
+    return DailyStockQuote.upsert(
+        stock_id,
+        (
+            (getattr(row, "Date"), getattr(row, "Close"))
+            for row in fetcher_history.itertuples()
+        ),
+    )
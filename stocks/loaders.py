@@ -0,0 +1,161 @@
+"""
+Request scoped DataLoaders for the Stocks App. They batch the per object
+lookups of the GraphQL resolvers into a bounded number of queries.
+"""
+from collections import defaultdict
+import datetime
+from django.db.models import DateField, FloatField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from promise import Promise
+from promise.dataloader import DataLoader
+from .models import BucketDailyValue, DailyStockQuote, FillJob, FillTask, \
+    InvestmentBucket, InvestmentStockConfiguration, QUOTE_CACHE
+from .valuation import forward_fill
+
+
+def get_loader(info, loader_class):
+    """
+    Returns the instance of loader_class that belongs to the current request.
+    Loaders are created on first use and live as long as the request does,
+    so nothing is cached across requests.
+    """
+    loaders = info.context.__dict__.setdefault('dataloaders', {})
+    if loader_class not in loaders:
+        loaders.setdefault(loader_class, loader_class())
+    return loaders[loader_class]
+
+
+# pylint: disable=method-hidden,no-self-use
+class LatestQuoteLoader(DataLoader):
+    """
+    Loads the most recent :py:class:`stocks.models.DailyStockQuote` per stock id
+    """
+    def batch_load_fn(self, keys):
+        """
+        Reads the quotes of all stocks from QUOTE_CACHE at once
+        """
+        series = QUOTE_CACHE.series_many(keys)
+        return Promise.resolve([
+            DailyStockQuote.from_series(series[key], -1)
+            if series[key] else Exception("No quote found")
+            for key in keys
+        ])
+
+
+class QuoteValueOnLoader(DataLoader):
+    """
+    Loads the value of the latest quote on or before a date. Keys are
+    (stock id, date) tuples.
+    """
+    def batch_load_fn(self, keys):
+        """
+        Looks the dates up in the cached quote series of each stock
+        """
+        series = QUOTE_CACHE.series_many(stock_id for (stock_id, _) in keys)
+        result = []
+        for (stock_id, date) in keys:
+            idx = series[stock_id].index_on(date)
+            if idx < 0:
+                result.append(Exception("No quote found"))
+            else:
+                result.append(float(series[stock_id].values[idx]))
+        return Promise.resolve(result)
+
+
+class StockConfigLoader(DataLoader):
+    """
+    Loads the current :py:class:`stocks.models.InvestmentStockConfiguration`
+    list per bucket id, together with their stocks
+    """
+    def batch_load_fn(self, keys):
+        """
+        Fetches the configs of all buckets with one query
+        """
+        configs = defaultdict(list)
+        for config in InvestmentStockConfiguration.objects.filter(
+                bucket_id__in=keys, end=None,
+        ).select_related('stock').order_by('id'):
+            configs[config.bucket_id].append(config)
+        return Promise.resolve([configs[key] for key in keys])
+
+
+class BucketValueLoader(DataLoader):
+    """
+    Loads the current value of buckets by id from their latest
+    :py:class:`stocks.models.BucketDailyValue`, see
+    :py:meth:`stocks.models.InvestmentBucket.value_on`
+    """
+    def batch_load_fn(self, keys):
+        """
+        Fetches the latest daily value of all buckets with one query
+        """
+        latest = BucketDailyValue.objects.filter(
+            bucket=OuterRef('pk'), date__lte=datetime.datetime.now().date(),
+        ).order_by('-date').values('holdings')[:1]
+        values = {
+            bucket_id: (holdings or 0.0) + available
+            for (bucket_id, available, holdings) in InvestmentBucket.objects.filter(
+                id__in=keys,
+            ).annotate(
+                holdings=Subquery(latest, output_field=FloatField()),
+            ).values_list('id', 'available', 'holdings')
+        }
+        return Promise.resolve([
+            values[key] if key in values else Exception("Bucket not found")
+            for key in keys
+        ])
+
+
+class BucketValueOnLoader(DataLoader):
+    """
+    Loads the value of buckets on a date, see
+    :py:meth:`stocks.models.InvestmentBucket.values_on`. Keys are
+    (bucket id, date) tuples.
+    """
+    def batch_load_fn(self, keys):
+        """
+        Reads the daily values of all buckets with one range scan
+        """
+        dates = [date for (_, date) in keys]
+        first_row = BucketDailyValue.objects.filter(
+            bucket=OuterRef('bucket'), date__lte=min(dates),
+        ).order_by('-date').values('date')[:1]
+        rows = defaultdict(list)
+        for (bucket_id, date, holdings) in BucketDailyValue.objects.filter(
+                bucket_id__in={bucket_id for (bucket_id, _) in keys},
+                date__gte=Coalesce(Subquery(first_row), Value(min(dates)),
+                                   output_field=DateField()),
+                date__lte=max(dates),
+        ).order_by('date').values_list('bucket_id', 'date', 'holdings'):
+            rows[bucket_id].append((date, holdings))
+        available = dict(InvestmentBucket.objects.filter(
+            id__in={bucket_id for (bucket_id, _) in keys},
+        ).values_list('id', 'available'))
+        result = []
+        for (bucket_id, date) in keys:
+            if bucket_id not in available:
+                result.append(Exception("Bucket not found"))
+                continue
+            holdings = forward_fill(
+                [row_date for (row_date, _) in rows[bucket_id]],
+                [value for (_, value) in rows[bucket_id]], [date])
+            result.append(float(holdings[0]) + available[bucket_id])
+        return Promise.resolve(result)
+
+
+class BackfillTaskLoader(DataLoader):
+    """
+    Loads the task that downloads the history of a stock per stock id, see
+    :py:meth:`stocks.models.Stock.backfill_task`. Stocks without one get None.
+    """
+    def batch_load_fn(self, keys):
+        """
+        Fetches the latest backfill task of all stocks with one query
+        """
+        tasks = {}
+        for task in FillTask.objects.filter(
+                stock_id__in=keys, job__kind=FillJob.BACKFILL,
+        ).order_by('stock_id', '-id'):
+            tasks.setdefault(task.stock_id, task)
+        return Promise.resolve([tasks.get(key) for key in keys])
+# pylint: enable=method-hidden,no-self-use
@@ -0,0 +1,108 @@
+"""
+Payload and latency benchmark for history downsampling (see
+:py:mod:`stocks.downsampling`)
+"""
+import datetime
+import json
+import time
+import numpy
+from django.core.management.base import BaseCommand
+from graphene import Int, List, NonNull, ObjectType, Schema
+from stocks.graphql import DataPoint, GDataPoint, downsampled, history_args
+
+QUERY = """
+query Series($size: Int, $maxPoints: Int, $downsampling: GDownsampling) {
+  series(size: $size, maxPoints: $maxPoints, downsampling: $downsampling) { date value }
+}
+"""
+
+
+def random_walk(size, seed=0):
+    """
+    Daily (date, value) series of size days ending today
+    """
+    # pylint: disable=no-member
+    rand = numpy.random.RandomState(seed)
+    # pylint: enable=no-member
+    values = 100 + numpy.cumsum(rand.normal(0, 1, size))
+    today = datetime.date.today()
+    return [
+        (today - datetime.timedelta(days=size - idx), float(value))
+        for (idx, value) in enumerate(values)
+    ]
+
+
+class Command(BaseCommand):
+    """
+    Resolves random walk histories of several lengths through a GDataPoint
+    field, once in full and once per downsampling method, and reports the
+    JSON payload and the time to resolve and serialize them
+    """
+    help = "Compares payload and latency of full and downsampled histories"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[365, 3650, 36500],
+            help="Points of the full histories")
+        parser.add_argument(
+            '--max-points', type=int, default=500,
+            help="maxPoints of the downsampled histories")
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help="Executions per measurement, the fastest one is reported")
+
+    def handle(self, *args, **options):
+        series = {size: random_walk(size) for size in options['sizes']}
+
+        # pylint: disable=too-few-public-methods
+        class Query(ObjectType):
+            """
+            A history field like GInvestmentBucket.history
+            """
+            series = NonNull(List(NonNull(GDataPoint)), args=history_args(size=Int()))
+
+            @staticmethod
+            def resolve_series(_data, _info, size, max_points=None, **args):
+                """
+                Returns the random walk of size points
+                """
+                points = series[size]
+                return [
+                    DataPoint(*points[idx])
+                    for idx in downsampled(points, max_points, args.get('downsampling'))
+                ]
+        # pylint: enable=too-few-public-methods
+
+        schema = Schema(query=Query)
+        for size in options['sizes']:
+            (full_bytes, full_ms) = self.measure(
+                schema, {'size': size}, options['repeat'])
+            self.stdout.write("{:>7} points  full     {:>9} bytes {:>8.1f}ms".format(
+                size, full_bytes, full_ms))
+            for method in ('LTTB', 'MIN_MAX'):
+                (payload, latency) = self.measure(schema, {
+                    'size': size, 'maxPoints': options['max_points'], 'downsampling': method,
+                }, options['repeat'])
+                self.stdout.write(
+                    "{:>7} points  {:8} {:>9} bytes {:>8.1f}ms  "
+                    "{:.1f}x smaller, {:.1f}x faster".format(
+                        size, method.lower(), payload, latency,
+                        full_bytes / payload, full_ms / latency))
+
+    @staticmethod
+    def measure(schema, variables, repeat):
+        """
+        Executes the query repeat times
+
+        :returns: (bytes of the JSON response, fastest execution in ms)
+        """
+        fastest = None
+        for _ in range(repeat):
+            start = time.monotonic()
+            result = schema.execute(QUERY, variable_values=variables)
+            payload = json.dumps({'data': result.data}, separators=(',', ':'))
+            seconds = time.monotonic() - start
+            if result.errors:
+                raise result.errors[0]
+            fastest = seconds if fastest is None else min(fastest, seconds)
+        return (len(payload), fastest * 1000)
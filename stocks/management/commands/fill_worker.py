@@ -0,0 +1,39 @@
+"""
+Worker process for the quote fill queue (see :py:mod:`stocks.fill_queue`)
+"""
+from django.core.management.base import BaseCommand
+from stocks import fill_queue
+
+
+class Command(BaseCommand):
+    """
+    Leases queued fill tasks and downloads their quotes
+    """
+    help = "Processes queued quote fill jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Exit as soon as the queue is empty")
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help="Number of tasks leased at a time")
+        parser.add_argument(
+            '--lease', type=int, default=None,
+            help="Seconds a leased task stays reserved for this worker")
+
+    def handle(self, *args, **options):
+        results = fill_queue.work(
+            once=options['once'],
+            batch_size=options['batch_size'],
+            lease_seconds=options['lease'],
+        )
+        for result in results:
+            self.stdout.write("{} {} rows={} attempts={} {:.2f}s {}".format(
+                result.ticker,
+                'failed' if result.error else 'ok',
+                result.rows,
+                result.attempts,
+                result.seconds,
+                result.error or '',
+            ))
@@ -0,0 +1,188 @@
+"""
+Latency benchmark for the GraphQL execution modes (see
+:py:mod:`stocks.async_execution`)
+"""
+import datetime
+import time
+import uuid
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.utils import timezone
+from graphql import execute, parse
+from authentication.models import UserBank
+from BuyBitcoin.graphene_schema import SCHEMA
+from BuyBitcoin.graphql_executor import POOL, PooledExecutor
+from stocks.async_execution import execute_async
+from stocks.models import DailyStockQuote, DataVersion, InvestmentBucket, \
+    InvestmentStockConfiguration, Stock
+
+QUERY = """
+{
+  viewer {
+    userbank {
+      edges { node { balance income outcome history(start: "%s") { date value } } }
+    }
+    profile {
+      investSuggestions { edges { node { value history(count: 30) { value } } } }
+      tradingAccounts {
+        edges { node { availableCash totalValue positions { kind value } } }
+      }
+    }
+  }
+}
+"""
+
+
+class Command(BaseCommand):
+    """
+    Sends the same dashboard query through the resolver pool and the
+    asyncio execution mode and reports the latency percentiles of both.
+    Requests run one after another, like on a sync gunicorn worker (the
+    promise scheduler is shared by the whole process). No Plaid or quote
+    provider call is made: the bank histories read local rows, and the
+    latency of a remote call is simulated by sleeping in each of them.
+    """
+    help = "Compares GraphQL latency of the thread and asyncio execution modes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests', type=int, default=200,
+            help="Requests every mode executes")
+        parser.add_argument(
+            '--banks', type=int, default=3,
+            help="Bank accounts of the benchmark user")
+        parser.add_argument(
+            '--io-latency', type=float, default=0.05,
+            help="Simulated I/O latency in seconds, slept in every bank history "
+                 "(no remote call is made)")
+
+    def handle(self, *args, **options):
+        # Everything the benchmark writes belongs to its own user and stock,
+        # so it doesn't invalidate the cached results of other viewers
+        with mock.patch.object(DataVersion, 'bump'):
+            self.run_benchmark(options)
+
+    def run_benchmark(self, options):
+        """
+        Creates the benchmark data, measures both modes and deletes the data
+        """
+        suffix = uuid.uuid4().hex[:8]
+        (user, stock) = (None, None)
+        try:
+            user = User.objects.create_user('graphql-benchmark-{}'.format(suffix))
+            stock = self.create_stock(suffix)
+            start = self.create_portfolio(user, stock, options['banks'])
+            document = parse(QUERY % start)
+            request = RequestFactory().post('/graphql')
+            request.user = user
+            modes = [
+                ('thread', lambda: execute(
+                    SCHEMA, document, context_value=self.context(request),
+                    executor=PooledExecutor(POOL))),
+                ('asyncio', lambda: execute_async(
+                    SCHEMA, document, context_value=self.context(request))),
+            ]
+            with mock.patch.object(UserBank, 'historical_data', _delayed(
+                    UserBank.historical_data, options['io_latency'])):
+                for (name, run) in modes:
+                    latencies = self.measure(run, options['requests'])
+                    self.report(name, latencies)
+        finally:
+            if user is not None:
+                user.delete()
+            if stock is not None:
+                stock.delete()
+
+    @staticmethod
+    def context(request):
+        """
+        A fresh copy of the request, so data loaders are per request
+        """
+        copy = RequestFactory().post('/graphql')
+        copy.user = request.user
+        return copy
+
+    @staticmethod
+    def create_stock(suffix):
+        """
+        Creates a stock with 60 days of quotes that only the benchmark uses.
+        It is inserted directly, so its ticker isn't validated and no
+        backfill is queued for it.
+        """
+        ticker = 'BM{}'.format(suffix[:6].upper())
+        Stock.objects.bulk_create([Stock(name='graphql-benchmark', ticker=ticker)])
+        stock = Stock.objects.get(ticker=ticker)
+        today = datetime.date.today()
+        DailyStockQuote.objects.bulk_create([
+            DailyStockQuote(
+                stock=stock, date=today - datetime.timedelta(days=days), value=100 + days % 5)
+            for days in range(60)
+        ])
+        return stock
+
+    @staticmethod
+    def create_portfolio(user, stock, banks):
+        """
+        Creates banks with local transactions, a bucket and trades on the
+        benchmark stock
+
+        :returns: the first day of the bank histories
+        """
+        today = datetime.date.today()
+        for idx in range(banks):
+            bank = UserBank.objects.create(
+                user=user, item_id='benchmark', access_token='benchmark-{}'.format(idx),
+                institution_name='benchmark', current_balance_field=1000.0,
+                balance_updated=timezone.now(), account_name_field='benchmark',
+                income_field=0.0, expenditure_field=0.0, transactions_synced=today)
+            for days in range(60):
+                bank.transactions.create(
+                    date=today - datetime.timedelta(days=days), amount=days % 7 - 3)
+        bucket = InvestmentBucket.objects.create(
+            name='benchmark', public=False, available=10, owner=user.profile)
+        InvestmentStockConfiguration.objects.create(
+            quantity=1, stock=stock, bucket=bucket, start=today - datetime.timedelta(days=30))
+        account = user.profile.default_acc()
+        account.trades.create(stock=stock, quantity=1)
+        account.buckettrades.create(stock=bucket, quantity=1)
+        return today - datetime.timedelta(days=30)
+
+    @staticmethod
+    def measure(run, requests):
+        """
+        Runs run() requests times
+
+        :returns: sorted list of the latencies in seconds
+        """
+        latencies = []
+        for _ in range(requests):
+            start = time.monotonic()
+            result = run()
+            latencies.append(time.monotonic() - start)
+            if result.errors:
+                raise result.errors[0]
+        return sorted(latencies)
+
+    def report(self, name, latencies):
+        """
+        Writes the latency percentiles of a mode
+        """
+        def percentile(fraction):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000
+
+        self.stdout.write(
+            "{:8} {} requests  p50 {:.1f}ms  p95 {:.1f}ms  p99 {:.1f}ms  max {:.1f}ms".format(
+                name, len(latencies), percentile(0.5), percentile(0.95),
+                percentile(0.99), latencies[-1] * 1000))
+
+
+def _delayed(method, seconds):
+    """
+    Wraps method so it sleeps for seconds first
+    """
+    def delayed(*args, **kwargs):
+        time.sleep(seconds)
+        return method(*args, **kwargs)
+    return delayed
@@ -0,0 +1,40 @@
+"""
+Rebuilds and verifies the materialized bucket values (see
+:py:class:`stocks.models.BucketDailyValue`)
+"""
+from django.core.management.base import BaseCommand, CommandError
+from stocks.models import BucketDailyValue, InvestmentBucket
+
+
+class Command(BaseCommand):
+    """
+    Recomputes every BucketDailyValue from scratch and compares the result
+    with the live computation from configs and quotes
+    """
+    help = "Rebuilds the daily bucket values and verifies them"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify-only', action='store_true',
+            help="Only compare the stored values, don't rebuild them")
+        parser.add_argument(
+            '--bucket', type=int, action='append', default=None,
+            help="Id of a bucket to process, can be repeated (default: all)")
+
+    def handle(self, *args, **options):
+        bucket_ids = options['bucket']
+        if not options['verify_only']:
+            buckets = InvestmentBucket.objects.all()
+            if bucket_ids is not None:
+                buckets = buckets.filter(id__in=bucket_ids)
+            ids = list(buckets.values_list('id', flat=True))
+            BucketDailyValue.objects.filter(bucket_id__in=ids).delete()
+            BucketDailyValue.refresh(ids)
+            self.stdout.write("Rebuilt {} buckets".format(len(ids)))
+        mismatches = BucketDailyValue.verify(bucket_ids)
+        for (bucket_id, date, stored, computed) in mismatches[:50]:
+            self.stdout.write("bucket {} on {}: stored {} computed {}".format(
+                bucket_id, date, stored, computed))
+        if mismatches:
+            raise CommandError("{} values differ".format(len(mismatches)))
+        self.stdout.write("All values match")
@@ -0,0 +1,32 @@
+"""
+Bulk ticker validation (see :py:func:`stocks.stock_helper.validate_tickers`)
+"""
+from django.core.management.base import BaseCommand
+from stocks.stock_helper import validate_tickers
+
+
+class Command(BaseCommand):
+    """
+    Checks which tickers yahoo_historical knows, e.g. before seeding stocks
+    """
+    help = "Validates a list of tickers and caches the results"
+
+    def add_arguments(self, parser):
+        parser.add_argument('tickers', nargs='*', help="Tickers to validate")
+        parser.add_argument(
+            '--file', default=None,
+            help="File with one ticker per line")
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help="Number of concurrent checks")
+
+    def handle(self, *args, **options):
+        tickers = list(options['tickers'])
+        if options['file']:
+            with open(options['file']) as ticker_file:
+                tickers.extend(line.strip() for line in ticker_file if line.strip())
+        validity = validate_tickers(tickers, workers=options['workers'])
+        for ticker in tickers:
+            valid = validity[ticker]
+            self.stdout.write("{} {}".format(
+                ticker, 'unknown' if valid is None else 'valid' if valid else 'invalid'))
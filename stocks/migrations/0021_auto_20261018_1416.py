@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2026-10-18 14:16
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks', '0020_auto_20171102_1226'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FillJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done')], default='pending', max_length=10)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FillTask',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('start', models.DateField(blank=True, null=True)),
+                ('lease_owner', models.CharField(blank=True, max_length=255)),
+                ('lease_expires', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('rows', models.IntegerField(default=0)),
+                ('last_date', models.DateField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tasks', to='stocks.FillJob')),
+                ('stock', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fill_tasks', to='stocks.Stock')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='filltask',
+            unique_together=set([('job', 'stock')]),
+        ),
+    ]
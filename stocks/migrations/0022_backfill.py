@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2026-10-18 14:18
+from __future__ import unicode_literals
+
+import django.core.validators
+from django.db import migrations, models
+import stocks.stock_helper
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks', '0021_auto_20261018_1416'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filljob',
+            name='kind',
+            field=models.CharField(choices=[('fill', 'Fill missing days'), ('backfill', 'Backfill new stock')], default='fill', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='stock',
+            name='ticker',
+            field=models.CharField(max_length=10, unique=True, validators=[django.core.validators.MinLengthValidator(1, message='The ticker should not be empty.'), stocks.stock_helper.ticker_validator]),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2026-10-18 14:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks', '0022_backfill'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TickerValidation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ticker', models.CharField(max_length=32, unique=True)),
+                ('valid', models.BooleanField()),
+                ('checked', models.DateTimeField()),
+            ],
+        ),
+    ]
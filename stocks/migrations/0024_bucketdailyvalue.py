@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2026-10-18 14:22
+from __future__ import unicode_literals
+
+from bisect import bisect_right
+from collections import defaultdict
+import datetime
+import math
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_bucket_values(apps, _schema_editor):
+    """
+    Materializes the daily values of the existing buckets, like
+    BucketDailyValue.refresh does for a bucket whose configs change: every
+    config is valued at the latest quote on or before each day it is active
+    """
+    bucket_daily_value = apps.get_model('stocks', 'BucketDailyValue')
+    config_model = apps.get_model('stocks', 'InvestmentStockConfiguration')
+    quote_model = apps.get_model('stocks', 'DailyStockQuote')
+    configs = defaultdict(list)
+    for (bucket_id, stock_id, quantity, start, end) in config_model.objects.order_by(
+            'id').values_list('bucket_id', 'stock_id', 'quantity', 'start', 'end'):
+        configs[bucket_id].append((stock_id, quantity, start, end))
+    quotes = defaultdict(lambda: ([], []))
+    for (stock_id, date, value) in quote_model.objects.filter(
+            stock_id__in=set(
+                config[0] for bucket_configs in configs.values() for config in bucket_configs),
+    ).order_by('stock_id', 'date').values_list('stock_id', 'date', 'value'):
+        quotes[stock_id][0].append(date)
+        quotes[stock_id][1].append(value)
+    today = datetime.datetime.now().date()
+    for (bucket_id, bucket_configs) in configs.items():
+        first_start = min(start for (_, _, start, _) in bucket_configs)
+        if first_start > today:
+            continue
+        rows = []
+        for i in range((today - first_start).days + 1):
+            date = first_start + datetime.timedelta(days=i)
+            holdings = 0.0
+            for (stock_id, quantity, start, end) in bucket_configs:
+                (dates, values) = quotes[stock_id]
+                idx = bisect_right(dates, date) - 1
+                if idx < 0 or date < start or (end is not None and date > end):
+                    continue
+                value = values[idx] * quantity
+                if not math.isnan(value):
+                    holdings += value
+            rows.append(bucket_daily_value(bucket_id=bucket_id, date=date, holdings=holdings))
+        bucket_daily_value.objects.bulk_create(rows, batch_size=300)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks', '0023_tickervalidation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BucketDailyValue',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('holdings', models.FloatField()),
+                ('bucket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_values', to='stocks.InvestmentBucket')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='bucketdailyvalue',
+            unique_together=set([('bucket', 'date')]),
+        ),
+        migrations.RunPython(fill_bucket_values, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2026-10-18 14:24
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks', '0024_bucketdailyvalue'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bucketdailyvalue',
+            index=models.Index(fields=['bucket', '-date', 'holdings'], name='stocks_bucket_value_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dailystockquote',
+            index=models.Index(fields=['stock', '-date', 'value'], name='stocks_quote_latest_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2026-10-18 15:24
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def mark_active(apps, _schema_editor):
+    """
+    Marks the oldest waiting or running fill job as the active one
+    """
+    fill_job = apps.get_model('stocks', 'FillJob')
+    job = fill_job.objects.filter(
+        kind='fill', status__in=['pending', 'running']).order_by('id').first()
+    if job is not None:
+        fill_job.objects.filter(id=job.id).update(active=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks', '0026_dataversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filljob',
+            name='active',
+            field=models.NullBooleanField(editable=False, unique=True),
+        ),
+        migrations.RunPython(mark_active, migrations.RunPython.noop),
+    ]
@@ -1,24 +1,39 @@
 """
 Models keeps track of all the persistent data around stocks
 """
+from collections import namedtuple
 import datetime
 from datetime import date as os_date
 import math
-from django.db.models import Q
-from django.db import models
-from django.db.models.signals import pre_save
+from django.conf import settings
+from django.db.models import Case, DateField, Max, Min, OuterRef, Q, Subquery, \
+    Value, When
+from django.db.models.functions import Coalesce
+from django.db import IntegrityError, connection, models
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
+from django.utils import timezone
 from django.db import transaction
 from django.core.exceptions import ValidationError
 from django.core.validators import MinLengthValidator, MinValueValidator
 from authentication.models import Profile
-from .stock_helper import validate_ticker
+from .quote_cache import QuoteCache
+from .stock_helper import ticker_validator
+from .valuation import forward_fill, holdings_values
 
 
 class Stock(models.Model):
     """
     Stock represents a single stock. For example GOOGL
     """
+    DAY = 'day'
+    WEEK = 'week'
+    MONTH = 'month'
+    SERIES_PERIODS = {
+        WEEK: lambda date: date.isocalendar()[:2],
+        MONTH: lambda date: (date.year, date.month),
+    }
+
     name = models.CharField(
         max_length=255,
         validators=[
@@ -29,14 +44,15 @@ class Stock(models.Model):
         unique=True,
         validators=[
             MinLengthValidator(1, message="The ticker should not be empty."),
-            validate_ticker
+            ticker_validator
         ], )
 
     def latest_quote(self, date=None):
         """
-        Returns the latest quote for the stock
+        Returns the latest quote for the stock. The lookup is served from
+        QUOTE_CACHE, so it only hits the database when the history of the
+        stock is not cached yet.
         """
-        quote_query = self.daily_quote
         if date is not None:
             if isinstance(date, str):
                 date = datetime.datetime.strptime(date, "%Y-%m-%d").date()
@@ -44,11 +60,11 @@ class Stock(models.Model):
                 date = date.date()
             if date > datetime.datetime.now().date():
                 raise Exception("Date is later than now!")
-            quote_query = quote_query.filter(date__lte=date)
-        quote_query = quote_query.order_by('-date')
-        if quote_query:
-            return quote_query[0]
-        raise Exception("No quote found")
+        series = QUOTE_CACHE.series(self.id)
+        idx = series.index_on(date)
+        if idx < 0:
+            raise Exception("No quote found")
+        return DailyStockQuote.from_series(series, idx)
 
     @staticmethod
     def find_stock(text, first=None):
@@ -63,10 +79,10 @@ class Stock(models.Model):
     @staticmethod
     def create_new_stock(ticker, name):
         """
-        Creates a new stock
+        Creates a new stock. The ticker is validated once by the field
+        validator when the stock is saved, the history is downloaded in the
+        background afterwards (see :py:meth:`Stock.backfill_status`)
         """
-        if not validate_ticker(ticker):
-            raise Exception("Invalid Ticker")
         stock = Stock(name=name, ticker=ticker)
         stock.save()
         return stock
@@ -83,12 +99,95 @@ class Stock(models.Model):
         query = query.order_by('date')
         return query
 
+    # pylint: disable=too-many-arguments
+    def quote_series(self, start=None, end=None, after=None, first=None,
+                     interval=DAY, points=None):
+        """
+        Quote history for charts as (date, value) tuples, read straight from
+        stocks_quote_latest_idx without creating model instances. Pages are
+        keyset paginated on the date. The history can be downsampled to the
+        last quote of every week or month, or of points equally long spans
+        between start and end.
+
+        :param after: Only quotes after this date, i.e. the date of the last
+            point of the previous page.
+        :param first: Maximum number of points to return.
+        :param interval: Stock.DAY, Stock.WEEK or Stock.MONTH.
+        :returns: (list of (date, value), whether more points follow)
+        """
+        quotes = self.quote_in_range(start, end)
+        if after:
+            quotes = quotes.filter(date__gt=after)
+        rows = quotes.values_list('date', 'value')
+        period = self.SERIES_PERIODS.get(interval)
+        if points:
+            period = self._span_period(start, end, points)
+        if period is None:
+            if first is None:
+                return (list(rows), False)
+            rows = list(rows[:first + 1])
+            return (rows[:first], len(rows) > first)
+        series = []
+        current = None
+        for (date, value) in rows.iterator():
+            key = period(date)
+            if series and key == current:
+                series[-1] = (date, value)
+                continue
+            if first is not None and len(series) == first:
+                return (series, True)
+            series.append((date, value))
+            current = key
+        return (series, False)
+    # pylint: enable=too-many-arguments
+
+    def _span_period(self, start, end, points):
+        """
+        Period of a date when the range from start to end (default: the
+        first and last quote) is split into points equally long spans
+        """
+        if start is None or end is None:
+            bounds = self.daily_quote.aggregate(first=Min('date'), last=Max('date'))
+            start = start or bounds['first']
+            end = end or bounds['last']
+        if start is None:
+            return lambda date: date
+        start = _as_date(start)
+        days = max((_as_date(end) - start).days + 1, 1)
+        return lambda date: (date - start).days * points // days
+
     def trades_for_profile(self, profile):
         """
         Returns all trades the user made with this stock
         """
         return self.trades.filter(account__profile=profile)
 
+    def backfill_task(self):
+        """
+        Returns the task that downloads the history of the stock, if any
+        """
+        return self.fill_tasks.filter(
+            job__kind=FillJob.BACKFILL).order_by('-id').first()
+
+    def backfill_status(self):
+        """
+        Returns 'backfilling' while the history of the stock is still being
+        downloaded, afterwards 'done' or 'failed'
+        """
+        return Stock.backfill_status_of(self.backfill_task())
+
+    @staticmethod
+    def backfill_status_of(task):
+        """
+        The backfill status reported for a task returned by
+        :py:meth:`Stock.backfill_task`
+        """
+        if task is None or task.status == FillTask.DONE:
+            return 'done'
+        if task.status == FillTask.FAILED:
+            return 'failed'
+        return 'backfilling'
+
 
 class DailyStockQuote(models.Model):
     """
@@ -109,6 +208,183 @@ class DailyStockQuote(models.Model):
         unique_together = (
             'stock',
             'date', )
+        indexes = [
+            # Serves latest quote and range lookups without touching the table
+            models.Index(fields=['stock', '-date', 'value'], name='stocks_quote_latest_idx'),
+        ]
+
+    @staticmethod
+    def latest_per_stock(stock_ids, date=None):
+        """
+        Finds the latest quote on or before date (default: today) of every
+        stock with a single query that only reads stocks_quote_latest_idx.
+        PostgreSQL uses DISTINCT ON, SQLite a ROW_NUMBER() window and other
+        databases a correlated subquery.
+
+        :returns: dict of stock id to :py:class:`stocks.models.LatestQuote`,
+            stocks without a quote are left out.
+        """
+        date = _as_date(date) if date else datetime.datetime.now().date()
+        stock_ids = sorted(set(stock_ids))
+        rows = []
+        # SQLite allows 999 query parameters
+        for start in range(0, len(stock_ids), 500):
+            rows.extend(DailyStockQuote._latest_rows(stock_ids[start:start + 500], date))
+        return {
+            stock_id: LatestQuote(stock_id, _as_date(quote_date), value)
+            for (stock_id, quote_date, value) in rows
+        }
+
+    @staticmethod
+    def _latest_rows(stock_ids, date):
+        quotes = DailyStockQuote.objects.filter(stock_id__in=stock_ids, date__lte=date)
+        if connection.vendor == 'postgresql':
+            return quotes.order_by('stock', '-date').distinct('stock').values_list(
+                'stock_id', 'date', 'value')
+        if connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 25):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT stock_id, date, value FROM ("
+                    "SELECT stock_id, date, value, ROW_NUMBER() OVER ("
+                    "PARTITION BY stock_id ORDER BY date DESC) AS position "
+                    "FROM {} WHERE stock_id IN ({}) AND date <= %s"
+                    ") WHERE position = 1".format(
+                        DailyStockQuote._meta.db_table,
+                        ', '.join(['%s'] * len(stock_ids))),
+                    stock_ids + [connection.ops.adapt_datefield_value(date)],
+                )
+                return cursor.fetchall()
+        latest_date = DailyStockQuote.objects.filter(
+            stock=OuterRef('stock'), date__lte=date,
+        ).order_by('-date').values('date')[:1]
+        return quotes.filter(date=Subquery(latest_date)).values_list(
+            'stock_id', 'date', 'value')
+
+    @staticmethod
+    def from_series(series, idx):
+        """
+        Builds the quote at position idx of a cached
+        :py:class:`stocks.quote_cache.QuoteSeries` without querying the database
+        """
+        (quote_id, date, value) = series.row(idx)
+        return DailyStockQuote.from_db(
+            DailyStockQuote.objects.db,
+            ['id', 'value', 'date', 'stock_id'],
+            [quote_id, value, date, series.stock_id],
+        )
+
+    @staticmethod
+    def upsert(stock_id, quotes, batch_size=1000):
+        """
+        Idempotently stores (date, value) quotes for a stock. Dates that are
+        not stored yet are inserted in large batches, stored quotes with a
+        different value are corrected in place and everything else is left
+        untouched, so overlapping re-runs are cheap. Only portable ORM
+        statements are used, so this works on SQLite and PostgreSQL alike.
+
+        :returns: :py:class:`stocks.models.UpsertResult`
+        """
+        incoming = {}
+        for (date, value) in quotes:
+            incoming[_as_date(date)] = float(value)
+        if not incoming:
+            return UpsertResult(0, 0, 0)
+        try:
+            with transaction.atomic():
+                (result, first_change) = DailyStockQuote._upsert(
+                    stock_id, incoming, batch_size)
+        except IntegrityError:
+            # A concurrent run inserted some of the dates after we diffed
+            with transaction.atomic():
+                (result, first_change) = DailyStockQuote._upsert(
+                    stock_id, incoming, batch_size)
+        if result.inserted or result.updated:
+            QUOTE_CACHE.invalidate(stock_id)
+            BucketDailyValue.refresh_for_stock(stock_id, first_change)
+            DataVersion.bump(DataVersion.QUOTES)
+        return result
+
+    @staticmethod
+    def _upsert(stock_id, incoming, batch_size):
+        existing = {
+            date: (quote_id, value)
+            for (date, quote_id, value) in DailyStockQuote.objects.filter(
+                stock_id=stock_id,
+                date__gte=min(incoming),
+                date__lte=max(incoming),
+            ).values_list('date', 'id', 'value')
+        }
+        new_quotes = [
+            DailyStockQuote(stock_id=stock_id, date=date, value=value)
+            for (date, value) in sorted(incoming.items())
+            if date not in existing
+        ]
+        corrections = [
+            (quote_id, incoming[date])
+            for (date, (quote_id, value)) in existing.items()
+            if not _same_value(value, incoming[date])
+        ]
+        DailyStockQuote.objects.bulk_create(new_quotes, batch_size=batch_size)
+        # Every correction takes two query parameters, SQLite allows 999
+        for start in range(0, len(corrections), 300):
+            chunk = corrections[start:start + 300]
+            DailyStockQuote.objects.filter(
+                id__in=[quote_id for (quote_id, _) in chunk],
+            ).update(value=Case(
+                *[When(id=quote_id, then=Value(value)) for (quote_id, value) in chunk],
+                output_field=models.FloatField()
+            ))
+        changed_dates = [quote.date for quote in new_quotes] + [
+            date for (date, (quote_id, value)) in existing.items()
+            if not _same_value(value, incoming[date])
+        ]
+        return (UpsertResult(
+            inserted=len(new_quotes),
+            updated=len(corrections),
+            unchanged=len(existing) - len(corrections),
+        ), min(changed_dates) if changed_dates else None)
+
+
+LatestQuote = namedtuple(
+    "LatestQuote",
+    ["stock_id", "date", "value"],
+)
+UpsertResult = namedtuple(
+    "UpsertResult",
+    ["inserted", "updated", "unchanged"],
+)
+
+
+def _as_date(date):
+    """
+    Converts strings, datetimes and pandas timestamps to a date
+    """
+    if isinstance(date, str):
+        return datetime.datetime.strptime(date[:10], "%Y-%m-%d").date()
+    if isinstance(date, datetime.datetime):
+        return date.date()
+    return date
+
+
+def _same_value(stored, incoming):
+    """
+    Compares two closes, treating two missing (NaN) closes as equal
+    """
+    if math.isnan(stored) or math.isnan(incoming):
+        return math.isnan(stored) and math.isnan(incoming)
+    return stored == incoming
+
+
+def _load_quote_rows(stock_ids):
+    """
+    Loads the quote histories for QUOTE_CACHE in a single query
+    """
+    return DailyStockQuote.objects.filter(
+        stock_id__in=stock_ids,
+    ).order_by('stock_id', 'date').values_list('stock_id', 'id', 'date', 'value')
+
+
+QUOTE_CACHE = QuoteCache(_load_quote_rows, max_age=settings.QUOTE_CACHE_MAX_AGE)
 
 
 class InvestmentBucket(models.Model):
@@ -166,6 +442,13 @@ class InvestmentBucket(models.Model):
         return self.stocks.filter(
             start__lte=date).filter(Q(end__gte=date) | Q(end=None))
 
+    def get_stock_configs_between(self, start, end):
+        """
+        Get all configs that were active at some point between start and end
+        """
+        return self.stocks.filter(
+            start__lte=end).filter(Q(end__gte=start) | Q(end=None))
+
     def _sell_all(self):
         """
         Sells all stocks held in the investment bucket
@@ -186,6 +469,9 @@ class InvestmentBucket(models.Model):
         """
         with transaction.atomic():
             self._sell_all()
+            BucketDailyValue.refresh(
+                [self.id],
+                datetime.datetime.now().date() - datetime.timedelta(days=31))
             for conf in new_config:
                 stock = Stock.objects.get(id=conf.id)
                 quote = stock.latest_quote()
@@ -203,27 +489,61 @@ class InvestmentBucket(models.Model):
         """
         The value of the bucket on a specific day
         """
-        values = []
-        for config in self.get_stock_configs(date):
-            try:
-                values.append(config.value_on(date))
-            except Exception:  # pylint: disable=broad-except
-                pass
-        return sum(values) + self.available
+        return self.values_on([date or datetime.datetime.now().date()])[0]
+
+    def values_on(self, dates):
+        """
+        The value of the bucket on each of the given days, read from the
+        materialized :py:class:`stocks.models.BucketDailyValue` rows with a
+        single range scan. Days after the last row keep its value, since
+        nothing changed since then.
+        """
+        if not dates:
+            return []
+        dates = [_as_date(date) for date in dates]
+        first_row = BucketDailyValue.objects.filter(
+            bucket=self, date__lte=min(dates),
+        ).order_by('-date').values('date')[:1]
+        rows = list(self.daily_values.filter(
+            date__gte=Coalesce(Subquery(first_row), Value(min(dates)),
+                               output_field=DateField()),
+            date__lte=max(dates),
+        ).order_by('date').values_list('date', 'holdings'))
+        holdings = forward_fill(
+            [date for (date, _) in rows], [value for (_, value) in rows], dates)
+        return (holdings + self.available).tolist()
+
+    def holdings_on(self, dates):
+        """
+        Computes the value of the stocks held on each of the given days from
+        the configs and quotes. This is what the materialized
+        :py:class:`stocks.models.BucketDailyValue` rows are built from, so
+        the quotes are read from the database instead of QUOTE_CACHE.
+        """
+        if not dates:
+            return []
+        configs = list(
+            self.get_stock_configs_between(min(dates), max(dates))
+            .order_by('id')
+            .values_list('stock_id', 'quantity', 'start', 'end')
+        )
+        series = QUOTE_CACHE.series_many((config[0] for config in configs), reload=True)
+        return holdings_values(configs, series, dates).tolist()
 
     def historical(self, count=None, skip=None):
         """
         Fetches the historical value of the bucket.
         """
-        res = []
         if count is None:
             count = 30
         if skip is None:
             skip = 0
-        for i in range(skip, count + skip):
-            date = datetime.datetime.now().date() - datetime.timedelta(days=i)
-            res.append((date, self.value_on(date)))
-        return res
+        today = datetime.datetime.now().date()
+        dates = [
+            today - datetime.timedelta(days=i)
+            for i in range(skip, count + skip)
+        ]
+        return list(zip(dates, self.values_on(dates)))
 
 
 class InvestmentBucketDescription(models.Model):
@@ -274,6 +594,322 @@ class InvestmentStockConfiguration(models.Model):
         return value
 
 
+class BucketDailyValue(models.Model):
+    """
+    Materialized value of the stocks an InvestmentBucket holds on each day,
+    from the start of its first config until today. The cash available to
+    the bucket is added when reading, so rows only change when quotes or
+    configs change.
+    """
+    bucket = models.ForeignKey(InvestmentBucket, related_name='daily_values')
+    date = models.DateField()
+    holdings = models.FloatField()
+
+    class Meta(object):
+        unique_together = ('bucket', 'date')
+        indexes = [
+            models.Index(
+                fields=['bucket', '-date', 'holdings'], name='stocks_bucket_value_idx'),
+        ]
+
+    @staticmethod
+    def refresh(bucket_ids, start=None):
+        """
+        Recomputes the rows of the buckets from start (or the start of their
+        first config) until today
+        """
+        today = datetime.datetime.now().date()
+        buckets = InvestmentBucket.objects.filter(id__in=bucket_ids).annotate(
+            first_start=Min('stocks__start'))
+        for bucket in buckets:
+            with transaction.atomic():
+                # Refreshes of the same bucket from other processes wait
+                # here, otherwise both would insert the same dates
+                InvestmentBucket.objects.select_for_update().get(id=bucket.id)
+                if bucket.first_start is None:
+                    bucket.daily_values.all().delete()
+                    continue
+                begin = bucket.first_start
+                if start is not None:
+                    begin = max(begin, _as_date(start))
+                bucket.daily_values.filter(
+                    Q(date__gte=begin) | Q(date__lt=bucket.first_start)).delete()
+                if begin > today:
+                    continue
+                dates = [
+                    begin + datetime.timedelta(days=i)
+                    for i in range((today - begin).days + 1)
+                ]
+                BucketDailyValue.objects.bulk_create([
+                    BucketDailyValue(bucket=bucket, date=date, holdings=holdings)
+                    for (date, holdings) in zip(dates, bucket.holdings_on(dates))
+                ], batch_size=300)
+
+    @staticmethod
+    def refresh_for_stock(stock_id, start):
+        """
+        Recomputes the rows of all buckets holding the stock from start on,
+        after quotes of the stock changed
+        """
+        BucketDailyValue.refresh(
+            InvestmentStockConfiguration.objects.filter(stock_id=stock_id).filter(
+                Q(end__gte=start) | Q(end=None),
+            ).values_list('bucket_id', flat=True).distinct(),
+            start,
+        )
+
+    @staticmethod
+    def verify(bucket_ids=None, tolerance=1e-6):
+        """
+        Compares the rows with the live computation
+
+        :returns: list of (bucket id, date, stored, computed) mismatches
+        """
+        today = datetime.datetime.now().date()
+        buckets = InvestmentBucket.objects.annotate(first_start=Min('stocks__start'))
+        if bucket_ids is not None:
+            buckets = buckets.filter(id__in=bucket_ids)
+        mismatches = []
+        for bucket in buckets:
+            stored = dict(bucket.daily_values.values_list('date', 'holdings'))
+            dates = []
+            if bucket.first_start is not None and bucket.first_start <= today:
+                dates = [
+                    bucket.first_start + datetime.timedelta(days=i)
+                    for i in range((today - bucket.first_start).days + 1)
+                ]
+            for (date, computed) in zip(dates, bucket.holdings_on(dates)):
+                value = stored.pop(date, None)
+                if value is None or abs(value - computed) > tolerance:
+                    mismatches.append((bucket.id, date, value, computed))
+            mismatches.extend(
+                (bucket.id, date, value, None) for (date, value) in stored.items())
+        return mismatches
+
+
+class TickerValidation(models.Model):
+    """
+    Remembers whether yahoo_historical knows a ticker, so validating a ticker
+    doesn't need a download every time (see
+    :py:func:`stocks.stock_helper.validate_ticker`)
+    """
+    ticker = models.CharField(max_length=32, unique=True)
+    valid = models.BooleanField()
+    checked = models.DateTimeField()
+
+
+class FillJob(models.Model):
+    """
+    A request to download missing quotes. Jobs are stored in the database
+    and processed by ``manage.py fill_worker``, so the web process only has
+    to enqueue them.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+    )
+    FILL = 'fill'
+    BACKFILL = 'backfill'
+    KIND_CHOICES = (
+        (FILL, 'Fill missing days'),
+        (BACKFILL, 'Backfill new stock'),
+    )
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default=FILL)
+    # True while a fill job is waiting or running, NULL otherwise. The unique
+    # constraint ignores NULLs, so at most one fill job can be active.
+    active = models.NullBooleanField(unique=True, editable=False)
+
+    @staticmethod
+    def active_fill():
+        """
+        Returns the fill job that is waiting or running, None if there is none
+        """
+        return FillJob.objects.filter(active=True).first()
+
+    @staticmethod
+    def enqueue():
+        """
+        Creates a job with one task per stock that has quotes. If a job is
+        still waiting or running, that one is returned instead, so
+        overlapping requests don't duplicate work.
+
+        :returns: tuple of the job and whether it was created.
+        """
+        job = FillJob.active_fill()
+        if job is not None:
+            return (job, False)
+        try:
+            with transaction.atomic():
+                job = FillJob.objects.create(kind=FillJob.FILL)
+                # Taking the flag with an update leaves the check to the unique
+                # constraint, which also sees jobs that aren't committed yet
+                FillJob.objects.filter(id=job.id).update(active=True)
+                job.active = True
+                FillTask.objects.bulk_create([
+                    FillTask(job=job, stock_id=stock_id)
+                    for stock_id in DailyStockQuote.objects.values_list(
+                        'stock_id', flat=True).distinct()
+                ])
+        except IntegrityError:
+            # A concurrent request created the active job after the lookup
+            return (FillJob.active_fill(), False)
+        return (job, True)
+
+    @staticmethod
+    def enqueue_backfill(stock, years=10):
+        """
+        Creates a job that downloads the last years of quotes for a new stock
+        """
+        today = datetime.datetime.now().date()
+        with transaction.atomic():
+            job = FillJob.objects.create(kind=FillJob.BACKFILL)
+            job.tasks.create(
+                stock=stock,
+                start=today.replace(year=today.year - years, day=min(today.day, 28)),
+            )
+        return job
+
+    def progress(self):
+        """
+        Returns a dict with the number of tasks per status
+        """
+        progress = {status: 0 for (status, _) in FillTask.STATUS_CHOICES}
+        progress.update(
+            self.tasks.values_list('status').annotate(count=models.Count('id'))
+        )
+        return progress
+
+    def finish_if_complete(self):
+        """
+        Marks the job as done once none of its tasks is waiting or running
+        """
+        if not self.tasks.filter(
+                status__in=[FillTask.PENDING, FillTask.RUNNING]).exists():
+            FillJob.objects.filter(id=self.id).exclude(status=FillJob.DONE).update(
+                status=FillJob.DONE, finished=timezone.now(), active=None)
+
+
+class FillTask(models.Model):
+    """
+    The part of a FillJob for a single stock. A worker leases the task while
+    it downloads the quotes, other workers skip it until the lease expires.
+    The outcome is checkpointed on the task as soon as the stock is saved, so
+    a restarted worker only picks up what is left.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+    job = models.ForeignKey(FillJob, related_name='tasks')
+    stock = models.ForeignKey(Stock, related_name='fill_tasks')
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    start = models.DateField(null=True, blank=True)
+    lease_owner = models.CharField(max_length=255, blank=True)
+    lease_expires = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    rows = models.IntegerField(default=0)
+    last_date = models.DateField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    class Meta(object):
+        unique_together = ('job', 'stock')
+
+
+class DataVersion(models.Model):
+    """
+    Counters that are bumped whenever a kind of data changes. Cached results
+    that depend on the data (see :py:mod:`BuyBitcoin.graphql_cache`) include
+    the counters in their key, so a bump invalidates them in every process.
+    """
+    QUOTES = 'quotes'
+    BUCKETS = 'buckets'
+    TRADES = 'trades'
+    BANKS = 'banks'
+    MUTATIONS = 'mutations'
+    ALL = (QUOTES, BUCKETS, TRADES, BANKS, MUTATIONS)
+
+    name = models.CharField(max_length=32, unique=True)
+    version = models.BigIntegerField(default=0)
+
+    @staticmethod
+    def current():
+        """
+        Returns a tuple with the version of every kind of data, in the
+        order of ALL
+        """
+        versions = dict(DataVersion.objects.values_list('name', 'version'))
+        return tuple(versions.get(name, 0) for name in DataVersion.ALL)
+
+    @staticmethod
+    def bump(*names):
+        """
+        Increments the counters of names once the current transaction
+        commits. Every writer shares these rows, so incrementing them inside
+        its transaction would hold their lock until the commit and serialize
+        all writers (e.g. all trades) on it.
+        """
+        transaction.on_commit(lambda: DataVersion._increment(names))
+
+    @staticmethod
+    def _increment(names):
+        """
+        Increments the counters of names right away
+        """
+        for name in names:
+            if not DataVersion.objects.filter(name=name).update(
+                    version=models.F('version') + 1):
+                try:
+                    with transaction.atomic():
+                        DataVersion.objects.create(name=name, version=1)
+                except IntegrityError:
+                    DataVersion.objects.filter(name=name).update(
+                        version=models.F('version') + 1)
+
+
+@receiver(post_save, sender=DailyStockQuote)
+@receiver(post_delete, sender=DailyStockQuote)
+def invalidate_quote_cache(instance, **_):
+    """
+    Drops the cached history of a stock whenever one of its quotes changes
+    """
+    QUOTE_CACHE.invalidate(instance.stock_id)
+    DataVersion.bump(DataVersion.QUOTES)
+
+
+@receiver(post_save, sender=DailyStockQuote)
+@receiver(post_delete, sender=DailyStockQuote)
+def refresh_bucket_values_for_quote(instance, **_):
+    """
+    Updates the materialized values of buckets holding the stock
+    """
+    BucketDailyValue.refresh_for_stock(instance.stock_id, _as_date(instance.date))
+
+
+@receiver(post_save, sender=InvestmentStockConfiguration)
+@receiver(post_delete, sender=InvestmentStockConfiguration)
+def refresh_bucket_config_values(instance, **_):
+    """
+    Updates the materialized values of a bucket when its holdings change
+    """
+    BucketDailyValue.refresh([instance.bucket_id], _as_date(instance.start))
+    DataVersion.bump(DataVersion.BUCKETS)
+
+
 @receiver(pre_save)
 def pre_save_any(sender, instance, *_args, **_kwargs):
     """
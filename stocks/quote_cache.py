@@ -0,0 +1,127 @@
+"""
+Process-wide cache for daily stock quotes. The history of every stock is kept
+as sorted NumPy arrays, which turns "latest quote on or before a date" into a
+binary search instead of a database query.
+"""
+import threading
+import time
+import numpy as np
+
+
+class QuoteSeries(object):
+    """
+    The complete quote history of a single stock, sorted by date
+    """
+    def __init__(self, stock_id, ids, dates, values):
+        self.stock_id = stock_id
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.dates = np.asarray(dates, dtype='datetime64[D]')
+        self.values = np.asarray(values, dtype=np.float64)
+        self.loaded_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.dates)
+
+    def index_on(self, date=None):
+        """
+        Returns the index of the latest quote on or before date, or -1 if
+        there is none
+        """
+        if date is None:
+            return len(self.dates) - 1
+        return int(np.searchsorted(
+            self.dates, np.datetime64(date, 'D'), side='right')) - 1
+
+    def indices_on(self, dates):
+        """
+        Vectorized version of index_on for an array of dates
+        """
+        return np.searchsorted(
+            self.dates, np.asarray(dates, dtype='datetime64[D]'), side='right') - 1
+
+    def row(self, idx):
+        """
+        Returns (id, date, value) of the quote at position idx
+        """
+        return (
+            int(self.ids[idx]),
+            self.dates[idx].item(),
+            float(self.values[idx]),
+        )
+
+
+class QuoteCache(object):
+    """
+    Keeps a QuoteSeries per stock. Series are loaded lazily through loader,
+    which receives a list of stock ids and returns (stock_id, id, date, value)
+    rows ordered by stock and date. Entries expire after max_age seconds so
+    processes that did not ingest the quotes themselves eventually catch up.
+    """
+    def __init__(self, loader, max_age=300):
+        self.loader = loader
+        self.max_age = max_age
+        self._series = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _is_fresh(self, series):
+        return (
+            series is not None and
+            (self.max_age is None or
+             time.monotonic() - series.loaded_at < self.max_age)
+        )
+
+    def series(self, stock_id):
+        """
+        Returns the QuoteSeries for a single stock
+        """
+        return self.series_many([stock_id])[stock_id]
+
+    def series_many(self, stock_ids, reload=False):
+        """
+        Returns a dict of stock id to QuoteSeries. All stocks that are not
+        cached yet are loaded with a single query.
+
+        :param reload: Load all stocks from the database, even if they are
+            cached. Use this when the result is stored, since quotes another
+            process ingested show up in the cache only after max_age.
+        """
+        stock_ids = set(stock_ids)
+        with self._lock:
+            generation = self._generation
+            result = {
+                stock_id: self._series.get(stock_id)
+                for stock_id in stock_ids
+            }
+        missing = [
+            stock_id for (stock_id, series) in result.items()
+            if reload or not self._is_fresh(series)
+        ]
+        if missing:
+            rows = {stock_id: ([], [], []) for stock_id in missing}
+            for (stock_id, quote_id, date, value) in self.loader(missing):
+                ids, dates, values = rows[stock_id]
+                ids.append(quote_id)
+                dates.append(date)
+                values.append(value)
+            loaded = {
+                stock_id: QuoteSeries(stock_id, *columns)
+                for (stock_id, columns) in rows.items()
+            }
+            with self._lock:
+                # Don't keep what we loaded if quotes changed in the meantime
+                if generation == self._generation:
+                    self._series.update(loaded)
+            result.update(loaded)
+        return result
+
+    def invalidate(self, stock_id=None):
+        """
+        Drops the cached history of a stock, or of all stocks if no id is given
+        """
+        with self._lock:
+            self._generation += 1
+            if stock_id is None:
+                self._series.clear()
+            else:
+                self._series.pop(stock_id, None)
@@ -1,8 +1,16 @@
 """
 A couple helper functions that help us get real data backing for stocks
 """
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
 from yahoo_historical import Fetcher
 import arrow
+from .fill_engine import FetchJob, HistoryFetcher
 
 
 def get_date_array_for_fetcher(arrow_date):
@@ -10,13 +18,103 @@ def get_date_array_for_fetcher(arrow_date):
     return [arrow_date.year, arrow_date.month, arrow_date.day]
 
 
+def _ticker_key(ticker):
+    return ticker.strip().upper()
+
+
+def _cached_validity(tickers):
+    """
+    Returns the cached validity of those tickers whose cache entry is still
+    fresh. Valid and invalid tickers expire after different TTLs.
+    """
+    now = timezone.now()
+    valid_after = now - datetime.timedelta(seconds=settings.TICKER_VALID_TTL)
+    invalid_after = now - datetime.timedelta(seconds=settings.TICKER_INVALID_TTL)
+    ticker_validation = apps.get_model('stocks', 'TickerValidation')
+    return {
+        ticker: valid
+        for (ticker, valid, checked) in ticker_validation.objects.filter(
+            ticker__in=tickers).values_list('ticker', 'valid', 'checked')
+        if checked > (valid_after if valid else invalid_after)
+    }
+
+
+def _remember_validity(validity):
+    """
+    Stores the result of live checks, a dict of ticker to validity. Existing
+    rows are updated in place, if a concurrent check inserted the ticker
+    first, its row is updated instead.
+    """
+    ticker_validation = apps.get_model('stocks', 'TickerValidation')
+    now = timezone.now()
+    for (ticker, valid) in validity.items():
+        fields = {'valid': valid, 'checked': now}
+        if ticker_validation.objects.filter(ticker=ticker).update(**fields):
+            continue
+        try:
+            with transaction.atomic():
+                # bulk_create leaves the duplicate check to the database
+                ticker_validation.objects.bulk_create([
+                    ticker_validation(ticker=ticker, **fields)])
+        except IntegrityError:
+            ticker_validation.objects.filter(ticker=ticker).update(**fields)
+
+
 def validate_ticker(ticker):
-    """Function that validates ticker from yahoo_historical api"""
+    """
+    Function that validates ticker from yahoo_historical api. Results are
+    cached in :py:class:`stocks.models.TickerValidation`, only unknown or
+    expired tickers are downloaded.
+    """
+    key = _ticker_key(ticker)
+    cached = _cached_validity([key])
+    if key in cached:
+        return cached[key]
     now = arrow.now()
     now = get_date_array_for_fetcher(now)
     try:
         fetcher = Fetcher(ticker, now, now)
         fetcher.getHistorical()
+        valid = True
     except KeyError:
-        return False
-    return True
+        valid = False
+    _remember_validity({key: valid})
+    return valid
+
+
+def validate_tickers(tickers, workers=None, rate=None):
+    """
+    Validates many tickers in one pass, e.g. to seed the list of stocks.
+    Cached tickers are answered from a single query, the others are checked
+    concurrently with the rate limits and retries of
+    :py:class:`stocks.fill_engine.HistoryFetcher`.
+
+    :param tickers: Iterable of ticker symbols.
+    :returns: dict of ticker to True / False, or None if the ticker could not
+        be checked (e.g. the provider was unreachable). Those are not cached.
+    """
+    keys = {ticker: _ticker_key(ticker) for ticker in tickers}
+    validity = _cached_validity(set(keys.values()))
+    missing = sorted(set(keys.values()) - set(validity))
+    if missing:
+        fetcher = HistoryFetcher(
+            rate=settings.FILL_RATE_PER_HOST if rate is None else rate,
+            retries=settings.FILL_RETRIES,
+        )
+        now = get_date_array_for_fetcher(arrow.now())
+        with ThreadPoolExecutor(max_workers=workers or settings.FILL_WORKERS) as pool:
+            checks = pool.map(
+                lambda key: fetcher.fetch(FetchJob(key, None, now, now)), missing)
+            checked = {}
+            for (key, (_, _, error)) in zip(missing, checks):
+                if error is None or isinstance(error, KeyError):
+                    checked[key] = error is None
+        _remember_validity(checked)
+        validity.update(checked)
+    return {ticker: validity.get(key) for (ticker, key) in keys.items()}
+
+
+def ticker_validator(ticker):
+    """Field validator that rejects tickers unknown to yahoo_historical"""
+    if not validate_ticker(ticker):
+        raise ValidationError("Invalid Ticker")
@@ -0,0 +1,55 @@
+"""
+Vectorized valuation helpers. They work on plain arrays and QuoteSeries, so
+callers can load everything they need up front and value many days at once.
+"""
+import datetime
+import numpy as np
+
+
+def holdings_values(configs, series, dates):
+    """
+    Computes the value of a set of stock configurations for every date.
+
+    :param configs: (stock_id, quantity, start, end) tuples. The order matters
+        for floating point equality with the day by day computation.
+    :param series: dict of stock id to :py:class:`stocks.quote_cache.QuoteSeries`
+    :param dates: list of dates to value the configurations on.
+    :returns: numpy array with one value per date.
+    """
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    total = np.zeros(len(dates))
+    not_future = dates <= np.datetime64(datetime.datetime.now().date(), 'D')
+    for (stock_id, quantity, start, end) in configs:
+        quotes = series[stock_id]
+        if not quotes:
+            continue
+        # Forward fill: every date gets the latest quote on or before it
+        idx = quotes.indices_on(dates)
+        values = quotes.values[np.maximum(idx, 0)] * quantity
+        active = not_future & (idx >= 0) & (dates >= np.datetime64(start, 'D'))
+        if end is not None:
+            active &= dates <= np.datetime64(end, 'D')
+        active &= ~np.isnan(values)
+        total += np.where(active, values, 0.0)
+    return total
+
+
+def forward_fill(row_dates, row_values, dates):
+    """
+    Looks up a daily series that may end before some of the dates. Every date
+    gets the last row on or before it, dates before the first row and future
+    dates get 0.0.
+
+    :param row_dates: sorted dates of the stored rows.
+    :param row_values: value of each row.
+    :param dates: list of dates to look up.
+    :returns: numpy array with one value per date.
+    """
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    row_dates = np.asarray(row_dates, dtype='datetime64[D]')
+    row_values = np.asarray(row_values, dtype=np.float64)
+    if not len(row_dates):  # pylint: disable=len-as-condition
+        return np.zeros(len(dates))
+    idx = np.searchsorted(row_dates, dates, side='right') - 1
+    not_future = dates <= np.datetime64(datetime.datetime.now().date(), 'D')
+    return np.where(not_future & (idx >= 0), row_values[np.maximum(idx, 0)], 0.0)
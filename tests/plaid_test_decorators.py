@@ -74,36 +74,39 @@ def mock_plaid_accounts(func):
     return new_patch(func)
 
 
-def transactions_side(_, start_date, end_date):
+def transactions_side(_, start_date, end_date, count=None, offset=None):
     '''
     Helper function for mocking Transactions get
     '''
-    start_date = datetime.datetime.strptime(start_date, "%Y-%m-%d")
-    end_date = datetime.datetime.strptime(end_date, "%Y-%m-%d")
+    def day(days):
+        return (datetime.datetime.now() - datetime.timedelta(days=days)).strftime("%Y-%m-%d")
+
     data = [
         {
-            'date': datetime.datetime.now() - datetime.timedelta(days=10),
+            'date': day(10),
             'amount': -150,
         },
         {
-            'date': datetime.datetime.now() - datetime.timedelta(days=13),
+            'date': day(13),
             'amount': 1000,
         },
         {
-            'date': datetime.datetime.now() - datetime.timedelta(days=13),
+            'date': day(13),
             'amount': 125,
         },
         {
-            'date': datetime.datetime.now() - datetime.timedelta(days=20),
+            'date': day(20),
             'amount': 10,
         },
     ]
 
     data_filtered = list(
-        filter(lambda x: x['date'] > start_date and x['date'] < end_date,
+        filter(lambda x: start_date <= x['date'] <= end_date,
                data))
+    offset = offset or 0
     return {
-        'transactions': data_filtered
+        'transactions': data_filtered[offset:offset + (count or 100)],
+        'total_transactions': len(data_filtered),
     }
 
 
@@ -1,8 +1,17 @@
 """
 Tests for authentication models
 """
+import copy
+import datetime
+import pickle
+import threading
+from unittest import mock
 import pytest
 from django.contrib.auth.models import User
+from django.db import connection
+from django.utils import timezone
+from plaid.api.accounts import Balance
+from plaid.api.transactions import Transactions
 from authentication.models import UserBank
 from test_plaid import setup_module as setup_plaid, \
     teardown_module as teardown_plaid
@@ -54,6 +63,72 @@ def test_user_bank_current_balance():
     assert ub1.current_balance() == -9.0
 
 
+@mock_plaid_balance
+@pytest.mark.django_db(transaction=True)
+def test_bank_balance_consistency():
+    """
+    Test cached, bounded staleness and forced balance reads
+    """
+    # pylint: disable=no-member
+    user1 = User.objects.create(username='user1', password="a")
+    ub1 = UserBank.objects.create(
+        user=user1, item_id="hi", access_token="Bye",
+        institution_name="bankofcool", current_balance_field=10,
+        balance_updated=timezone.now(),
+        account_name_field="coolaccount", income_field=30,
+        expenditure_field=5
+    )
+    with mock.patch('django.conf.settings.PLAID_BALANCE_MAX_AGE', 300):
+        assert ub1.current_balance() == 10
+        assert ub1.current_balance(max_age=3600) == 10
+        assert Balance.get.call_count == 0
+        assert ub1.current_balance(max_age=0) == -9.0
+        assert Balance.get.call_count == 1
+        UserBank.objects.filter(id=ub1.id).update(
+            current_balance_field=5,
+            balance_updated=timezone.now() - datetime.timedelta(seconds=600))
+        ub1 = UserBank.objects.get(id=ub1.id)
+        assert ub1.current_balance(False) == 5
+        assert ub1.current_balance(max_age=3600) == 5
+        assert ub1.current_balance() == -9.0
+        assert Balance.get.call_count == 2
+    assert UserBank.objects.get(id=ub1.id).current_balance_field == -9.0
+    # pylint: enable=no-member
+
+
+@mock_plaid_balance
+@pytest.mark.django_db(transaction=True)
+def test_user_bank_refresh_stale():
+    """
+    Test that only stale balances of active users are refreshed
+    """
+    now = timezone.now()
+    banks = {}
+    for (name, last_login, updated) in [
+            ('fresh', now, now),
+            ('stale', now, now - datetime.timedelta(hours=1)),
+            ('never', now, None),
+            ('inactive', now - datetime.timedelta(days=30), None)]:
+        user = User.objects.create(username=name, password="a", last_login=last_login)
+        banks[name] = UserBank.objects.create(
+            user=user, item_id="hi", access_token="Bye",
+            institution_name="bankofcool", current_balance_field=10,
+            balance_updated=updated,
+            account_name_field="coolaccount", income_field=30,
+            expenditure_field=5
+        )
+    (refreshed, failed) = UserBank.refresh_stale(max_age=60, active_days=7)
+    assert failed == {}
+    assert sorted(bank.id for bank in refreshed) == sorted(
+        [banks['stale'].id, banks['never'].id])
+    balances = dict(UserBank.objects.values_list('id', 'current_balance_field'))
+    assert balances[banks['fresh'].id] == 10
+    assert balances[banks['stale'].id] == -9.0
+    assert balances[banks['never'].id] == -9.0
+    assert balances[banks['inactive'].id] == 10
+    assert UserBank.refresh_stale(max_age=60, active_days=7) == ([], {})
+
+
 @mock_plaid_accounts
 @pytest.mark.django_db(transaction=True)
 def test_user_bank_account_name():
@@ -86,9 +161,10 @@ def test_user_bank_income():
         expenditure_field=5
     )
     ub1.save()
-    assert ub1.income(update=False) == 30
-    assert ub1.income(days=13) == 1125.0
+    assert ub1.income() == 30
+    assert ub1.income(days=13, update=True) == 1125.0
     assert ub1.income() == 1135.0
+    assert UserBank.objects.get(id=ub1.id).income() == 1135.0
 
 
 @mock_plaid_transactions
@@ -105,5 +181,86 @@ def test_expenditures():
         expenditure_field=-5
     )
     ub1.save()
-    assert ub1.expenditure(update=False) == -5
-    assert ub1.expenditure() == -150
+    assert ub1.expenditure() == -5
+    assert ub1.expenditure(update=True) == -150
+    assert UserBank.objects.get(id=ub1.id).expenditure(days=5) == 0.0
+
+
+@mock_plaid_transactions
+@pytest.mark.django_db(transaction=True)
+def test_bank_local_transactions():
+    """
+    Test that history, income and expenditure are computed from the stored
+    transactions and syncs only fetch the days since the last one
+    """
+    # pylint: disable=no-member
+    user1 = User.objects.create(username='user1', password="a")
+    ub1 = UserBank.objects.create(
+        user=user1, item_id="hi", access_token="Bye",
+        institution_name="bankofcool", current_balance_field=10,
+        account_name_field="coolaccount", income_field=30,
+        expenditure_field=5
+    )
+
+    def day(days):
+        return str(datetime.date.today() - datetime.timedelta(days=days))
+
+    assert ub1.historical_data(day(60)) == [
+        (day(0), 10), (day(10), 160.0), (day(13), -965.0), (day(20), -975.0)]
+    assert ub1.transactions.count() == 4
+    assert Transactions.get.call_count == 1
+    ub1 = UserBank.objects.get(id=ub1.id)
+    assert ub1.historical_data(day(15)) == [(day(0), 10), (day(10), 160.0), (day(13), -965.0)]
+    assert ub1.income(days=13) == 1125.0
+    assert ub1.expenditure() == -150.0
+    assert Transactions.get.call_count == 1
+    UserBank.objects.filter(id=ub1.id).update(transactions_synced=day(12))
+    ub1 = UserBank.objects.get(id=ub1.id)
+    assert ub1.expenditure(update=True) == -150.0
+    assert Transactions.get.call_count == 2
+    assert Transactions.get.call_args[1]['start_date'] == day(12)
+    assert ub1.transactions.count() == 4
+    user1.last_login = timezone.now()
+    user1.save()
+    assert UserBank.sync_stale_transactions() == ([], {})
+    UserBank.objects.filter(id=ub1.id).update(transactions_synced=day(1))
+    (synced, failed) = UserBank.sync_stale_transactions()
+    assert [bank.id for bank in synced] == [ub1.id] and failed == {}
+    assert Transactions.get.call_count == 3
+    # pylint: enable=no-member
+
+
+@mock_plaid_balance
+@pytest.mark.django_db(transaction=True)
+def test_bank_balance_shared():
+    """
+    Test that concurrent accessors of one bank share a single remote call
+    """
+    # pylint: disable=no-member
+    user1 = User.objects.create(username='user1', password="a")
+    ub1 = UserBank.objects.create(
+        user=user1, item_id="hi", access_token="Bye",
+        institution_name="bankofcool", current_balance_field=10,
+        account_name_field="coolaccount", income_field=30,
+        expenditure_field=5
+    )
+    ub1 = UserBank.objects.get(id=ub1.id)
+    balances = []
+
+    def read():
+        try:
+            balances.append(ub1.current_balance())
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=read) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert balances == [-9.0] * 8
+    assert Balance.get.call_count == 1
+    for clone in (pickle.loads(pickle.dumps(ub1)), copy.deepcopy(ub1)):
+        assert clone.current_balance_field == -9.0
+        assert clone.plaid() is not ub1.plaid()
+    # pylint: enable=no-member
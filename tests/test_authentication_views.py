@@ -1,10 +1,13 @@
 """
 Tests for the authentication views
 """
+import datetime
+from unittest import mock
 import pytest
 from django.test import Client
 from django.contrib.auth.models import User
 from authentication.models import UserBank
+from authentication.plaid_wrapper import PlaidAPI
 
 
 @pytest.mark.django_db(transaction=True)
@@ -56,6 +59,25 @@ def test_access_token():
     false_get = test_client.get("/plaid/get_access_token/")
     response_code = false_get.status_code
     assert response_code == 403
+    today = datetime.date.today()
+    client = mock.MagicMock()
+    client.Item.public_token.exchange.return_value = {
+        'access_token': 'token', 'item_id': 'item'}
+    client.Item.get.return_value = {'item': {'institution_id': 'bank'}}
+    client.Accounts.balance.get.return_value = {'accounts': [
+        {'balances': {'available': 100}, 'subtype': 'checking'}]}
+    client.Accounts.get.return_value = {'accounts': [{'name': 'account'}]}
+    client.Transactions.get.return_value = {'total_transactions': 2, 'transactions': [
+        {'date': str(today), 'amount': 20, 'transaction_id': 'a'},
+        {'date': str(today), 'amount': -5, 'transaction_id': 'b'},
+    ]}
+    with mock.patch.object(PlaidAPI, 'client', return_value=client):
+        linked = test_client.post("/plaid/get_access_token/", {'public_token': 'public'})
+    assert linked.status_code == 201
+    assert client.Transactions.get.call_count == 1
+    bank = user1.userbank.get()
+    assert (bank.income(), bank.expenditure()) == (20, -5)
+    assert bank.transactions.count() == 2
 
 
 @pytest.mark.django_db(transaction=True)
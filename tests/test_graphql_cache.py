@@ -0,0 +1,147 @@
+"""
+Tests the response cache and persisted queries of the /graphql endpoint
+"""
+import json
+import pytest
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from BuyBitcoin.graphql_cache import AsyncGraphQLView, DOCUMENTS, query_hash
+from stocks.models import DataVersion, Stock
+import test_stocks_model as stock_test
+
+VIEWER_QUERY = """
+query {
+  viewer {
+    profile {
+      tradingAccounts {
+        edges {
+          node {
+            accountName
+            trades { edges { node { quantity } } }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+
+def setup_module(module):
+    """
+    Mock out any externals
+    """
+    stock_test.setup_module(module)
+
+
+def teardown_module(module):
+    """
+    Restore externals
+    """
+    stock_test.teardown_module(module)
+
+
+def post(client, **body):
+    """
+    Posts body as JSON to /graphql
+    """
+    return client.post('/graphql', json.dumps(body), content_type='application/json')
+
+
+def create_client():
+    """
+    Creates a user with a trading account and a client logged in as them
+    """
+    caches['default'].clear()
+    DOCUMENTS.clear()
+    user = User.objects.create(username='user1', password="a")
+    account = user.profile.trading_accounts.create(account_name="acc")
+    client = Client()
+    client.force_login(user)
+    return (client, account)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_graphql_response_cache():
+    """
+    Repeated queries are served from the cache until data they depend on
+    changes
+    """
+    (client, account) = create_client()
+    first = post(client, query=VIEWER_QUERY)
+    assert first['X-GraphQL-Cache'] == 'miss'
+    with CaptureQueriesContext(connection) as queries:
+        second = post(client, query=" ".join(VIEWER_QUERY.split()))
+    assert second['X-GraphQL-Cache'] == 'hit'
+    assert second.content == first.content
+    # Session, user, data versions and the cached result
+    assert len(queries.captured_queries) <= 4
+
+    stock = Stock.objects.create(name="Google", ticker="GOOGL")
+    stock.daily_quote.create(value=10, date="2017-05-08")
+    account.trades.create(stock=stock, quantity=2)
+    third = post(client, query=VIEWER_QUERY)
+    assert third['X-GraphQL-Cache'] == 'miss'
+    trades = json.loads(third.content)['data']['viewer']['profile'][
+        'tradingAccounts']['edges'][0]['node']['trades']['edges']
+    assert trades == [{'node': {'quantity': 2.0}}]
+
+    assert post(client, query=VIEWER_QUERY)['X-GraphQL-Cache'] == 'hit'
+    versions = DataVersion.current()
+    mutation = post(client, query="""
+        mutation { addTradingAccount(name: "acc2") { account { accountName } } }
+    """)
+    assert 'X-GraphQL-Cache' not in mutation
+    assert 'errors' not in json.loads(mutation.content)
+    assert DataVersion.current() != versions
+    assert post(client, query=VIEWER_QUERY)['X-GraphQL-Cache'] == 'miss'
+    versions = DataVersion.current()
+    with transaction.atomic():
+        DataVersion.bump(DataVersion.TRADES)
+        # Bumped once the transaction commits, not under its locks
+        assert DataVersion.current() == versions
+    assert DataVersion.current() != versions
+
+    other = Client()
+    other.force_login(User.objects.create(username='user2', password="a"))
+    assert post(other, query=VIEWER_QUERY)['X-GraphQL-Cache'] == 'miss'
+    broken = post(client, query="query { viewer { unknownField } }")
+    assert broken.status_code == 400
+
+
+@pytest.mark.django_db(transaction=True)
+def test_graphql_persisted_queries():
+    """
+    Queries can be sent as their hash once the server has seen them
+    """
+    (client, _) = create_client()
+    digest = {'persistedQuery': {'version': 1, 'sha256Hash': query_hash(VIEWER_QUERY)}}
+    unknown = json.loads(post(client, extensions=digest).content)
+    assert unknown['errors'][0]['message'] == 'PersistedQueryNotFound'
+    registered = post(client, query=VIEWER_QUERY, extensions=digest)
+    assert registered.status_code == 200
+    persisted = post(client, extensions=digest)
+    assert persisted.status_code == 200
+    assert persisted['X-GraphQL-Cache'] == 'hit'
+    assert persisted.content == registered.content
+    mismatch = post(client, query="query { viewer { id } }", extensions=digest)
+    assert mismatch.status_code == 400
+
+
+@pytest.mark.django_db(transaction=True)
+def test_graphql_asyncio_view():
+    """
+    The asyncio execution mode serves the same responses through the view
+    """
+    (_, account) = create_client()
+    request = RequestFactory().post(
+        '/graphql', json.dumps({'query': VIEWER_QUERY}), content_type='application/json')
+    request.user = account.profile.user
+    response = AsyncGraphQLView.as_view()(request)
+    assert response.status_code == 200
+    assert response['X-GraphQL-Cache'] == 'miss'
+    accounts = json.loads(response.content)['data']['viewer']['profile']['tradingAccounts']
+    assert accounts['edges'][0]['node'] == {'accountName': 'acc', 'trades': {'edges': []}}
@@ -0,0 +1,155 @@
+"""
+Tests the static cost analysis and the cost budgets of the /graphql endpoint
+"""
+import datetime
+import json
+from unittest import mock
+import pytest
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.test import Client
+from graphql import parse
+from graphql.utils.get_operation_ast import get_operation_ast
+from graphql_relay.node.node import to_global_id
+from BuyBitcoin.graphene_schema import SCHEMA
+from BuyBitcoin.graphql_cost import LIST_SIZES, query_cost
+from stocks.models import InvestmentBucket
+import test_stocks_model as stock_test
+
+BUCKET_QUERY = """
+query Bucket($id: ID!, $count: Int) {
+  investBucket(idValue: $id) { name history(count: $count) { date value } }
+}
+"""
+
+
+def setup_module(module):
+    """
+    Mock out any externals
+    """
+    stock_test.setup_module(module)
+
+
+def teardown_module(module):
+    """
+    Restore externals
+    """
+    stock_test.teardown_module(module)
+
+
+def cost(query, variables=None):
+    """
+    Cost of the only operation of query
+    """
+    document = parse(query)
+    return query_cost(SCHEMA, document, get_operation_ast(document), variables)
+
+
+def post(client, **body):
+    """
+    Posts body as JSON to /graphql
+    """
+    return client.post('/graphql', json.dumps(body), content_type='application/json')
+
+
+def test_query_cost():
+    """
+    Objects cost a point each, lists and connections multiply their
+    selection by the number of items their arguments ask for
+    """
+    assert cost(BUCKET_QUERY, {'count': 30}) == 1 + 30
+    assert cost(BUCKET_QUERY, {'count': 100000}) == 1 + 100000
+    assert cost(BUCKET_QUERY) == 1 + LIST_SIZES[('GInvestmentBucket', 'history')]
+    # maxPoints only caps the items the selection is charged for
+    assert cost("""
+        {
+          viewer {
+            profile {
+              stockFind(text: "GO", first: 1) {
+                quoteInRange(start: "2017-01-01", end: "2017-12-31", maxPoints: 3) {
+                  value
+                  stock { name }
+                }
+              }
+            }
+          }
+        }
+    """) == 1 + 1 + 1 * (1 + 365 * 1 + 3 * 1)
+    assert cost("""
+        {
+          viewer {
+            profile {
+              stockFind(text: "GO", first: 5) {
+                quoteInRange(start: "2017-01-01", end: "2017-01-31") { value }
+              }
+            }
+          }
+        }
+    """) == 1 + 1 + 5 * (1 + 31)
+    start = (datetime.date.today() - datetime.timedelta(days=9)).isoformat()
+    assert cost("""
+        fragment bank on GUserBank { balance history(start: "%s") { value } }
+        {
+          viewer {
+            userbank(first: 3) { edges { node { ...bank } } }
+            profile { investSuggestions { edges { node { ... on GInvestmentBucket { name } } } } }
+          }
+        }
+    """ % start) == 1 + 3 * (1 + 1 + 1 + 10) + 1 + 100 * (1 + 1 + 1)
+    assert cost("""
+        {
+          viewer {
+            profile {
+              stockFind(text: "GO", first: 2) {
+                first: quoteSeries(first: 50, points: 10) { points }
+                all: quoteSeries(start: "2000-01-01") { points pageInfo { hasNextPage } }
+              }
+            }
+          }
+        }
+    """) == 1 + 1 + 2 * (1 + 50 * 1 + settings.QUOTE_SERIES_PAGE_SIZE * (1 + 1))
+    assert cost("{ __schema { types { name } } }") == 0
+
+
+@pytest.mark.django_db(transaction=True)
+def test_graphql_cost_limits():
+    """
+    Expensive queries are rejected before execution, the cost is reported
+    and viewers over their budget are throttled
+    """
+    caches['default'].clear()
+    client = Client()
+    user = User.objects.create(username='user1', password="a")
+    client.force_login(user)
+    bucket = InvestmentBucket.objects.create(
+        name='bucket', public=False, available=10, owner=user.profile)
+
+    def query(count):
+        return post(client, query=BUCKET_QUERY, variables={
+            'id': to_global_id('GInvestmentBucket', bucket.id), 'count': count})
+
+    rejected = query(100000)
+    assert rejected.status_code == 400
+    body = json.loads(rejected.content.decode('utf-8'))
+    assert 'exceeds the maximum' in body['errors'][0]['message']
+    assert body['extensions']['cost']['requestedQueryCost'] == 100001
+    assert 'data' not in body
+
+    with mock.patch('django.conf.settings.GRAPHQL_COST_BUDGET', 70), \
+            mock.patch('django.conf.settings.GRAPHQL_COST_WINDOW', 10 ** 6):
+        first = query(30)
+        assert first.status_code == 200
+        assert json.loads(first.content.decode('utf-8'))['extensions']['cost'][
+            'requestedQueryCost'] == 31
+        assert first['X-GraphQL-Cost-Remaining'] == '39'
+        cached = query(30)
+        assert cached['X-GraphQL-Cache'] == 'hit'
+        assert 'X-GraphQL-Cost-Remaining' not in cached
+        assert query(31).status_code == 200
+        throttled = query(32)
+        assert throttled.status_code == 429
+        assert int(throttled['Retry-After']) > 0
+        assert throttled['X-GraphQL-Cost-Remaining'] == '7'
+        assert 'budget' in json.loads(throttled.content.decode('utf-8'))['errors'][0]['message']
+        assert query(6).status_code == 200
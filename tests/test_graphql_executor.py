@@ -0,0 +1,121 @@
+"""
+Tests the bounded resolver pool of the /graphql endpoint
+"""
+import json
+import threading
+import time
+import pytest
+from django.contrib.auth.models import User
+from django.test import Client, RequestFactory
+from graphql import execute, parse
+from promise import Promise
+from BuyBitcoin.graphene_schema import SCHEMA
+from BuyBitcoin.graphql_executor import PooledExecutor, ResolverPool
+import test_stocks_model as stock_test
+
+QUERY = """
+{
+  viewer {
+    username
+    profile { tradingAccounts { edges { node { accountName totalValue } } } }
+  }
+}
+"""
+
+
+def setup_module(module):
+    """
+    Mock out any externals
+    """
+    stock_test.setup_module(module)
+
+
+def teardown_module(module):
+    """
+    Restore externals
+    """
+    stock_test.teardown_module(module)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_pooled_matches_sync():
+    """
+    Queries resolve on the pool like without an executor and every resolver
+    is timed
+    """
+    user = User.objects.create(username='user1', password="a")
+    user.profile.trading_accounts.create(account_name="acc")
+    request = RequestFactory().post('/graphql')
+    request.user = user
+    expected = execute(SCHEMA, parse(QUERY), context_value=request)
+    assert not expected.errors
+    pool = ResolverPool(workers=2, queue_depth=1)
+    result = execute(
+        SCHEMA, parse(QUERY), context_value=request, executor=PooledExecutor(pool))
+    assert not result.errors
+    assert result.data == expected.data
+    stats = pool.stats()
+    assert stats['resolvers']['GUser.username']['count'] == 1
+    assert stats['resolvers']['GTradingAccount.accountName']['count'] == 1
+    assert stats['submitted'] + stats['inline'] == sum(
+        timing['count'] for timing in stats['resolvers'].values())
+    assert stats['queue_wait']['count'] == stats['submitted']
+    assert stats['busy'] == 0 and stats['pending'] == 0
+    assert stats['db_connections'] <= 2
+
+
+def test_resolver_pool_backpressure():
+    """
+    A full queue makes the caller run the resolver, so no more than workers
+    resolvers run on the pool at once
+    """
+    pool = ResolverPool(workers=2, queue_depth=2)
+    release = threading.Event()
+    lock = threading.Lock()
+    running = {'now': 0, 'peak': 0}
+
+    def resolver():
+        if not threading.current_thread().name.startswith('graphql'):
+            return 'inline'
+        with lock:
+            running['now'] += 1
+            running['peak'] = max(running['peak'], running['now'])
+        release.wait(5)
+        time.sleep(0.01)
+        with lock:
+            running['now'] -= 1
+        return 'pool'
+
+    promises = [Promise() for _ in range(6)]
+    futures = [pool.submit('Query.slow', promise, resolver, (), {}) for promise in promises]
+    assert [future is None for future in futures] == [False] * 4 + [True] * 2
+    release.set()
+    for future in futures[:4]:
+        future.result()
+    assert [promise.get() for promise in promises] == ['pool'] * 4 + ['inline'] * 2
+    assert running['peak'] == 2
+    stats = pool.stats()
+    assert (stats['submitted'], stats['inline']) == (4, 2)
+    assert 2 <= stats['peak_pending'] <= 4
+    assert stats['resolvers']['Query.slow']['count'] == 6
+    assert stats['resolvers']['Query.slow']['max_ms'] >= 10
+    assert stats['queue_wait']['max_ms'] >= 10
+    pool.reset()
+    assert pool.stats()['resolvers'] == {}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_graphql_stats_view():
+    """
+    Only staff users can read the pool metrics
+    """
+    client = Client()
+    user = User.objects.create(username='user1', password="a")
+    client.force_login(user)
+    assert client.get('/graphql/stats').status_code == 403
+    user.is_staff = True
+    user.save()
+    response = client.get('/graphql/stats')
+    assert response.status_code == 200
+    assert {'workers', 'queue_wait', 'db_connections', 'resolvers'} <= set(
+        json.loads(response.content.decode('utf-8')))
@@ -2,11 +2,15 @@
 Tests Plaid
 '''
 import datetime
+import json
+import time
 from unittest import mock
 import pytest
 import authentication.plaid_wrapper as PlaidMiddleware
 import plaid
+from plaid.api.accounts import Accounts, Balance
 from plaid.api.transactions import Transactions
+from plaid.errors import PlaidError
 from plaid_test_decorators import mock_plaid_balance, \
     mock_plaid_accounts, mock_plaid_transactions
 
@@ -126,3 +130,80 @@ def test_expenditure():
     assert expenditure == -150
     expenditure2 = user.expenditure(days=5)
     assert expenditure2 == 0.0
+
+
+@mock_plaid_transactions
+@mock.patch.object(PlaidMiddleware.PlaidAPI, 'PAGE_SIZE', 1)
+@pytest.mark.django_db(transaction=True)
+def test_stream_transactions():
+    '''
+    Testing that transactions are streamed page by page with a bounded
+    prefetch
+    '''
+    client = plaid.Client(client_id='', secret='', public_key='', environment='')
+    user = PlaidMiddleware.PlaidAPI(access_token='', client=client)
+    # pylint: disable=no-member
+    start = datetime.datetime.now() - datetime.timedelta(days=30)
+    assert user.income() == 1135.0
+    assert Transactions.get.call_count == 4
+    for prefetch in [0, 1]:
+        Transactions.get.reset_mock()
+        stream = user.stream_transactions(start, datetime.datetime.now(), prefetch=prefetch)
+        assert next(stream)['amount'] == -150
+        time.sleep(0.2)
+        assert Transactions.get.call_count <= 2 + prefetch
+        stream.close()
+    Transactions.get.side_effect = IOError("Connection reset")
+    with pytest.raises(IOError):
+        list(user.stream_transactions(start, datetime.datetime.now()))
+    # pylint: enable=no-member
+
+
+@mock_plaid_balance
+@mock_plaid_accounts
+@pytest.mark.django_db(transaction=True)
+def test_shared_client():
+    '''
+    Testing that PlaidAPI instances share one pooled client but memoize
+    their balance and name on their own
+    '''
+    # pylint: disable=no-member
+    first = PlaidMiddleware.PlaidAPI(access_token='first')
+    second = PlaidMiddleware.PlaidAPI(access_token='second')
+    assert first.plaid is second.plaid
+    assert isinstance(first.plaid, PlaidMiddleware.PooledClient)
+    assert first.current_balance() == -9.0
+    assert first.current_balance() == -9.0
+    assert first.account_name() == first.account_name() == 'Test Account'
+    assert second.balance is None and second.name is None
+    assert Balance.get.call_count == 1
+    assert Accounts.get.call_count == 1
+    assert first.current_balance(refresh=True) == -9.0
+    assert Balance.get.call_count == 2
+    # pylint: enable=no-member
+
+
+@mock.patch.object(plaid.requester, 'requests', plaid.requester.requests)
+@mock.patch.object(PlaidMiddleware.PlaidAPI, 'shared_client', None)
+@mock.patch.object(PlaidMiddleware.PlaidAPI, 'PLAID_ENV', 'sandbox')
+def test_pooled_client_session():
+    '''
+    Testing that the shared client sends every request through its session
+    and raises plaid errors
+    '''
+    client = PlaidMiddleware.PlaidAPI.client()
+    assert isinstance(client, PlaidMiddleware.PooledClient)
+    client.session = mock.MagicMock()
+    client.session.post.return_value.text = json.dumps({'accounts': []})
+    assert client.Accounts.get('token') == {'accounts': []}
+    assert client.Accounts.get('token') == {'accounts': []}
+    assert client.session.post.call_count == 2
+    (url, ) = client.session.post.call_args[0]
+    assert url == 'https://sandbox.plaid.com/accounts/get'
+    assert client.session.post.call_args[1]['json']['access_token'] == 'token'
+    client.session.post.return_value.text = json.dumps({
+        'error_type': 'ITEM_ERROR', 'error_code': 'ITEM_LOGIN_REQUIRED',
+        'error_message': 'login required', 'display_message': None,
+    })
+    with pytest.raises(PlaidError):
+        client.Accounts.get('token')
@@ -0,0 +1,66 @@
+"""
+Tests the downsampling of chart series
+"""
+import datetime
+import io
+import numpy
+from django.core.management import call_command
+from stocks.downsampling import LTTB, MIN_MAX, downsample, lttb, min_max
+
+
+def test_lttb():
+    """
+    LTTB keeps the ends, returns threshold points in order and keeps spikes
+    """
+    dates = numpy.arange(1000, dtype=float)
+    values = numpy.sin(dates / 50)
+    values[500] = 10
+    kept = lttb(dates, values, 100)
+    assert len(kept) == 100
+    assert (kept[0], kept[-1]) == (0, 999)
+    assert (numpy.diff(kept) > 0).all()
+    assert 500 in kept
+    assert list(lttb(dates[:50], values[:50], 100)) == list(range(50))
+
+
+def test_min_max():
+    """
+    min_max keeps the lowest and highest point of every bucket
+    """
+    values = numpy.array([5, 1, 9, 3, 4, 8, 0, 2], dtype=float)
+    kept = min_max(numpy.arange(8), values, 4)
+    assert list(kept) == [1, 2, 5, 6]
+    assert list(min_max(numpy.arange(8), values, 8)) == list(range(8))
+
+
+def test_downsample():
+    """
+    Series of dates or date strings are reduced in their original order
+    """
+    start = datetime.date(2017, 1, 1)
+    points = [(start + datetime.timedelta(days=idx), float(idx % 7)) for idx in range(70)]
+    assert downsample(points, None) is points
+    assert downsample(points, 100) is points
+    reduced = downsample(points, 10)
+    assert len(reduced) == 10
+    assert (reduced[0], reduced[-1]) == (points[0], points[-1])
+    newest_first = [(str(date), value) for (date, value) in reversed(points)]
+    reduced = downsample(newest_first, 10, MIN_MAX)
+    assert len(reduced) == 10
+    assert [value for (_, value) in reduced] == [6.0, 0.0] * 5
+    assert reduced == sorted(reduced, reverse=True)
+    assert downsample(newest_first, 10, LTTB)[0] == newest_first[0]
+
+
+def test_downsampling_benchmark():
+    """
+    The benchmark reports smaller payloads for downsampled histories
+    """
+    out = io.StringIO()
+    call_command('downsampling_benchmark', sizes=[100, 1000], max_points=50, repeat=1,
+                 stdout=out)
+    lines = out.getvalue().splitlines()
+    assert [line.split()[2] for line in lines] == ['full', 'lttb', 'min_max'] * 2
+    full = int(lines[3].split()[3])
+    for line in lines[4:]:
+        assert int(line.split()[3]) < full / 10
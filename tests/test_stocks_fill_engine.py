@@ -0,0 +1,119 @@
+"""
+Tests the concurrent fill engine against a local fake fetcher
+"""
+import threading
+import time
+import pandas as pd
+from stocks.fill_engine import FillEngine, FetchJob, RateLimiter
+
+
+# pylint: disable=too-few-public-methods
+class FakeFetcher(object):
+    """
+    Stands in for yahoo_historical.Fetcher. Tickers listed in failures fail
+    that many times before they succeed, unknown tickers raise KeyError.
+    """
+    failures = {}
+    active = 0
+    max_active = 0
+    lock = threading.Lock()
+
+    def __init__(self, ticker, start, end):
+        self.ticker = ticker
+        self.start = start
+        self.end = end
+
+    # pylint: disable=invalid-name
+    def getHistorical(self):
+        """
+        Returns a two day history after a short delay
+        """
+        if self.ticker == 'UNKNOWN':
+            raise KeyError('Date')
+        with FakeFetcher.lock:
+            FakeFetcher.active += 1
+            FakeFetcher.max_active = max(FakeFetcher.max_active, FakeFetcher.active)
+        time.sleep(0.01)
+        with FakeFetcher.lock:
+            FakeFetcher.active -= 1
+            if FakeFetcher.failures.get(self.ticker):
+                FakeFetcher.failures[self.ticker] -= 1
+                raise IOError("Connection reset")
+        return pd.DataFrame({
+            'Close': [1.5, 2.5],
+            'Date': ["2017-05-05", "2017-05-06"],
+        })
+    # pylint: enable=invalid-name
+# pylint: enable=too-few-public-methods
+
+
+def make_jobs(tickers):
+    """
+    Creates one job per ticker
+    """
+    return [
+        FetchJob(ticker=ticker, stock_id=idx, start=[2017, 5, 5], end=[2017, 5, 6])
+        for (idx, ticker) in enumerate(tickers)
+    ]
+
+
+def test_fill_engine_saves_all():
+    """
+    Every download is saved and reported, with bounded concurrency
+    """
+    saved = []
+    FakeFetcher.max_active = 0
+    engine = FillEngine(
+        lambda history, stock_id: saved.append(stock_id) or len(history),
+        fetcher_class=FakeFetcher,
+        workers=3,
+        rate=None,
+    )
+    results = engine.run(make_jobs(["T{}".format(idx) for idx in range(12)]))
+    assert sorted(saved) == list(range(12))
+    assert len(results) == 12
+    assert all(result.rows == 2 and result.error is None for result in results)
+    assert all(result.seconds >= 0 for result in results)
+    assert 1 < FakeFetcher.max_active <= 3
+
+
+def test_fill_engine_retries():
+    """
+    Transient errors are retried with backoff, unknown tickers are not
+    """
+    sleeps = []
+    FakeFetcher.failures = {'FLAKY': 2, 'BROKEN': 10}
+    engine = FillEngine(
+        lambda history, _stock_id: len(history),
+        fetcher_class=FakeFetcher,
+        rate=None,
+        retries=3,
+        backoff=0.5,
+        sleep=sleeps.append,
+    )
+    results = {
+        result.ticker: result
+        for result in engine.run(make_jobs(['FLAKY', 'BROKEN', 'UNKNOWN']))
+    }
+    assert results['FLAKY'].rows == 2
+    assert results['FLAKY'].attempts == 3
+    assert results['BROKEN'].rows is None
+    assert results['BROKEN'].attempts == 4
+    assert 'Connection reset' in results['BROKEN'].error
+    assert results['UNKNOWN'].attempts == 1
+    assert 'KeyError' in results['UNKNOWN'].error
+    assert sorted(sleeps) == [0.5, 0.5, 1.0, 1.0, 2.0]
+    FakeFetcher.failures = {}
+
+
+def test_rate_limiter_per_host():
+    """
+    Requests to the same host are spaced out, other hosts are independent
+    """
+    now = [0.0]
+    sleeps = []
+    limiter = RateLimiter(4, clock=lambda: now[0], sleep=sleeps.append)
+    for _ in range(3):
+        limiter.wait('a')
+    limiter.wait('b')
+    assert sleeps == [0.25, 0.5]
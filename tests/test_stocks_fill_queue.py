@@ -0,0 +1,126 @@
+"""
+Tests the database backed fill queue
+"""
+from unittest import mock
+import pytest
+from django.db.models.signals import post_save
+from stocks import fill_queue
+from stocks.historical import create_stock
+from stocks.models import DailyStockQuote, FillJob, FillTask, Stock
+from test_stocks_fill_engine import FakeFetcher
+import test_stocks_model as stock_test
+
+
+def setup_module(module):
+    """
+    Mock out any externals
+    """
+    stock_test.setup_module(module)
+
+
+def teardown_module(module):
+    """
+    Restore externals
+    """
+    stock_test.teardown_module(module)
+
+
+def create_stocks(*tickers):
+    """
+    Creates a stock with one old quote per ticker
+    """
+    post_save.disconnect(receiver=create_stock, sender=Stock)
+    stocks = []
+    for ticker in tickers:
+        stock = Stock(name=ticker, ticker=ticker)
+        stock.save()
+        stock.daily_quote.create(value=1, date="2017-05-01")
+        stocks.append(stock)
+    return stocks
+
+
+@pytest.mark.django_db(transaction=True)
+def test_fill_job_enqueue():
+    """
+    Tests FillJob.enqueue()
+    """
+    create_stocks("AA", "BB")
+    (job, created) = FillJob.enqueue()
+    assert created
+    assert job.tasks.count() == 2
+    assert FillJob.enqueue() == (job, False)
+    assert job.progress()['pending'] == 2
+    # A request that raced past the lookup gets the job the other one created
+    with mock.patch.object(FillJob, 'active_fill', side_effect=[None, job]):
+        assert FillJob.enqueue() == (job, False)
+    assert FillJob.objects.count() == 1
+    job.tasks.update(status=FillTask.DONE)
+    job.finish_if_complete()
+    (second, created) = FillJob.enqueue()
+    assert created and second != job
+
+
+@pytest.mark.django_db(transaction=True)
+def test_fill_tasks_are_leased_once():
+    """
+    Two workers never lease the same task, expired leases are handed out again
+    """
+    create_stocks("AA", "BB", "CC")
+    FillJob.enqueue()
+    first = fill_queue.claim_tasks('worker-1', 2, 600)
+    second = fill_queue.claim_tasks('worker-2', 2, 600)
+    assert len(first) == 2
+    assert len(second) == 1
+    assert not {task.id for task in first} & {task.id for task in second}
+    assert fill_queue.claim_tasks('worker-3', 2, 600) == []
+    FillTask.objects.filter(id=second[0].id).update(lease_expires="2000-01-01T00:00Z")
+    reclaimed = fill_queue.claim_tasks('worker-3', 2, 600)
+    assert [task.id for task in reclaimed] == [second[0].id]
+    assert reclaimed[0].attempts == 2
+    assert FillJob.objects.get().status == FillJob.RUNNING
+
+
+@pytest.mark.django_db(transaction=True)
+def test_fill_worker_checkpoints():
+    """
+    The worker saves every stock, checkpoints its task and finishes the job
+    """
+    create_stocks("AA", "FLAKY", "UNKNOWN")
+    FakeFetcher.failures = {'FLAKY': 1}
+    (job, _) = FillJob.enqueue()
+    results = fill_queue.work(
+        once=True, fetcher_class=FakeFetcher, rate=None, retries=0, max_attempts=2)
+    FakeFetcher.failures = {}
+    tasks = {task.stock.ticker: task for task in job.tasks.all()}
+    assert tasks['AA'].status == FillTask.DONE
+    assert tasks['AA'].rows == 2
+    assert str(tasks['AA'].last_date) == "2017-05-06"
+    assert tasks['FLAKY'].status == FillTask.DONE
+    assert tasks['FLAKY'].attempts == 2
+    assert tasks['UNKNOWN'].status == FillTask.FAILED
+    assert 'KeyError' in tasks['UNKNOWN'].error
+    assert len(results) == 5
+    job.refresh_from_db()
+    assert job.status == FillJob.DONE
+    assert job.finished is not None
+    assert DailyStockQuote.objects.filter(stock__ticker="AA").count() == 3
+
+
+@pytest.mark.django_db(transaction=True)
+def test_new_stock_queues_backfill():
+    """
+    A new stock is backfilling until the worker downloaded its history
+    """
+    post_save.disconnect(receiver=create_stock, sender=Stock)
+    stock = Stock(name="DD", ticker="DD")
+    stock.save()
+    create_stock(instance=stock, created=True)
+    assert stock.backfill_status() == 'backfilling'
+    assert not stock.daily_quote.exists()
+    task = stock.backfill_task()
+    assert task.start.year == task.job.created.year - 10
+    assert FillJob.enqueue()[0] != task.job
+    results = fill_queue.work(once=True, fetcher_class=FakeFetcher, rate=None)
+    assert [result.stock_id for result in results] == [stock.id]
+    assert stock.backfill_status() == 'done'
+    assert stock.daily_quote.count() == 2
@@ -1,8 +1,11 @@
 """This module is for testing stocks"""
+import datetime
 from unittest import mock
+from django.conf import settings
 from django.test import TestCase
-from stocks.models import Stock, DailyStockQuote
-from stocks import stock_helper, historical
+from django.utils import timezone
+from stocks.models import Stock, DailyStockQuote, FillJob, TickerValidation
+from stocks import fill_queue, stock_helper
 import pandas as pd
 from yahoo_historical import Fetcher
 import pytest
@@ -90,6 +93,10 @@ class StocksViewTests(TestCase):
         data = {'name': name, 'ticker': ticker}
         request = self.client.post('/stocks/addstock/', data, follow=True, secure=True)
         stock_id = request.content
+        self.assertEqual(Stock.objects.get(id=stock_id).backfill_status(), 'backfilling')
+        self.assertEqual(DailyStockQuote.objects.filter(stock_id=stock_id).count(), 0)
+        fill_queue.work(once=True, rate=None)
+        self.assertEqual(Stock.objects.get(id=stock_id).backfill_status(), 'done')
         data = DailyStockQuote.objects.filter(stock_id=stock_id)
         stock_data = Stock.objects.filter(id=stock_id)
         self.assertGreater(len(data), 0)
@@ -118,11 +125,6 @@ class StocksViewTests(TestCase):
                 'Close': [2.55, 2.58],
                 'Date': ["2016-10-11", "2017-10-12"],
             })]))
-    @mock.patch.object(
-        historical,
-        'fill',
-        mock.MagicMock(return_value=None)
-        )
     @pytest.mark.django_db(transaction=True)
     def test_fill_stock_data(self):
         """
@@ -222,7 +224,47 @@ class StocksViewTests(TestCase):
         """
         stock = Stock(name="Facebook", ticker="FB")
         stock.save()
-        historical.fill()
+        fill_queue.work(once=True, rate=None)
+        FillJob.enqueue()
+        fill_queue.work(once=True, rate=None)
         stock_db = DailyStockQuote.objects.values('stock_id')[0]
         data = DailyStockQuote.objects.filter(stock_id=stock_db['stock_id'])
         self.assertEqual(4, len(data))
+
+    @mock.patch.object(
+        Fetcher,
+        'getHistorical',
+        mock.MagicMock(side_effect=KeyError('abc'))
+    )
+    def test_validate_ticker_is_cached(self):
+        """
+        Known tickers are not downloaded again until their entry expires
+        """
+        # pylint: disable=no-member
+        self.assertEqual(stock_helper.validate_ticker('xxx'), False)
+        self.assertEqual(stock_helper.validate_ticker('XXX'), False)
+        self.assertEqual(Fetcher.getHistorical.call_count, 1)
+        TickerValidation.objects.filter(ticker='XXX').update(
+            checked=timezone.now() - datetime.timedelta(
+                seconds=settings.TICKER_INVALID_TTL + 1))
+        self.assertEqual(stock_helper.validate_ticker('xxx'), False)
+        self.assertEqual(Fetcher.getHistorical.call_count, 2)
+        # pylint: enable=no-member
+
+    def test_validate_tickers_in_bulk(self):
+        """
+        Bulk validation answers cached tickers without a download
+        """
+        TickerValidation.objects.create(ticker='FB', valid=True, checked=timezone.now())
+        with mock.patch.object(Fetcher, 'getHistorical', side_effect=KeyError('abc')) as fetch:
+            validity = stock_helper.validate_tickers(['fb', 'XXX', 'YYY'], rate=None)
+        self.assertEqual(validity, {'fb': True, 'XXX': False, 'YYY': False})
+        self.assertEqual(fetch.call_count, 2)
+        self.assertEqual(
+            set(TickerValidation.objects.values_list('ticker', 'valid')),
+            {('FB', True), ('XXX', False), ('YYY', False)})
+        TickerValidation.objects.update(checked=timezone.now() - datetime.timedelta(days=365))
+        with mock.patch.object(Fetcher, 'getHistorical', return_value=None):
+            self.assertEqual(stock_helper.validate_tickers(['XXX'], rate=None), {'XXX': True})
+        self.assertEqual(TickerValidation.objects.count(), 3)
+        self.assertTrue(TickerValidation.objects.get(ticker='XXX').valid)
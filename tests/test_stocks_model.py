@@ -3,11 +3,17 @@ Tests the models of the stock app
 """
 from collections import namedtuple
 import datetime
+import io
 from unittest import mock, TestCase
 import pytest
-from stocks.historical import create_stock
-from stocks.models import DailyStockQuote, InvestmentBucket, InvestmentStockConfiguration, Stock
+import pandas as pd
+from stocks.historical import create_stock, save_stock_quote_from_fetcher
+from stocks.models import BucketDailyValue, DailyStockQuote, InvestmentBucket, \
+    InvestmentStockConfiguration, Stock
+from django.core.management import call_command
+from django.db import connection
 from django.db.models.signals import post_save
+from django.test.utils import CaptureQueriesContext
 from django.db.models import Sum
 from django.contrib.auth.models import User
 from yahoo_historical import Fetcher
@@ -65,6 +71,71 @@ def test_stock_latest_quote():
         stock.latest_quote(datetime.datetime.now() + datetime.timedelta(days=3))
 
 
+@pytest.mark.django_db(transaction=True)
+def test_stock_latest_quote_cache():
+    """
+    Tests that Stock.latest_quote() is served from the quote cache
+    """
+    stock = Stock(
+        name="Name1",
+        ticker="TKRC"
+    )
+    stock.save()
+    stock.daily_quote.create(
+        value=3,
+        date="2016-06-03"
+    )
+    assert stock.latest_quote().value == 3
+    with CaptureQueriesContext(connection) as queries:
+        assert stock.latest_quote("2016-06-04").value == 3
+        assert stock.latest_quote().date == datetime.date(2016, 6, 3)
+    assert not queries.captured_queries
+    save_stock_quote_from_fetcher(pd.DataFrame({
+        'Close': [4.5, 5.5],
+        'Date': ["2016-06-05", "2016-06-06"],
+    }), stock.id)
+    assert stock.latest_quote("2016-06-05").value == 4.5
+    assert stock.latest_quote() == stock.daily_quote.get(date="2016-06-06")
+
+
+@pytest.mark.django_db(transaction=True)
+def test_daily_stock_quote_upsert():
+    """
+    Tests DailyStockQuote.upsert()
+    """
+    stock = Stock(
+        name="Name1",
+        ticker="TKRC"
+    )
+    stock.save()
+    result = DailyStockQuote.upsert(stock.id, [
+        ("2016-06-03", 3),
+        ("2016-06-04", 4),
+    ])
+    assert (result.inserted, result.updated, result.unchanged) == (2, 0, 0)
+    assert stock.latest_quote().value == 4
+    result = DailyStockQuote.upsert(stock.id, [
+        (datetime.date(2016, 6, 3), 3),
+        (datetime.datetime(2016, 6, 4), 4.25),
+        ("2016-06-05", 5),
+    ])
+    assert (result.inserted, result.updated, result.unchanged) == (1, 1, 1)
+    assert [
+        (quote.date, quote.value) for quote in stock.quote_in_range()
+    ] == [
+        (datetime.date(2016, 6, 3), 3),
+        (datetime.date(2016, 6, 4), 4.25),
+        (datetime.date(2016, 6, 5), 5),
+    ]
+    assert stock.latest_quote("2016-06-04").value == 4.25
+    assert DailyStockQuote.upsert(stock.id, []).inserted == 0
+    save_stock_quote_from_fetcher(pd.DataFrame({
+        'Close': [5, 6],
+        'Date': ["2016-06-05", "2016-06-06"],
+    }), stock.id)
+    assert stock.daily_quote.count() == 4
+
+
 @pytest.mark.django_db(transaction=True)
 def test_stock_find_stock():
     """
@@ -134,6 +205,45 @@ def test_stock_quote_in_range():
     assert [quote1, quote2] == list(stock.quote_in_range(end="2016-06-05"))
 
 
+@pytest.mark.django_db(transaction=True)
+def test_stock_quote_series():
+    """
+    Tests Stock.quote_series() pagination and downsampling
+    """
+    stock = Stock(name="Name1X", ticker="TKRC")
+    stock.save()
+    start = datetime.date(2016, 5, 30)
+    for days in range(40):
+        stock.daily_quote.create(value=days, date=start + datetime.timedelta(days=days))
+
+    def day(days):
+        return start + datetime.timedelta(days=days)
+
+    (page, more) = stock.quote_series(first=3)
+    assert (page, more) == ([(day(0), 0), (day(1), 1), (day(2), 2)], True)
+    (page, more) = stock.quote_series(after=day(36), first=3)
+    assert (page, more) == ([(day(37), 37), (day(38), 38), (day(39), 39)], False)
+    assert stock.quote_series(start="2016-06-01", end="2016-06-02") == (
+        [(day(2), 2), (day(3), 3)], False)
+
+    (weeks, more) = stock.quote_series(interval=Stock.WEEK)
+    assert not more
+    assert weeks[0] == (day(6), 6)
+    assert [value for (_, value) in weeks] == [6, 13, 20, 27, 34, 39]
+    (page, more) = stock.quote_series(interval=Stock.WEEK, first=2)
+    assert (page, more) == (weeks[:2], True)
+    assert stock.quote_series(interval=Stock.WEEK, after=page[-1][0]) == (weeks[2:], False)
+    assert stock.quote_series(interval=Stock.MONTH) == ([(day(1), 1), (day(31), 31),
+                                                         (day(39), 39)], False)
+
+    (points, _) = stock.quote_series(points=4)
+    assert [value for (_, value) in points] == [9, 19, 29, 39]
+    (points, _) = stock.quote_series(start="2016-06-01", end="2016-06-10", points=2)
+    assert [value for (_, value) in points] == [6, 11]
+    empty = Stock.objects.create(name="Empty", ticker="EMPTY")
+    assert empty.quote_series(points=4) == ([], False)
+
+
 @pytest.mark.django_db(transaction=True)
 def test_stock_trades_for_profile():
     """
@@ -438,3 +548,96 @@ def test_bucket_historical():
             datetime.datetime.now().date() - datetime.timedelta(days=idx),
             val
             )
+
+
+@pytest.mark.django_db(transaction=True)
+def test_bucket_historical_value():
+    """
+    Tests that InvestmentBucket.historical() agrees with the live computation
+    from the configs and quotes
+    """
+    user = User.objects.create(username='user1', password="a")
+    today = datetime.datetime.now().date()
+    stock1 = Stock(name="Name1X", ticker="TKRC")
+    stock1.save()
+    stock2 = Stock(name="Name2X", ticker="TKRD")
+    stock2.save()
+    for idx in range(3, 40, 3):
+        stock1.daily_quote.create(value=idx * 1.1, date=today - datetime.timedelta(days=idx))
+    for idx in range(0, 20, 7):
+        stock2.daily_quote.create(value=idx + 0.3, date=today - datetime.timedelta(days=idx))
+    bucket = InvestmentBucket(name="bucket", public=True, owner=user.profile, available=7.5)
+    bucket.save()
+    InvestmentStockConfiguration(
+        quantity=2.5,
+        stock=stock1,
+        bucket=bucket,
+        start=today - datetime.timedelta(days=35),
+        end=today - datetime.timedelta(days=10),
+    ).save()
+    InvestmentStockConfiguration(
+        quantity=0.7,
+        stock=stock1,
+        bucket=bucket,
+        start=today - datetime.timedelta(days=9),
+    ).save()
+    InvestmentStockConfiguration(
+        quantity=3,
+        stock=stock2,
+        bucket=bucket,
+        start=today - datetime.timedelta(days=25),
+    ).save()
+    historical = bucket.historical(count=45)
+    assert len(historical) == 45
+    live = bucket.holdings_on([date for (date, _) in historical])
+    for ((date, value), holdings) in zip(historical, live):
+        assert value == holdings + bucket.available
+    # 0.7 of stock1 at 3.3 and 3 of stock2 at 0.3
+    assert historical[0] == (today, pytest.approx(0.7 * 3.3 + 3 * 0.3 + 7.5))
+    # 2.5 of stock1 at 13.2 before the first config ended, stock2 at 14.3
+    assert historical[12] == (
+        today - datetime.timedelta(days=12), pytest.approx(2.5 * 13.2 + 3 * 14.3 + 7.5))
+    assert historical[40] == (today - datetime.timedelta(days=40), 7.5)
+    assert bucket.historical(count=0) == []
+
+
+@pytest.mark.django_db(transaction=True)
+def test_bucket_values_in_sync():
+    """
+    Tests that BucketDailyValue follows config and quote changes
+    """
+    user = User.objects.create(username='user1', password="a")
+    today = datetime.datetime.now().date()
+    stock = Stock(name="Name1X", ticker="TKRE")
+    stock.save()
+    stock.daily_quote.create(value=2.0, date=today - datetime.timedelta(days=20))
+    bucket = InvestmentBucket(name="bucket", public=True, owner=user.profile, available=5)
+    bucket.save()
+    InvestmentStockConfiguration(
+        quantity=3, stock=stock, bucket=bucket, start=today - datetime.timedelta(days=30),
+    ).save()
+    assert bucket.daily_values.count() == 31
+    assert bucket.value_on(today - datetime.timedelta(days=25)) == 5
+    assert bucket.value_on() == 11
+    save_stock_quote_from_fetcher(pd.DataFrame({
+        'Close': [4.0, 6.0],
+        'Date': [str(today - datetime.timedelta(days=10)), str(today)],
+    }), stock.id)
+    assert bucket.value_on(today - datetime.timedelta(days=5)) == 17
+    assert bucket.value_on() == 23
+    assert BucketDailyValue.verify() == []
+    cfg = namedtuple("cfg", ["id", "quantity"])
+    bucket.change_config([cfg(id=stock.id, quantity=1)])
+    assert BucketDailyValue.verify() == []
+    BucketDailyValue.objects.filter(bucket=bucket, date=today).update(holdings=0)
+    assert BucketDailyValue.verify() == [(bucket.id, today, 0, 6.0)]
+    call_command('rebuild_bucket_values', stdout=io.StringIO())
+    assert BucketDailyValue.verify() == []
+    # Quotes another process ingested aren't in this process' cache yet
+    assert stock.latest_quote().value == 6.0
+    stock.daily_quote.filter(date=today).update(value=8.0)
+    BucketDailyValue.refresh([bucket.id], today)
+    # change_config sold 3 and bought 1 at 6.0, so 17 is available
+    assert bucket.value_on() == 17 + 8.0
+    dates = [today - datetime.timedelta(days=idx) for idx in range(3)]
+    assert bucket.historical(count=3) == [(date, bucket.value_on(date)) for date in dates]
@@ -0,0 +1,119 @@
+"""
+Tests that the quote and bucket valuation queries are answered from indexes
+"""
+import datetime
+from unittest import mock
+import pytest
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.backends.utils import CursorWrapper
+from stocks.models import DailyStockQuote, InvestmentBucket, \
+    InvestmentStockConfiguration, LatestQuote, Stock
+from trading.models import TradingAccount
+import test_stocks_model as stock_test
+
+
+def setup_module(module):
+    """
+    Mock out any externals
+    """
+    stock_test.setup_module(module)
+
+
+def teardown_module(module):
+    """
+    Restore externals
+    """
+    stock_test.teardown_module(module)
+
+
+def query_plans(run, table):
+    """
+    Runs run() and returns the SQLite query plan of every statement it sent
+    that reads from table
+    """
+    statements = []
+    original = CursorWrapper.execute
+
+    def execute(self, sql, params=None):
+        statements.append((sql, params))
+        return original(self, sql, params)
+
+    with mock.patch.object(CursorWrapper, 'execute', execute):
+        run()
+    plans = []
+    with connection.cursor() as cursor:
+        for (sql, params) in statements:
+            if sql.startswith('SELECT') and table in sql:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                plans.append(' / '.join(row[-1] for row in cursor.fetchall()))
+    return plans
+
+
+def create_portfolio():
+    """
+    Creates an account holding two stocks and a bucket
+    """
+    today = datetime.datetime.now().date()
+    user = User.objects.create(username='user1', password="a")
+    account = TradingAccount.objects.create(profile=user.profile, account_name="acc")
+    stocks = []
+    for (idx, ticker) in enumerate(["AAA", "BBB"]):
+        stock = Stock.objects.create(name=ticker, ticker=ticker)
+        for days in range(10):
+            stock.daily_quote.create(
+                value=idx + days, date=today - datetime.timedelta(days=days + 1))
+        account.trades.create(stock=stock, quantity=2)
+        stocks.append(stock)
+    bucket = InvestmentBucket.objects.create(
+        name="bucket", public=True, owner=user.profile, available=10)
+    InvestmentStockConfiguration.objects.create(
+        quantity=1, stock=stocks[0], bucket=bucket, start=today - datetime.timedelta(days=5))
+    account.buckettrades.create(stock=bucket, quantity=1)
+    return (account, stocks, bucket)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_latest_per_stock():
+    """
+    Tests DailyStockQuote.latest_per_stock() with the window function and
+    the fallback query
+    """
+    (_, stocks, _) = create_portfolio()
+    today = datetime.datetime.now().date()
+    expected = {
+        stocks[0].id: LatestQuote(stocks[0].id, today - datetime.timedelta(days=1), 0),
+        stocks[1].id: LatestQuote(stocks[1].id, today - datetime.timedelta(days=1), 1),
+    }
+    ids = [stock.id for stock in stocks] + [0]
+    assert DailyStockQuote.latest_per_stock(ids) == expected
+    with mock.patch.object(connection.Database, 'sqlite_version_info', (3, 8, 0)):
+        assert DailyStockQuote.latest_per_stock(ids) == expected
+    assert DailyStockQuote.latest_per_stock(
+        ids, today - datetime.timedelta(days=4))[stocks[1].id].value == 4
+
+
+@pytest.mark.skipif(connection.vendor != 'sqlite', reason="Checks SQLite query plans")
+@pytest.mark.django_db(transaction=True)
+def test_valuation_index_only():
+    """
+    Quote and bucket value lookups only read the covering indexes
+    """
+    (account, stocks, bucket) = create_portfolio()
+    assert account.holding_value() == 2 * 0 + 2 * 1 + (10 + 0)
+    quote_plans = query_plans(account.holding_value, 'stocks_dailystockquote')
+    quote_plans += query_plans(
+        lambda: list(stocks[0].quote_in_range("2017-01-01")), 'stocks_dailystockquote')
+    quote_plans += query_plans(
+        lambda: stocks[0].quote_series("2017-01-01", after="2017-02-01", first=5),
+        'stocks_dailystockquote')
+    quote_plans += query_plans(
+        lambda: stocks[0].quote_series(interval=Stock.MONTH), 'stocks_dailystockquote')
+    assert len(quote_plans) == 4
+    for plan in quote_plans:
+        assert 'COVERING INDEX stocks_quote_latest_idx' in plan, plan
+    value_plans = query_plans(account.holding_value, 'stocks_bucketdailyvalue')
+    value_plans += query_plans(bucket.historical, 'stocks_bucketdailyvalue')
+    assert len(value_plans) == 2
+    for plan in value_plans:
+        assert 'COVERING INDEX stocks_bucket_value_idx' in plan, plan
@@ -1,6 +1,8 @@
 """
 Tests the models of the Trading app
 """
+import datetime
+import io
 import random
 import string
 from unittest import mock
@@ -8,7 +10,13 @@ import pytest
 from stocks.models import InvestmentBucket, Stock, InvestmentStockConfiguration
 from stocks.models import InvestmentBucketDescription
 from django.contrib.auth.models import User
-from trading.models import TradingAccount, TradeStock, TradeBucket
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from authentication.models import UserBank
+from trading import valuation
+from trading.models import PositionSnapshot, TradingAccount, TradeStock, TradeBucket
 import test_stocks_model as stock_test
 
 
@@ -363,3 +371,179 @@ def account_helper():
     account = TradingAccount(profile=user.profile, account_name="testAccount")
     account.save()
     return account
+
+
+@pytest.mark.django_db(transaction=True)
+def test_trading_positions():
+    """
+    Testing the per position breakdown of the holding value
+    """
+    account = account_helper()
+    stock1 = Stock.create_new_stock(name="Name1X", ticker="TKRC")
+    stock1.daily_quote.create(value=3, date="2016-06-03")
+    stock1.daily_quote.create(value=5, date="2016-06-05")
+    stock2 = Stock.create_new_stock(name="Name2X", ticker="TKF")
+    bucket = InvestmentBucket(name="bucket", public=True, owner=account.profile, available=2)
+    bucket.save()
+    InvestmentStockConfiguration(quantity=1, stock=stock1, bucket=bucket, start="2016-06-01").save()
+    TradeStock(quantity=2, account=account, stock=stock1).save()
+    TradeStock(quantity=1, account=account, stock=stock1).save()
+    TradeStock(quantity=4, account=account, stock=stock2).save()
+    TradeBucket(quantity=2, account=account, stock=bucket).save()
+    sold = InvestmentBucket(name="sold", public=True, owner=account.profile, available=2)
+    sold.save()
+    TradeBucket(quantity=1, account=account, stock=sold).save()
+    TradeBucket(quantity=-1, account=account, stock=sold).save()
+    assert valuation.positions(account) == [
+        valuation.Position('stock', stock1.id, "Name1X", 3, 5, 15),
+        valuation.Position('stock', stock2.id, "Name2X", 4, None, 0),
+        valuation.Position('bucket', bucket.id, "bucket", 2, 7, 14),
+    ]
+    assert account.holding_value() == 29
+    with CaptureQueriesContext(connection) as queries:
+        account.holding_value()
+        account.trading_balance()
+    assert len(queries.captured_queries) == 3
+    assert account.trading_balance() == -15 - 14
+    assert valuation.trading_balance(account) == -15 - 14
+
+
+@pytest.mark.django_db(transaction=True)
+def test_trading_cash_ledger():
+    """
+    Testing that trades are booked on the cash ledger and can be reconciled
+    """
+    account = account_helper()
+    stock = Stock.create_new_stock(name="Name1X", ticker="TKRC")
+    stock.daily_quote.create(value=3, date="2016-06-03")
+    TradeStock(quantity=2, account=account, stock=stock).save()
+    TradeStock(quantity=-1, account=account, stock=stock).save()
+    assert list(account.cash_ledger.order_by('id').values_list('amount', 'balance')) == [
+        (-6, -6), (3, -3),
+    ]
+    with CaptureQueriesContext(connection) as queries:
+        assert account.trading_balance() == -3
+    assert len(queries.captured_queries) == 1
+    account.cash_ledger.all().delete()
+    out = io.StringIO()
+    call_command('reconcile_cash_ledger', '--dry-run', stdout=out)
+    assert "account {}: ledger 0.0 trades -3.0".format(account.id) in out.getvalue()
+    assert account.trading_balance() == 0
+    call_command('reconcile_cash_ledger', stdout=io.StringIO())
+    assert account.trading_balance() == -3
+    assert account.cash_ledger.filter(trade_stock__isnull=False).count() == 2
+    unquoted = Stock.create_new_stock(name="Name2X", ticker="TKRD")
+    TradeStock(quantity=1, account=account, stock=unquoted).save()
+    assert list(account.cash_ledger.order_by('-id').values_list('amount', 'balance')[:1]) == [
+        (None, -3),
+    ]
+    unquoted.daily_quote.create(value=2, date="2016-06-03")
+    out = io.StringIO()
+    call_command('reconcile_cash_ledger', stdout=out)
+    assert "1 unvalued entries" in out.getvalue()
+    assert account.trading_balance() == -5
+    assert not account.cash_ledger.filter(amount__isnull=True).exists()
+
+
+@mock.patch.object(TradingAccount, 'available_cash', mock.MagicMock(return_value=100.0))
+@pytest.mark.django_db(transaction=True)
+def test_trading_position_snapshots():
+    """
+    Testing that positions follow the trades and are read as single rows
+    """
+    account = account_helper()
+    stock = Stock.create_new_stock(name="Name1X", ticker="TKRC")
+    stock.daily_quote.create(value=3, date="2016-06-03")
+    bucket = InvestmentBucket(name="bucket", public=True, owner=account.profile, available=2)
+    bucket.save()
+    account.trade_stock(stock, 4)
+    account.trade_stock(stock, -1)
+    account.trade_bucket(bucket, 2)
+    TradeBucket(quantity=1, account=account, stock=bucket).save()
+    with pytest.raises(Exception):
+        account.trade_stock(stock, -4)
+    with CaptureQueriesContext(connection) as queries:
+        assert account.available_stocks(stock) == 3
+        assert account.available_buckets(bucket) == 3
+    assert len(queries.captured_queries) == 2
+    assert account.positions.count() == 2
+    assert PositionSnapshot.quantities([
+        (account.id, stock.id, None), (account.id, None, bucket.id), (account.id, 0, None),
+    ]) == {
+        (account.id, stock.id, None): 3,
+        (account.id, None, bucket.id): 3,
+        (account.id, 0, None): 0,
+    }
+
+
+@mock.patch.object(TradingAccount, 'available_cash', mock.MagicMock(return_value=10.0))
+@pytest.mark.django_db(transaction=True)
+def test_trading_execute_order():
+    """
+    Testing that multi leg orders are executed completely or not at all
+    """
+    account = account_helper()
+    stock = Stock.create_new_stock(name="Name1X", ticker="TKRC")
+    stock.daily_quote.create(value=3, date="2016-06-03")
+    bucket = InvestmentBucket(name="bucket", public=True, owner=account.profile, available=2)
+    bucket.save()
+    (trade1, trade2) = account.execute_order([(stock, 2), (bucket, 1)])
+    assert (trade1.stock, trade2.stock) == (stock, bucket)
+    with pytest.raises(Exception):
+        account.execute_order([(stock, -1), (bucket, -2)])
+    with pytest.raises(Exception):
+        account.execute_order([(stock, -1), (stock, -2)])
+    with pytest.raises(Exception):
+        account.execute_order([(stock, 3), (bucket, 1)])
+    assert account.available_stocks(stock) == 2
+    assert account.available_buckets(bucket) == 1
+    account.execute_order([(stock, -2), (bucket, -1), (stock, 1)])
+    assert account.available_stocks(stock) == 1
+    assert account.trades.count() + account.buckettrades.count() == 5
+
+
+@pytest.mark.django_db(transaction=True)
+def test_execute_order_bank_sync():
+    """
+    Stale bank balances are synced before the account is locked
+    """
+    account = account_helper()
+    stock = Stock.create_new_stock(name="Name1X", ticker="TKRC")
+    stock.daily_quote.create(value=3, date="2016-06-03")
+    UserBank.objects.create(
+        user=account.profile.user, item_id="item", access_token="token",
+        institution_name="bank", current_balance_field=0.0,
+        balance_updated=timezone.now() - datetime.timedelta(days=1),
+        account_name_field="acc", income_field=0, expenditure_field=0)
+    in_transaction = []
+
+    def refresh_balance(bank):
+        in_transaction.append(connection.in_atomic_block)
+        UserBank.objects.filter(id=bank.id).update(
+            current_balance_field=10.0, balance_updated=timezone.now())
+        bank.current_balance_field = 10.0
+        return 10.0
+
+    with mock.patch.object(UserBank, 'refresh_balance', autospec=True,
+                           side_effect=refresh_balance):
+        account.execute_order([(stock, 3)])
+        with pytest.raises(Exception):
+            account.execute_order([(stock, 1)])
+    assert in_transaction == [False]
+    assert account.available_stocks(stock) == 3
+
+
+@pytest.mark.skipif(
+    connection.vendor != 'postgresql', reason="select_for_update doesn't lock on this backend")
+@pytest.mark.django_db(transaction=True)
+def test_trade_benchmark():
+    """
+    Testing that concurrent orders don't lose updates
+    """
+    stock = Stock.create_new_stock(name="Name1X", ticker="TKRC")
+    stock.daily_quote.create(value=3, date="2016-06-03")
+    out = io.StringIO()
+    call_command('trade_benchmark', threads=4, orders=10, cash=40, seed=1, stdout=out)
+    assert "No lost updates" in out.getvalue(), out.getvalue()
+    assert "database error" not in out.getvalue(), out.getvalue()
+    assert not TradingAccount.objects.exists()
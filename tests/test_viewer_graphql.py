@@ -1,17 +1,27 @@
 """
 This file helps to test graphql queries and verify that the "big picture" works
 """
+import datetime
+import io
 import string
 import random
+import time
 from unittest import mock
 import pytest
 from graphene.test import Client
 from BuyBitcoin.graphene_schema import SCHEMA
 from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
 from django.db.models.signals import post_save
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from graphql import parse
+from authentication.models import UserBank
 from trading.models import TradingAccount, TradeBucket, TradeStock
-from stocks.models import DailyStockQuote, InvestmentBucket, \
+from stocks.models import DailyStockQuote, DataVersion, InvestmentBucket, \
     InvestmentBucketDescription, InvestmentStockConfiguration, Stock
+from stocks.async_execution import execute_async
 from stocks.historical import create_stock
 from graphql_relay.node.node import to_global_id
 from plaid_test_decorators import mock_plaid_balance, \
@@ -519,3 +529,333 @@ def test_big_gql(rf, snapshot):
 }
     """, context_value=request)
     snapshot.assert_match(executed)
+
+
+def query_count_for_portfolio(factory, size):
+    """
+    Creates size buckets and trades and counts the queries a viewer query
+    over all of them needs
+    """
+    request = factory.post('/graphql', follow=True, secure=True)
+    request.user = User.objects.create(username='user{}'.format(size), password="a")
+    account = request.user.profile.default_acc()
+    for idx in range(size):
+        stock = Stock(name="Stock{}-{}".format(size, idx), ticker="S{}-{}".format(size, idx))
+        stock.save()
+        DailyStockQuote(value=idx + 1, date="2017-05-08", stock=stock).save()
+        TradeStock(quantity=1, account=account, stock=stock).save()
+        bucket = InvestmentBucket(
+            name="B{}".format(idx), public=False, available=10, owner=request.user.profile)
+        bucket.save()
+        InvestmentStockConfiguration(
+            stock=stock, quantity=2, bucket=bucket, start="2017-05-08").save()
+        TradeBucket(quantity=3, account=account, stock=bucket).save()
+    client = Client(SCHEMA)
+    with CaptureQueriesContext(connection) as queries:
+        executed = client.execute("""
+{
+  viewer {
+    profile {
+      investSuggestions {
+        edges {
+          node {
+            value
+            ownedAmount
+            stocks {
+              edges {
+                node {
+                  stock {
+                    latestQuote {
+                      value
+                    }
+                  }
+                }
+              }
+            }
+          }
+        }
+      }
+      tradingAccounts {
+        edges {
+          node {
+            availableCash
+            totalValue
+            positions {
+              kind
+              value
+            }
+            trades {
+              edges {
+                node {
+                  value
+                }
+              }
+            }
+            buckettrades {
+              edges {
+                node {
+                  value
+                }
+              }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+        """, context_value=request)
+    assert 'errors' not in executed
+    buckets = executed['data']['viewer']['profile']['investSuggestions']['edges']
+    assert sorted(bucket['node']['value'] for bucket in buckets) == [
+        12.0 + 2 * idx for idx in range(size)
+    ]
+    assert all(bucket['node']['ownedAmount'] == 3 for bucket in buckets)
+    (account, ) = executed['data']['viewer']['profile']['tradingAccounts']['edges']
+    positions = account['node']['positions']
+    assert len(positions) == 2 * size
+    assert sorted(trade['node']['value'] for trade in account['node']['buckettrades']['edges']) \
+        == sorted(trade.current_value() for trade in TradeBucket.objects.filter(
+            account__profile__user=request.user))
+    assert account['node']['totalValue'] == account['node']['availableCash'] + sum(
+        position['value'] for position in positions)
+    return len(queries.captured_queries)
+
+
+@pytest.mark.django_db(transaction=True)
+# pylint: disable=invalid-name
+def test_viewer_query_count(rf):
+    """
+    The number of queries must not grow with the number of buckets and trades
+    """
+    # pylint: enable=invalid-name
+    assert query_count_for_portfolio(rf, 2) == query_count_for_portfolio(rf, 8)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_mutation_add_stock_reports_backfill(rf):
+    """
+    A stock added through GraphQL is returned right away and backfills
+    """
+    # pylint: disable=invalid-name
+    request = rf.post('/graphql')
+    pw = ''.join(random.choices(string.ascii_uppercase + string.digits, k=9))
+    request.user = User.objects.create(username='testuser1', password=pw)
+    post_save.connect(receiver=create_stock, sender=Stock)
+    client = Client(SCHEMA)
+    executed = client.execute("""
+        mutation {
+          addStock(ticker: "IBM", name: "IBM") {
+            stock {
+              ticker
+              backfill {
+                status
+                rows
+              }
+            }
+          }
+        }
+    """, context_value=request)
+    post_save.disconnect(receiver=create_stock, sender=Stock)
+    assert 'errors' not in executed
+    assert executed['data']['addStock']['stock'] == {
+        'ticker': 'IBM',
+        'backfill': {'status': 'backfilling', 'rows': 0},
+    }
+    # pylint: enable=invalid-name
+
+
+@pytest.mark.django_db(transaction=True)
+# pylint: disable=invalid-name
+def test_quote_series_pages(rf):
+    """
+    quoteSeries returns compact points page by page and downsampled
+    """
+    # pylint: enable=invalid-name
+    request = request_create(rf.post('/graphql'))
+    stock = Stock.objects.get(ticker="GOOGL")
+    for (date, value) in [("2017-05-11", 11), ("2017-05-15", 15), ("2017-06-01", 1)]:
+        stock.daily_quote.create(date=date, value=value)
+    query = """
+    query Series($after: String, $interval: GQuoteInterval) {
+      viewer {
+        profile {
+          stockFind(text: "GO", first: 1) {
+            quoteSeries(start: "2017-05-01", first: 2, after: $after, interval: $interval) {
+              points
+              pageInfo { hasNextPage hasPreviousPage endCursor }
+            }
+          }
+        }
+      }
+    }
+    """
+
+    def series(**variables):
+        executed = Client(SCHEMA).execute(query, variable_values=variables, context_value=request)
+        assert 'errors' not in executed, executed['errors']
+        return executed['data']['viewer']['profile']['stockFind'][0]['quoteSeries']
+
+    first = series()
+    assert first['points'] == [['2017-05-08', 9.0], ['2017-05-10', 10.0]]
+    assert first['pageInfo']['hasNextPage'] and not first['pageInfo']['hasPreviousPage']
+    second = series(after=first['pageInfo']['endCursor'])
+    assert second['points'] == [['2017-05-11', 11.0], ['2017-05-15', 15.0]]
+    assert second['pageInfo']['hasNextPage'] and second['pageInfo']['hasPreviousPage']
+    last = series(after=second['pageInfo']['endCursor'])
+    assert last['points'] == [['2017-06-01', 1.0]]
+    assert not last['pageInfo']['hasNextPage']
+    assert series(interval='MONTH')['points'] == [['2017-05-15', 15.0], ['2017-06-01', 1.0]]
+
+
+@pytest.mark.django_db(transaction=True)
+# pylint: disable=invalid-name
+def test_history_max_points(rf):
+    """
+    History fields can be downsampled with maxPoints
+    """
+    # pylint: enable=invalid-name
+    request = request_create(rf.post('/graphql'))
+    DailyStockQuote.objects.bulk_create([
+        DailyStockQuote(stock=Stock.objects.get(ticker="GOOGL"),
+                        date=datetime.date(2017, 4, day), value=day % 6)
+        for day in range(1, 31)
+    ])
+    today = datetime.date.today()
+    bank = UserBank.objects.create(
+        user=request.user, item_id="item", access_token="token",
+        institution_name="bank", current_balance_field=100.0,
+        balance_updated=timezone.now(), account_name_field="acc",
+        income_field=10, expenditure_field=-5, transactions_synced=today)
+    for days in range(1, 40):
+        bank.transactions.create(date=today - datetime.timedelta(days=days), amount=days % 5 - 2)
+    query = """
+    query History($maxPoints: Int, $downsampling: GDownsampling) {
+      viewer {
+        userbank {
+          edges { node { history(start: "%s", maxPoints: $maxPoints, downsampling: $downsampling) {
+            date value
+          } } }
+        }
+        profile {
+          investSuggestions {
+            edges { node { history(count: 60, maxPoints: $maxPoints) { date } } }
+          }
+          stockFind(text: "GO", first: 1) {
+            quoteInRange(start: "2017-04-01", end: "2017-05-11", maxPoints: $maxPoints) {
+              date
+            }
+          }
+        }
+      }
+    }
+    """ % (today - datetime.timedelta(days=50))
+
+    def histories(**variables):
+        executed = Client(SCHEMA).execute(query, variable_values=variables, context_value=request)
+        assert 'errors' not in executed, executed['errors']
+        viewer = executed['data']['viewer']
+        return (
+            viewer['userbank']['edges'][0]['node']['history'],
+            viewer['profile']['investSuggestions']['edges'][0]['node']['history'],
+            viewer['profile']['stockFind'][0]['quoteInRange'],
+        )
+
+    (bank_full, bucket_full, quotes) = histories()
+    assert (len(bank_full), len(bucket_full), len(quotes)) == (40, 60, 32)
+    (bank_history, bucket_history, reduced_quotes) = histories(maxPoints=10)
+    assert len(bank_history) == 10
+    assert (bank_history[0], bank_history[-1]) == (bank_full[0], bank_full[-1])
+    assert all(point in bank_full for point in bank_history)
+    assert len(bucket_history) == 10
+    assert bucket_history[0] == bucket_full[0]
+    assert len(reduced_quotes) == 10
+    assert (reduced_quotes[0], reduced_quotes[-1]) == (quotes[0], quotes[-1])
+    assert all(quote in quotes for quote in reduced_quotes)
+    (bank_history, _, _) = histories(maxPoints=10, downsampling='MIN_MAX')
+    assert len(bank_history) <= 10
+    assert min(point['value'] for point in bank_history) == min(
+        point['value'] for point in bank_full)
+    assert max(point['value'] for point in bank_history) == max(
+        point['value'] for point in bank_full)
+    rejected = Client(SCHEMA).execute(query, variable_values={'maxPoints': 2},
+                                      context_value=request)
+    assert rejected['errors'][0]['message'] == "maxPoints has to be at least 3"
+
+
+@pytest.mark.django_db(transaction=True)
+# pylint: disable=invalid-name
+def test_async_matches_threaded(rf):
+    """
+    The asyncio execution mode returns the same data and resolves offloaded
+    sibling fields concurrently
+    """
+    # pylint: enable=invalid-name
+    request = request_create(rf.post('/graphql', follow=True, secure=True))
+    today = datetime.date.today()
+    for idx in range(3):
+        bank = UserBank.objects.create(
+            user=request.user, item_id="item", access_token="token{}".format(idx),
+            institution_name="bank", current_balance_field=100.0 + idx,
+            balance_updated=timezone.now(), account_name_field="acc",
+            income_field=10, expenditure_field=-5, transactions_synced=today)
+        bank.transactions.create(date=today - datetime.timedelta(days=2), amount=20)
+    query = """
+{
+  viewer {
+    userbank {
+      edges {
+        node {
+          balance
+          income
+          history(start: "%s") { date value }
+        }
+      }
+    }
+    profile {
+      investSuggestions { edges { node { value history(count: 3) { value } } } }
+      stockFind(text: "GO", first: 1) {
+        quoteInRange(start: "2017-05-07", end: "2017-05-11") { value date }
+        backfill { status }
+      }
+      tradingAccounts { edges { node { totalValue positions { kind value } } } }
+    }
+  }
+}
+    """ % (today - datetime.timedelta(days=5))
+    threaded = SCHEMA.execute(query, context_value=request)
+    assert not threaded.errors, [e.path for e in threaded.errors]
+    original = UserBank.historical_data
+
+    def slow_history(bank, start):
+        time.sleep(0.2)
+        return original(bank, start)
+
+    with mock.patch.object(UserBank, 'historical_data', slow_history):
+        start = time.monotonic()
+        result = execute_async(SCHEMA, parse(query), context_value=request)
+        seconds = time.monotonic() - start
+    assert not result.errors
+    assert result.data == threaded.data
+    assert [
+        bank['node']['history'][1]['value']
+        for bank in result.data['viewer']['userbank']['edges']
+    ] == [80.0, 81.0, 82.0]
+    assert seconds < 0.5
+    assert not hasattr(request, 'graphql_loop')
+
+
+@pytest.mark.django_db(transaction=True)
+def test_graphql_benchmark():
+    """
+    The benchmark reports both execution modes and cleans up after itself
+    """
+    versions = DataVersion.current()
+    out = io.StringIO()
+    call_command('graphql_benchmark', requests=4, banks=2, io_latency=0.01, stdout=out)
+    lines = out.getvalue().splitlines()
+    assert [line.split()[0] for line in lines] == ['thread', 'asyncio'], lines
+    assert not User.objects.exists()
+    assert not InvestmentBucket.objects.exists()
+    assert not Stock.objects.exists()
+    assert DataVersion.current() == versions
@@ -2,11 +2,15 @@
 GraphQL definitions for the Trading App
 """
 from graphene_django import DjangoObjectType
-from graphql_relay.node.node import from_global_id
-from graphene import Field, Float, ID, Int, Mutation, NonNull, \
-    relay, String
+from graphql_relay.node.node import from_global_id, to_global_id
+from graphene import Field, Float, ID, InputObjectType, Int, List, Mutation, \
+    NonNull, ObjectType, relay, String
+from authentication.loaders import UserBankLoader
+from stocks.async_execution import ORM, offload
 from stocks.graphql import GInvestmentBucket
+from stocks.loaders import BucketValueOnLoader, QuoteValueOnLoader, get_loader
 from stocks.models import InvestmentBucket, Stock
+from . import valuation
 from .models import TradeBucket, TradeStock, TradingAccount
 
 
@@ -25,11 +29,15 @@ class GTrade(DjangoObjectType):
         interfaces = (relay.Node, )
 
     @staticmethod
-    def resolve_value(data, _info, **_args):
+    def resolve_value(data, info, **_args):
         """
         Returns the value of a trade (see the model)
         """
-        return data.current_value()
+        return get_loader(info, QuoteValueOnLoader).load(
+            (data.stock_id, data.timestamp.date())
+        ).then(
+            lambda quote_value: quote_value * (-1 * data.quantity)
+        )
 
 
 class GInvestmentBucketTrade(DjangoObjectType):
@@ -46,11 +54,37 @@ class GInvestmentBucketTrade(DjangoObjectType):
         interfaces = (relay.Node, )
 
     @staticmethod
-    def resolve_value(data, _info, **_args):
+    def resolve_value(data, info, **_args):
         """
         Returns the value of a trade (see the model)
         """
-        return data.current_value()
+        return get_loader(info, BucketValueOnLoader).load(
+            (data.stock_id, data.timestamp.date())
+        ).then(
+            lambda bucket_value: bucket_value * (-1 * data.quantity)
+        )
+
+
+class GPosition(ObjectType):
+    """
+    One stock or bucket an account holds, see
+    :py:func:`trading.valuation.positions`
+    """
+    kind = NonNull(String)
+    object_id = NonNull(ID)
+    name = NonNull(String)
+    quantity = NonNull(Float)
+    price = Float()
+    value = NonNull(Float)
+
+    @staticmethod
+    def resolve_object_id(data, _info, **_args):
+        """
+        Returns the global id of the GStock or GInvestmentBucket
+        """
+        if data.kind == valuation.STOCK:
+            return to_global_id('GStock', data.id)
+        return to_global_id('GInvestmentBucket', data.id)
 
 
 class GTradingAccount(DjangoObjectType):
@@ -59,6 +93,7 @@ class GTradingAccount(DjangoObjectType):
     """
     total_value = NonNull(Float)
     available_cash = NonNull(Float)
+    positions = NonNull(List(NonNull(GPosition)))
 
     class Meta(object):
         """
@@ -68,18 +103,35 @@ class GTradingAccount(DjangoObjectType):
         interfaces = (relay.Node, )
 
     @staticmethod
-    def resolve_total_value(data, _info, **_args):
+    def resolve_total_value(data, info, **_args):
         """
-        Returns the total value that the account currently holds
+        Returns the total value that the account currently holds. The
+        positions and trades are valued with a fixed number of queries.
         """
-        return data.total_value()
+        return get_loader(info, UserBankLoader).load(
+            data.profile.user_id
+        ).then(
+            lambda banks: data.total_value(banks=banks)
+        )
+
+    @staticmethod
+    @offload(ORM)
+    def resolve_positions(data, _info, **_args):
+        """
+        Returns the value of every stock and bucket the account holds
+        """
+        return valuation.positions(data)
 
     @staticmethod
-    def resolve_available_cash(data, _info, **_args):
+    def resolve_available_cash(data, info, **_args):
         """
         Returns the amount of cash the user has available
         """
-        return data.available_cash(False)
+        return get_loader(info, UserBankLoader).load(
+            data.profile.user_id
+        ).then(
+            lambda banks: data.available_cash(False, banks=banks)
+        )
 
 
 # pylint: disable=no-init
@@ -147,4 +199,49 @@ class InvestBucket(Mutation):
         bucket = InvestmentBucket.objects.get(id=bucket_id)
         trading_acc.trade_bucket(bucket, quantity)
         return InvestBucket(trading_account=trading_acc, bucket=bucket)
+
+
+class GOrderLeg(InputObjectType):
+    """
+    One trade of an order, id_value is the id of a GStock or a
+    GInvestmentBucket
+    """
+    id_value = NonNull(ID)
+    quantity = NonNull(Float)
+
+
+class ExecuteOrder(Mutation):
+    """
+    Executes several stock and bucket trades at once, either all of them
+    succeed or none
+    """
+    class Arguments(object):
+        """
+        We need the account and the legs of the order
+        """
+        trading_acc_id = NonNull(ID)
+        legs = NonNull(List(NonNull(GOrderLeg)))
+
+    trading_account = Field(lambda: GTradingAccount)
+
+    @staticmethod
+    def mutate(_self, info, trading_acc_id, legs, **_args):
+        """
+        Creates the trades
+        """
+        trading_acc = TradingAccount.objects.get(
+            id=from_global_id(trading_acc_id)[1],
+            profile=info.context.user.profile,
+        )
+        instruments = []
+        for leg in legs:
+            (kind, instrument_id) = from_global_id(leg.id_value)
+            if kind == 'GInvestmentBucket':
+                instruments.append(InvestmentBucket.objects.get(id=instrument_id))
+            else:
+                instruments.append(Stock.objects.get(id=instrument_id))
+        trading_acc.execute_order([
+            (instrument, leg.quantity) for (instrument, leg) in zip(instruments, legs)
+        ])
+        return ExecuteOrder(trading_account=trading_acc)
 # pylint: enable=too-few-public-methods
@@ -0,0 +1,44 @@
+"""
+Request scoped DataLoaders for the Trading App
+"""
+from promise import Promise
+from promise.dataloader import DataLoader
+from .models import PositionSnapshot, TradingAccount
+
+
+# pylint: disable=method-hidden,no-self-use
+class DefaultAccountLoader(DataLoader):
+    """
+    Loads the default :py:class:`trading.models.TradingAccount` per profile id
+    (see :py:meth:`authentication.models.Profile.default_acc`)
+    """
+    def batch_load_fn(self, keys):
+        """
+        Fetches the accounts of all profiles with one query
+        """
+        accounts = {}
+        for account in TradingAccount.objects.filter(profile_id__in=keys).order_by('id'):
+            accounts.setdefault(account.profile_id, account)
+        for key in keys:
+            if key not in accounts:
+                accounts[key] = TradingAccount.objects.create(
+                    profile_id=key, account_name='default')
+        return Promise.resolve([accounts[key] for key in keys])
+
+
+class BucketTradeSumLoader(DataLoader):
+    """
+    Loads how much of a bucket an account holds from the
+    :py:class:`trading.models.PositionSnapshot` rows. Keys are
+    (account id, bucket id) tuples.
+    """
+    def batch_load_fn(self, keys):
+        """
+        Reads the held quantities from the position snapshots
+        """
+        quantities = PositionSnapshot.quantities(
+            (account, None, bucket) for (account, bucket) in keys)
+        return Promise.resolve([
+            quantities[(account, None, bucket)] for (account, bucket) in keys
+        ])
+# pylint: enable=method-hidden,no-self-use
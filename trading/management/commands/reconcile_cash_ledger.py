@@ -0,0 +1,44 @@
+"""
+Rebuilds the cash ledgers from the trade history (see
+:py:class:`trading.models.CashLedgerEntry`)
+"""
+from django.core.management.base import BaseCommand
+from trading import valuation
+from trading.models import CashLedgerEntry, TradingAccount
+
+
+class Command(BaseCommand):
+    """
+    Compares the running balance of every account with its trade history and
+    rebuilds the ledger from the trades. Accounts with unvalued entries are
+    always rebuilt.
+    """
+    help = "Rebuilds the cash ledgers from the trade history"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Only report accounts whose balance differs")
+        parser.add_argument(
+            '--account', type=int, action='append', default=None,
+            help="Id of an account to process, can be repeated (default: all)")
+
+    def handle(self, *args, **options):
+        accounts = TradingAccount.objects.order_by('id')
+        if options['account'] is not None:
+            accounts = accounts.filter(id__in=options['account'])
+        drifted = 0
+        for account in accounts:
+            unvalued = account.cash_ledger.filter(amount__isnull=True).count()
+            if options['dry_run']:
+                before = CashLedgerEntry.balance_of(account.id)
+                after = valuation.trading_balance(account)
+            else:
+                (before, after) = CashLedgerEntry.rebuild(account)
+            if unvalued or abs(before - after) > 1e-6:
+                drifted += 1
+                self.stdout.write("account {}: ledger {} trades {}{}".format(
+                    account.id, before, after,
+                    ", {} unvalued entries".format(unvalued) if unvalued else ''))
+        self.stdout.write("{} of {} accounts differed{}".format(
+            drifted, accounts.count(), '' if options['dry_run'] else ', ledgers rebuilt'))
@@ -0,0 +1,132 @@
+"""
+Concurrency stress benchmark for the trade execution path (see
+:py:meth:`trading.models.TradingAccount.execute_order`)
+"""
+import random
+import threading
+import time
+import uuid
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, models
+from stocks.models import DailyStockQuote, InvestmentBucket, Stock
+from trading import valuation
+from trading.models import CashLedgerEntry, TradingAccount
+
+
+class Command(BaseCommand):
+    """
+    Lets several threads trade on one account at the same time and checks
+    afterwards that no update was lost: every position matches its trades,
+    none went negative and the cash ledger matches the trade history.
+    """
+    help = "Runs concurrent orders against one account and verifies the result"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads', type=int, default=8,
+            help="Number of concurrent traders")
+        parser.add_argument(
+            '--orders', type=int, default=50,
+            help="Orders every trader sends")
+        parser.add_argument(
+            '--cash', type=float, default=10000.0,
+            help="Cash the account starts with")
+        parser.add_argument(
+            '--seed', type=int, default=None,
+            help="Seed for the random orders")
+        parser.add_argument(
+            '--keep', action='store_true',
+            help="Keep the benchmark user and its trades")
+
+    def handle(self, *args, **options):
+        stock = Stock.objects.filter(
+            id__in=DailyStockQuote.objects.values('stock_id')).order_by('id').first()
+        if stock is None:
+            raise CommandError("The benchmark needs a stock with quotes")
+        user = User.objects.create_user('trade-benchmark-{}'.format(uuid.uuid4().hex[:8]))
+        try:
+            account = TradingAccount.objects.create(
+                profile=user.profile, account_name='benchmark')
+            bucket = InvestmentBucket.objects.create(
+                name='benchmark', public=False, available=10, owner=user.profile)
+            CashLedgerEntry.append(account.id, options['cash'])
+            (executed, rejected, seconds) = self.run_traders(
+                account.id, [stock, bucket], options)
+            total = executed + sum(rejected.values())
+            self.stdout.write("{} orders in {:.2f}s ({:.1f} orders/s), {} executed".format(
+                total, seconds, total / seconds, executed))
+            for (reason, count) in sorted(rejected.items()):
+                self.stdout.write("{} rejected: {}".format(count, reason))
+            self.verify(account, stock, bucket, options['cash'])
+        finally:
+            if not options['keep']:
+                user.delete()
+
+    @staticmethod
+    def run_traders(account_id, instruments, options):
+        """
+        Runs the traders and returns the number of executed orders, the
+        number of rejected orders per reason and the elapsed seconds
+        """
+        counts = {'executed': 0}
+        lock = threading.Lock()
+        rand = random.Random(options['seed'])
+        seeds = [rand.random() for _ in range(options['threads'])]
+
+        def trader(seed):
+            trader_rand = random.Random(seed)
+            account = TradingAccount.objects.get(id=account_id)
+            try:
+                for _ in range(options['orders']):
+                    legs = [
+                        (instrument, trader_rand.choice([-2, -1, 1, 2]))
+                        for instrument in trader_rand.sample(
+                            instruments, trader_rand.randint(1, len(instruments)))
+                    ]
+                    try:
+                        account.execute_order(legs)
+                        result = 'executed'
+                    except DatabaseError as ex:
+                        # e.g. lock timeouts, these orders didn't test the locking
+                        result = "database error: {}".format(ex)
+                    except Exception as ex:  # pylint: disable=broad-except
+                        result = str(ex)
+                    with lock:
+                        counts[result] = counts.get(result, 0) + 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=trader, args=(seed, )) for seed in seeds]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return (counts.pop('executed'), counts, time.monotonic() - start)
+
+    def verify(self, account, stock, bucket, cash):
+        """
+        Compares the positions and the ledger with the stored trades
+        """
+        errors = []
+        for (trades, position, instrument) in (
+                (account.trades, account.available_stocks(stock), stock),
+                (account.buckettrades, account.available_buckets(bucket), bucket)):
+            traded = trades.aggregate(q_s=models.Sum('quantity'))['q_s'] or 0
+            if position != traded:
+                errors.append("position of {} is {} but trades sum up to {}".format(
+                    instrument.name, position, traded))
+            if position < 0:
+                errors.append("position of {} is negative".format(instrument.name))
+        balance = CashLedgerEntry.balance_of(account.id)
+        expected = cash + valuation.trading_balance(account)
+        if abs(balance - expected) > 1e-6:
+            errors.append("ledger balance is {} but trades give {}".format(balance, expected))
+        entries = account.cash_ledger.count()
+        trades = account.trades.count() + account.buckettrades.count()
+        if entries != trades + 1:
+            errors.append("{} ledger entries for {} trades".format(entries, trades))
+        if errors:
+            raise CommandError("Lost updates: " + "; ".join(errors))
+        self.stdout.write("No lost updates: {} trades, balance {:.2f}".format(trades, balance))
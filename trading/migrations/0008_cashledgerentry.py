@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2026-10-18 14:29
+from __future__ import unicode_literals
+
+from collections import defaultdict
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def fill_ledger(apps, _schema_editor):
+    """
+    Books the existing trades on the ledger of their accounts, valued at
+    their price on the day they happened like trading.valuation.trade_values
+    """
+    cash_ledger_entry = apps.get_model('trading', 'CashLedgerEntry')
+    trade_stock = apps.get_model('trading', 'TradeStock')
+    trade_bucket = apps.get_model('trading', 'TradeBucket')
+    daily_stock_quote = apps.get_model('stocks', 'DailyStockQuote')
+    bucket_daily_value = apps.get_model('stocks', 'BucketDailyValue')
+    quote = models.Subquery(daily_stock_quote.objects.filter(
+        stock=models.OuterRef('stock'), date__lte=models.OuterRef('timestamp'),
+    ).order_by('-date').values('value')[:1], output_field=models.FloatField())
+    holdings = Coalesce(models.Subquery(bucket_daily_value.objects.filter(
+        bucket=models.OuterRef('stock'), date__lte=models.OuterRef('timestamp'),
+    ).order_by('-date').values('holdings')[:1], output_field=models.FloatField()), 0.0)
+    trades = defaultdict(list)
+    for (kind, rows) in (
+            ('trade_stock_id', trade_stock.objects.annotate(price=quote)),
+            ('trade_bucket_id', trade_bucket.objects.annotate(
+                price=holdings + models.F('stock__available')))):
+        for (trade_id, account_id, timestamp, quantity, price) in rows.values_list(
+                'id', 'account_id', 'timestamp', 'quantity', 'price'):
+            if price is not None:
+                trades[account_id].append((timestamp, kind, trade_id, price * (-1 * quantity)))
+    entries = []
+    for (account_id, account_trades) in trades.items():
+        balance = 0.0
+        for (timestamp, kind, trade_id, amount) in sorted(account_trades):
+            balance += amount
+            entries.append(cash_ledger_entry(
+                account_id=account_id, timestamp=timestamp, amount=amount,
+                balance=balance, **{kind: trade_id}))
+    cash_ledger_entry.objects.bulk_create(entries, batch_size=300)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks', '0024_bucketdailyvalue'),
+        ('trading', '0007_auto_20171102_1226'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CashLedgerEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('amount', models.FloatField()),
+                ('balance', models.FloatField()),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cash_ledger', to='trading.TradingAccount')),
+                ('trade_bucket', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='cash_entries', to='trading.TradeBucket')),
+                ('trade_stock', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='cash_entries', to='trading.TradeStock')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='cashledgerentry',
+            index=models.Index(fields=['account', '-id'], name='trading_ledger_balance_idx'),
+        ),
+        migrations.RunPython(fill_ledger, migrations.RunPython.noop),
+    ]
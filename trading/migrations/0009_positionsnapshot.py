@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2026-10-18 14:32
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_positions(apps, _schema_editor):
+    """
+    Sums up the existing trades into their positions
+    """
+    position_snapshot = apps.get_model('trading', 'PositionSnapshot')
+    trade_stock = apps.get_model('trading', 'TradeStock')
+    trade_bucket = apps.get_model('trading', 'TradeBucket')
+    position_snapshot.objects.bulk_create([
+        position_snapshot(account_id=row['account'], stock_id=row['stock'], quantity=row['q_s'])
+        for row in trade_stock.objects.values('account', 'stock').annotate(
+            q_s=models.Sum('quantity'))
+    ] + [
+        position_snapshot(account_id=row['account'], bucket_id=row['stock'], quantity=row['q_s'])
+        for row in trade_bucket.objects.values('account', 'stock').annotate(
+            q_s=models.Sum('quantity'))
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks', '0025_quote_indexes'),
+        ('trading', '0008_cashledgerentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PositionSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.FloatField(default=0.0)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='positions', to='trading.TradingAccount')),
+                ('bucket', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='positions', to='stocks.InvestmentBucket')),
+                ('stock', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='positions', to='stocks.Stock')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='positionsnapshot',
+            unique_together=set([('account', 'stock'), ('account', 'bucket')]),
+        ),
+        migrations.RunPython(fill_positions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.7 on 2026-10-18 16:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trading', '0009_positionsnapshot'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cashledgerentry',
+            name='amount',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -2,8 +2,12 @@
 Models here represents any interaction between a user and stocks
 """
 from authentication.models import Profile
-from django.db import models
-from stocks.models import Stock, InvestmentBucket
+from django.db import IntegrityError, models, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from stocks.models import DataVersion, InvestmentBucket, Stock
+from . import valuation
 
 
 class TradingAccount(models.Model):
@@ -18,69 +22,44 @@ class TradingAccount(models.Model):
 
     def holding_value(self):
         """
-        Calculates the value of all equity held by the user
+        Calculates the value of all equity held by the user (see
+        :py:func:`trading.valuation.positions` for the breakdown)
         """
-        stock_values = sum([
-            Stock.objects.get(id=res['stock']).latest_quote() * res['q_s']
-            for res in
-            self.trades.values('stock').annotate(q_s=models.Sum('quantity'))
-        ])
-        bucket_values = sum([
-            InvestmentBucket.objects.get(id=res['stock']).value_on() * res['q_s']
-            for res in
-            self.buckettrades.values('stock').annotate(q_s=models.Sum('quantity'))
-        ])
-        return stock_values + bucket_values
+        return valuation.holding_value(self)
 
-    def total_value(self):
+    def total_value(self, banks=None):
         """
-        Total value of the trading account
+        Total value of the trading account. The banks of the user can be
+        passed in if they were loaded already.
         """
-        cash = self.available_cash()
+        cash = self.available_cash(banks=banks)
         stock_val = self.holding_value()
         return cash + stock_val
 
     def trading_balance(self):
         """
-        The stock values from account
+        The stock values from account, read from the running balance of the
+        cash ledger (see :py:class:`trading.models.CashLedgerEntry`)
         """
-        stock_val = sum([
-            stock.current_value()
-            for stock
-            in self.trades.all()
-        ])
-        bucket_val = sum([
-            bucket.current_value()
-            for bucket
-            in self.buckettrades.all()
-        ])
-        return stock_val + bucket_val
+        return CashLedgerEntry.balance_of(self.id)
 
     def available_buckets(self, bkt):
         """
         Find the available buckets that have quantity > 0
         """
-        quantity = self.buckettrades.filter(stock=bkt).aggregate(sm=models.Sum('quantity'))['sm']
-        if not quantity:
-            quantity = 0
-        return quantity
+        return PositionSnapshot.quantity_of(self.id, bucket=bkt)
 
     def available_stocks(self, stk):
         """
         Find available stock
         """
-        quantity = self.trades.filter(stock=stk).aggregate(sm=models.Sum('quantity'))['sm']
-        if not quantity:
-            quantity = 0
-        return quantity
+        return PositionSnapshot.quantity_of(self.id, stock=stk)
 
-    def has_enough_cash(self, trade_value):
+    def has_enough_cash(self, trade_value, update=True, banks=None):
         """
         Check if you have enough cash to make a trade
         """
-        if self.available_cash() >= trade_value:
-            return True
-        return False
+        return self.available_cash(update, banks) >= trade_value
 
     def has_enough_bucket(self, bucket, quantity_bucket):
         """
@@ -98,36 +77,70 @@ class TradingAccount(models.Model):
         """
         Creates a new trade for the bucket and this account
         """
-        if self.has_enough_cash(bucket.value_on() * quantity) and (
-                self.has_enough_bucket(bucket, -1 * quantity)):
-            return self.buckettrades.create(
-                stock=bucket,
-                quantity=quantity,
-            )
-        raise Exception("You don't have the necessary resources!")
+        return self.execute_order([(bucket, quantity)])[0]
 
     def trade_stock(self, stock, quantity):
         """
         Trades a stock for the account
         """
-        if self.has_enough_cash(stock.latest_quote().value * quantity) and (
-                self.has_enough_stock(stock, -1 * quantity)):
-            return self.trades.create(
-                quantity=quantity,
-                stock=stock,
-            )
-        raise Exception("You don't have the necessary resources!")
+        return self.execute_order([(stock, quantity)])[0]
+
+    def execute_order(self, legs):
+        """
+        Executes several trades as one order. The account row is locked with
+        select_for_update while the cash and positions are checked and the
+        trades are stored, so concurrent orders of an account run one after
+        the other. Either all legs are executed or none. Stale bank balances
+        are refreshed before the lock is taken, so no remote call runs while
+        it is held.
 
-    def available_cash(self, update=True):
+        :param legs: list of (stock or bucket, quantity) tuples, negative
+            quantities sell.
+        :returns: list of the created trades, one per leg.
         """
-        Returns the available cash for the trading account
+        banks = list(self.profile.user.userbank.all())
+        for bank in banks:
+            bank.current_balance()
+        with transaction.atomic():
+            list(TradingAccount.objects.select_for_update().filter(
+                id=self.id).values_list('id'))
+            cost = 0.0
+            held = {}
+            for (instrument, quantity) in legs:
+                if isinstance(instrument, InvestmentBucket):
+                    price = instrument.value_on()
+                    key = ('bucket', instrument.id)
+                else:
+                    price = instrument.latest_quote().value
+                    key = ('stock', instrument.id)
+                if key not in held:
+                    held[key] = PositionSnapshot.quantity_of(self.id, **{key[0]: instrument})
+                held[key] += quantity
+                if held[key] < 0:
+                    raise Exception("You don't have the necessary resources!")
+                cost += price * quantity
+            if not self.has_enough_cash(cost, update=False, banks=banks):
+                raise Exception("You don't have the necessary resources!")
+            return [
+                self.buckettrades.create(stock=instrument, quantity=quantity)
+                if isinstance(instrument, InvestmentBucket) else
+                self.trades.create(stock=instrument, quantity=quantity)
+                for (instrument, quantity) in legs
+            ]
+
+    def available_cash(self, update=True, banks=None):
+        """
+        Returns the available cash for the trading account. The banks of the
+        user can be passed in if they were loaded already.
         """
+        if banks is None:
+            banks = self.profile.user.userbank.all()
         return (
             self.trading_balance() +
             sum([
                 bnk.current_balance(update)
                 for bnk
-                in self.profile.user.userbank.all()
+                in banks
             ])
         )
 
@@ -164,3 +177,204 @@ class TradeBucket(models.Model):
         """
         val = self.stock.value_on(self.timestamp) * (-1 * self.quantity)
         return val
+
+
+class CashLedgerEntry(models.Model):
+    """
+    One change of the cash of a TradingAccount, e.g. the executed amount of
+    a trade. Entries are only appended, balance is the running total of the
+    account up to and including the entry. The amount of a trade that
+    couldn't be valued is NULL, ``reconcile_cash_ledger`` books it once it
+    can be valued.
+    """
+    account = models.ForeignKey(TradingAccount, related_name='cash_ledger')
+    timestamp = models.DateTimeField(default=timezone.now)
+    amount = models.FloatField(null=True, blank=True)
+    balance = models.FloatField()
+    trade_stock = models.ForeignKey(
+        TradeStock, related_name='cash_entries', null=True, blank=True,
+        on_delete=models.SET_NULL)
+    trade_bucket = models.ForeignKey(
+        TradeBucket, related_name='cash_entries', null=True, blank=True,
+        on_delete=models.SET_NULL)
+
+    class Meta(object):
+        indexes = [
+            models.Index(fields=['account', '-id'], name='trading_ledger_balance_idx'),
+        ]
+
+    @staticmethod
+    def balance_of(account_id):
+        """
+        The current balance of the account, a single row read
+        """
+        balance = CashLedgerEntry.objects.filter(
+            account_id=account_id,
+        ).order_by('-id').values_list('balance', flat=True).first()
+        return balance or 0.0
+
+    @staticmethod
+    def append(account_id, amount, **trade):
+        """
+        Appends an entry to the ledger of the account. The account row is
+        locked while the new balance is computed, so concurrent appends
+        can't build on the same previous balance. An amount of None marks
+        the entry as unvalued and leaves the balance as it is.
+        """
+        with transaction.atomic():
+            list(TradingAccount.objects.select_for_update().filter(
+                id=account_id).values_list('id'))
+            return CashLedgerEntry.objects.create(
+                account_id=account_id,
+                amount=amount,
+                balance=CashLedgerEntry.balance_of(account_id) + (amount or 0.0),
+                **trade
+            )
+
+    @staticmethod
+    def rebuild(account):
+        """
+        Replaces the ledger of the account with one entry per trade, valued
+        from the trade history (see :py:func:`trading.valuation.trade_values`)
+
+        :returns: tuple of the balance before and after the rebuild
+        """
+        with transaction.atomic():
+            list(TradingAccount.objects.select_for_update().filter(
+                id=account.id).values_list('id'))
+            before = CashLedgerEntry.balance_of(account.id)
+            account.cash_ledger.all().delete()
+            balance = 0.0
+            entries = []
+            for trade in valuation.trade_values(account):
+                balance += trade.amount
+                entries.append(CashLedgerEntry(
+                    account=account,
+                    timestamp=trade.timestamp,
+                    amount=trade.amount,
+                    balance=balance,
+                    **{
+                        ('trade_stock_id' if trade.kind == valuation.STOCK
+                         else 'trade_bucket_id'): trade.id
+                    }
+                ))
+            CashLedgerEntry.objects.bulk_create(entries)
+        return (before, balance)
+
+
+class PositionSnapshot(models.Model):
+    """
+    How much of a stock or bucket an account currently holds. The row is
+    updated in the same transaction as every trade, so reading a position
+    doesn't need to sum up the trade history.
+    """
+    account = models.ForeignKey(TradingAccount, related_name='positions')
+    stock = models.ForeignKey(
+        Stock, related_name='positions', null=True, blank=True)
+    bucket = models.ForeignKey(
+        InvestmentBucket, related_name='positions', null=True, blank=True)
+    quantity = models.FloatField(default=0.0)
+
+    class Meta(object):
+        unique_together = (('account', 'stock'), ('account', 'bucket'))
+
+    @staticmethod
+    def quantity_of(account_id, stock=None, bucket=None):
+        """
+        How much of the stock or bucket the account holds, a single row read
+        """
+        quantity = PositionSnapshot.objects.filter(
+            account_id=account_id, stock=stock, bucket=bucket,
+        ).values_list('quantity', flat=True).first()
+        return quantity or 0
+
+    @staticmethod
+    def quantities(keys):
+        """
+        Reads many positions with one query per instrument kind
+
+        :param keys: (account id, stock id, bucket id) tuples where either the
+            stock or the bucket id is None.
+        :returns: dict of key to quantity, 0 for positions never traded.
+        """
+        keys = list(keys)
+        found = {}
+        stock_keys = [key for key in keys if key[1] is not None]
+        bucket_keys = [key for key in keys if key[1] is None]
+        if stock_keys:
+            found.update(
+                ((account_id, stock_id, None), quantity)
+                for (account_id, stock_id, quantity) in PositionSnapshot.objects.filter(
+                    account_id__in=set(key[0] for key in stock_keys),
+                    stock_id__in=set(key[1] for key in stock_keys),
+                ).values_list('account_id', 'stock_id', 'quantity')
+            )
+        if bucket_keys:
+            found.update(
+                ((account_id, None, bucket_id), quantity)
+                for (account_id, bucket_id, quantity) in PositionSnapshot.objects.filter(
+                    account_id__in=set(key[0] for key in bucket_keys),
+                    bucket_id__in=set(key[2] for key in bucket_keys),
+                ).values_list('account_id', 'bucket_id', 'quantity')
+            )
+        return {key: found.get(key) or 0 for key in keys}
+
+    @staticmethod
+    def locked(account_id, stock=None, bucket=None):
+        """
+        Returns the position locked for update until the end of the current
+        transaction, the row is created if the account never traded it
+        """
+        lookup = {'account_id': account_id, 'stock': stock, 'bucket': bucket}
+        try:
+            with transaction.atomic():
+                PositionSnapshot.objects.get_or_create(**lookup)
+        except IntegrityError:
+            # A concurrent trade created the row first
+            pass
+        return PositionSnapshot.objects.select_for_update().get(**lookup)
+
+
+def _executed_amount(trade):
+    """
+    The cash amount of a new trade, None if it can't be valued (e.g. the
+    stock has no quotes yet), so the ledger entry is marked as unvalued
+    """
+    try:
+        return trade.current_value()
+    except Exception:  # pylint: disable=broad-except
+        return None
+
+
+def _move_position(trade, **instrument):
+    """
+    Adds the quantity of a new trade to its position
+    """
+    with transaction.atomic():
+        position = PositionSnapshot.locked(trade.account_id, **instrument)
+        PositionSnapshot.objects.filter(id=position.id).update(
+            quantity=models.F('quantity') + trade.quantity)
+
+
+@receiver(post_save, sender=TradeStock)
+def record_stock_trade(instance, created, **_):
+    """
+    Books the cash and position of a new stock trade
+    """
+    if created:
+        CashLedgerEntry.append(
+            instance.account_id, _executed_amount(instance), trade_stock=instance)
+        _move_position(instance, stock=instance.stock)
+        DataVersion.bump(DataVersion.TRADES)
+
+
+@receiver(post_save, sender=TradeBucket)
+def record_bucket_trade(instance, created, **_):
+    """
+    Books the cash and position of a new bucket trade
+    """
+    if created:
+        CashLedgerEntry.append(
+            instance.account_id, _executed_amount(instance), trade_bucket=instance)
+        _move_position(instance, bucket=instance.stock)
+        DataVersion.bump(DataVersion.TRADES)
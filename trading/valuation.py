@@ -0,0 +1,121 @@
+"""
+Portfolio valuation for trading accounts. Positions and trade values are
+aggregated in the database with the matching price joined in through a
+subquery, so valuing an account takes a constant number of queries no matter
+how many stocks and buckets it holds.
+"""
+from collections import namedtuple
+import datetime
+from django.db.models import F, FloatField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from stocks.models import BucketDailyValue, DailyStockQuote
+
+Position = namedtuple(
+    "Position",
+    ["kind", "id", "name", "quantity", "price", "value"],
+)
+
+TradeValue = namedtuple(
+    "TradeValue",
+    ["kind", "id", "timestamp", "amount"],
+)
+
+STOCK = 'stock'
+BUCKET = 'bucket'
+
+
+def _quote_on(date):
+    """
+    Latest quote value of the outer stock on or before date
+    """
+    return Subquery(DailyStockQuote.objects.filter(
+        stock=OuterRef('stock'), date__lte=date,
+    ).order_by('-date').values('value')[:1], output_field=FloatField())
+
+
+def _holdings_on(date):
+    """
+    Latest materialized holdings of the outer bucket on or before date
+    """
+    return Coalesce(Subquery(BucketDailyValue.objects.filter(
+        bucket=OuterRef('stock'), date__lte=date,
+    ).order_by('-date').values('holdings')[:1], output_field=FloatField()), 0.0)
+
+
+def positions(account):
+    """
+    Returns the current positions of the account as a list of Position. Stocks
+    without any quote have no price and a value of 0, stocks and buckets that
+    were sold completely are left out. Both kinds of positions are loaded with
+    one query each.
+    """
+    today = datetime.datetime.now().date()
+    stocks = account.trades.values('stock').annotate(
+        quantity=Sum('quantity'),
+        name=F('stock__name'),
+        price=_quote_on(today),
+    ).exclude(quantity=0).order_by('stock')
+    buckets = account.buckettrades.values('stock').annotate(
+        quantity=Sum('quantity'),
+        name=F('stock__name'),
+        holdings=_holdings_on(today),
+        available=F('stock__available'),
+    ).exclude(quantity=0).order_by('stock')
+    return [
+        Position(
+            kind=STOCK,
+            id=row['stock'],
+            name=row['name'],
+            quantity=row['quantity'],
+            price=row['price'],
+            value=row['price'] * row['quantity'] if row['price'] is not None else 0.0,
+        )
+        for row in stocks
+    ] + [
+        Position(
+            kind=BUCKET,
+            id=row['stock'],
+            name=row['name'],
+            quantity=row['quantity'],
+            price=row['holdings'] + row['available'],
+            value=(row['holdings'] + row['available']) * row['quantity'],
+        )
+        for row in buckets
+    ]
+
+
+def holding_value(account):
+    """
+    Value of all positions of the account
+    """
+    return sum(position.value for position in positions(account))
+
+
+def trade_values(account):
+    """
+    Values every trade of the account at its price on the day it happened,
+    with two queries for all trades. Trades that can't be valued are left
+    out.
+
+    :returns: list of TradeValue ordered by timestamp
+    """
+    stock_trades = account.trades.annotate(
+        price=_quote_on(OuterRef('timestamp')),
+    ).values_list('id', 'timestamp', 'quantity', 'price')
+    bucket_trades = account.buckettrades.annotate(
+        price=_holdings_on(OuterRef('timestamp')) + F('stock__available'),
+    ).values_list('id', 'timestamp', 'quantity', 'price')
+    return sorted([
+        TradeValue(kind, trade_id, timestamp, price * (-1 * quantity))
+        for (kind, trades) in ((STOCK, stock_trades), (BUCKET, bucket_trades))
+        for (trade_id, timestamp, quantity, price) in trades
+        if price is not None
+    ], key=lambda trade: (trade.timestamp, trade.kind, trade.id))
+
+
+def trading_balance(account):
+    """
+    The cash that went into or came out of the account through trades,
+    computed from the trade history
+    """
+    return sum(trade.amount for trade in trade_values(account))